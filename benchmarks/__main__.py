@@ -0,0 +1,179 @@
+"""
+Runs the benchmark suite and stores the results as json for comparisons across commits.
+
+Usage: python -m benchmarks [-k filter] [--output file] [--compare file]
+"""
+
+import argparse
+import asyncio
+import gc
+import importlib
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+from inspect import iscoroutinefunction
+from pathlib import Path
+from typing import Callable, Dict
+
+from benchmarks.common import registry, get_loop
+
+# The modules containing benchmarks
+MODULES = ["bench_routing", "bench_answer", "bench_session", "bench_context", "bench_storage", "bench_memory"]
+
+RESULTS = Path(__file__).parent / "results"
+
+
+async def _time(func: Callable, number: int) -> float:
+    """
+    Measures the total time of several calls
+    :param func: The function to be timed
+    :param number: The number of calls
+    :return: The elapsed time in seconds
+    """
+
+    if iscoroutinefunction(func):
+        start = time.perf_counter()
+        for _ in range(number):
+            await func()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return time.perf_counter() - start
+
+
+async def measure(setup: Callable, kwargs: Dict, rounds: int, min_time: float) -> Dict:
+    """
+    Creates the timed function, calibrates the number of calls per round and measures several rounds.
+    Everything runs inside one task, so setup and calls share the async context.
+    :param setup: The benchmark's setup function
+    :param kwargs: The parameters for the setup function
+    :param rounds: The number of rounds
+    :param min_time: The minimal duration of a round in seconds
+    :return: The statistics in seconds per call
+    """
+
+    func = setup(**kwargs)
+
+    number = 1
+    while await _time(func, number) < min_time:
+        number *= 2
+
+    times = [await _time(func, number) / number for _ in range(rounds)]
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "stddev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "number": number,
+        "rounds": rounds,
+    }
+
+
+async def measure_memory(setup: Callable, kwargs: Dict) -> Dict:
+    """
+    Measures the memory held by the objects a benchmark creates
+    :param setup: The benchmark's setup function
+    :param kwargs: The parameters for the setup function
+    :return: The statistics in bytes
+    """
+
+    count, create = setup(**kwargs)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        objects = await create() if iscoroutinefunction(create) else create()
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+    del objects
+    return {"bytes": size, "count": count, "per_item": size / count}
+
+
+def _commit() -> str:
+    """
+    Determines the current commit to name the results
+    :return: The abbreviated hash or unknown
+    """
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _format(seconds: float) -> str:
+    for unit, factor in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= factor:
+            return f"{seconds / factor:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the SAMT benchmark suite")
+    parser.add_argument("-k", dest="filter", default="", help="Only run benchmarks containing this string")
+    parser.add_argument("--rounds", type=int, default=5, help="The number of measured rounds")
+    parser.add_argument("--min-time", type=float, default=0.05, help="The minimal duration of a round in seconds")
+    parser.add_argument("--output", type=Path, help="The result file, defaults to results/<commit>.json")
+    parser.add_argument("--compare", type=Path, help="A previous result file to compare against")
+    args = parser.parse_args()
+
+    for module in MODULES:
+        importlib.import_module(f"benchmarks.{module}")
+
+    previous = json.loads(args.compare.read_text())["results"] if args.compare else {}
+
+    loop = get_loop()
+    results = {}
+    for bench in registry:
+        for name, kwargs in bench.variants():
+            if args.filter not in name:
+                continue
+
+            if bench.kind == "memory":
+                stats = loop.run_until_complete(loop.create_task(measure_memory(bench.setup, kwargs)))
+                key, value = "per_item", f"{stats['per_item']:.0f} B/item"
+            elif bench.kind == "size":
+                stats = {"bytes": bench.setup(**kwargs)}
+                key, value = "bytes", f"{stats['bytes']} B"
+            else:
+                stats = loop.run_until_complete(loop.create_task(
+                    measure(bench.setup, kwargs, args.rounds, args.min_time)))
+                key, value = "median", _format(stats["median"])
+            results[name] = stats
+
+            line = f"{name:<60} {value:>12}"
+            if name in previous:
+                line += f"  {stats[key] / previous[name][key]:6.2f}x"
+            print(line)
+
+    # End tasks the benchmarks left running, e.g. the listeners of storages
+    pending = asyncio.all_tasks(loop)
+    for task in pending:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
+    commit = _commit()
+    output = args.output or RESULTS / f"{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "results": results
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Building answers: message resolution, media commands, keyboards and languages
+"""
+
+import io
+
+from samt.helper import User, Media, _user
+from samt.samt import Answer
+from benchmarks.common import benchmark, configure, MockBot, new_session
+
+LANGUAGE = {
+    "default": {"greeting": "Hello {}, how can I help you?"},
+    "de": {"greeting": "Hallo {}, wie kann ich helfen?"},
+}
+
+
+@benchmark("answer.msg", text=["plain", "photo", "document_caption"])
+def answer_msg(text: str):
+    configure()
+    msg = {
+        "plain": "Hello there, how can I help you?",
+        "photo": "photo:picture.jpg",
+        "document_caption": "document:report.pdf;The monthly report",
+    }[text]
+
+    def run():
+        # The property memorizes the media type, so a fresh answer is needed
+        return Answer(msg).msg
+
+    return run
+
+
+@benchmark("answer.get_config", keyboard=["none", "choices", "choices_tuples", "reply_keyboard"], buttons=[4, 32])
+def answer_get_config(keyboard: str, buttons: int):
+    configure()
+    labels = [f"Option {i}" for i in range(buttons)]
+    kwargs = {
+        "none": {},
+        "choices": {"choices": labels},
+        "choices_tuples": {"choices": [(label, str(i)) for i, label in enumerate(labels)]},
+        "reply_keyboard": {"keyboard": labels},
+    }[keyboard]
+
+    def run():
+        # The choices get aligned in place, so a fresh answer is needed
+        return Answer("Choose", **kwargs)._get_config()
+
+    return run
+
+
+@benchmark("answer.apply_language", language=["de", "fr"], formatted=[True, False])
+def answer_apply_language(language: str, formatted: bool):
+    configure({"bot": {"token": "123456:BENCHMARK", "language_feature": True}}, LANGUAGE)
+    _user.set(User({"id": 1, "first_name": "User", "language_code": language}))
+    answer = Answer("greeting", "User") if formatted else Answer("greeting")
+
+    def run():
+        return answer._apply_language()
+
+    return run
+
+
+@benchmark("answer.send", media=["text", "photo", "keyboard"], compiled=[False, True])
+def answer_send(media: str, compiled: bool):
+    configure()
+    bot = MockBot()
+    session = new_session(bot, 1)
+    picture = io.BytesIO(b"picture")
+    source = {
+        "text": lambda: Answer("Hello there, how can I help you?"),
+        "photo": lambda: Answer(media_type=Media.PHOTO, media=("picture.jpg", picture), caption="A picture"),
+        "keyboard": lambda: Answer("Choose", choices=[f"Option {i}" for i in range(8)]),
+    }[media]
+    answer = source().compile()
+
+    async def run():
+        # Without compiling, every send starts with a fresh answer as a handler would create
+        return await (answer if compiled else source())._send(session)
+
+    return run
@@ -0,0 +1,46 @@
+"""
+The async context: looking up values with Context and spawning tasks, which inherit the context
+"""
+
+import asyncio
+
+from samt.helper import Context
+from benchmarks.common import benchmark, configure, MockBot, new_session, user_message
+
+
+def _prepare(session) -> None:
+    """
+    Fills the context as it is during the handling of a message
+    :param session: The session handling the message
+    """
+
+    session.storage["counter"] = 1
+    session._prepare_context(user_message(1000, "/start"))
+
+
+@benchmark("context.get", key=["user", "storage", "missing"])
+def context_get(key: str):
+    configure()
+    _prepare(new_session(MockBot(), 1000))
+
+    key = {"user": "user", "storage": "counter", "missing": "unknown"}[key]
+
+    def run():
+        return Context.get(key)
+
+    return run
+
+
+@benchmark("context.spawn_task")
+def context_spawn_task():
+    configure()
+    _prepare(new_session(MockBot(), 1000))
+
+    async def child():
+        return Context.user()
+
+    async def run():
+        # Every task created during the handling of a message inherits its context
+        return await asyncio.ensure_future(child())
+
+    return run
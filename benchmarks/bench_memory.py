@@ -0,0 +1,33 @@
+"""
+The memory held per session and per received or sent message
+"""
+
+from collections import deque
+
+from samt.helper import User, Message
+from benchmarks.common import memory_benchmark, configure, MockBot, new_session, user_message
+
+SESSIONS = 100000
+
+
+@memory_benchmark("memory.records", count=[SESSIONS])
+def records(count: int):
+    messages = [user_message(1000 + i, f"Message {i}", message_id=i) for i in range(count)]
+
+    def create():
+        # A user, the incoming message and a full history of ten sent messages per session
+        return [(User(msg["from"]), Message(msg), deque((Message(msg) for _ in range(10)), maxlen=10))
+                for msg in messages]
+
+    return count, create
+
+
+@memory_benchmark("memory.sessions", count=[SESSIONS])
+def sessions(count: int):
+    configure()
+    bot = MockBot()
+
+    def create():
+        return [new_session(bot, 1000 + i) for i in range(count)]
+
+    return count, create
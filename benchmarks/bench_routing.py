@@ -0,0 +1,90 @@
+"""
+Lookups in the routing dictionaries depending on the number of registered routes and calls of cached routes
+"""
+
+from samt.helper import RegExDict, ParsingDict, CommandDict
+from samt.samt import Answer, _RouteCache
+from benchmarks.common import benchmark
+
+ROUTE_COUNTS = [1, 10, 100, 1000]
+
+
+@benchmark("routing.regex", routes=ROUTE_COUNTS, hit=[True, False])
+def regex_lookup(routes: int, hit: bool):
+    routing = RegExDict()
+    for i in range(routes):
+        routing[rf"/command{i} (?P<value>\d+)"] = i
+
+    # Alternate between two texts to bypass the single entry cache
+    texts = [f"/command{routes - 1} {i}" if hit else f"/unknown {i}" for i in range(2)]
+
+    def run():
+        for text in texts:
+            if text in routing:
+                routing[text]
+
+    return run
+
+
+@benchmark("routing.parse", routes=ROUTE_COUNTS, hit=[True, False])
+def parse_lookup(routes: int, hit: bool):
+    routing = ParsingDict()
+    for i in range(routes):
+        routing[f"/command{i} {{value:d}}"] = i
+
+    texts = [f"/command{routes - 1} {i}" if hit else f"/unknown {i}" for i in range(2)]
+
+    def run():
+        for text in texts:
+            if text in routing:
+                routing[text]
+
+    return run
+
+
+@benchmark("routing.command", routes=ROUTE_COUNTS, hit=[True, False])
+def command_lookup(routes: int, hit: bool):
+    routing = CommandDict()
+    routing.username = "benchbot"
+
+    def handler(value):
+        pass
+
+    for i in range(routes):
+        routing[f"/command{i}"] = handler
+
+    texts = [f"/Command{routes - 1}@BenchBot {i}" if hit else f"/unknown {i}" for i in range(2)]
+
+    def run():
+        for text in texts:
+            if text in routing:
+                routing[text]
+
+    return run
+
+
+@benchmark("routing.simple", routes=ROUTE_COUNTS)
+def simple_lookup(routes: int):
+    routing = {f"/command{i}": i for i in range(routes)}
+    texts = [f"/command{routes - 1}", "/unknown"]
+
+    def run():
+        for text in texts:
+            if text in routing:
+                routing[text]
+
+    return run
+
+
+@benchmark("routing.cached", cached=[False, True])
+def cached_route(cached: bool):
+    # A handler building a listing, as /help or /prices would
+    def handler():
+        return Answer("\n".join(f"Item {i}: {i * 1.19:.2f} EUR" for i in range(100)), choices=["Buy", "Cancel"])
+
+    cache = _RouteCache(None, handler, ttl=60)
+
+    async def run():
+        return await cache() if cached else handler()
+
+    return run
@@ -0,0 +1,60 @@
+"""
+The lifecycle of a session: creation with and without persistent storage and the answering of messages
+"""
+
+import atexit
+import os
+import tempfile
+
+from tinydb import TinyDB
+
+from samt.samt import _Session, Answer
+from samt.helper import User, Message, _user, _message, _init_message, _storage
+from benchmarks.common import benchmark, configure, MockBot, new_session, user_message
+
+
+@benchmark("session.init", storage=["none", "tinydb"], users=[100, 1000])
+def session_init(storage: str, users: int):
+    configure()
+    bot = MockBot()
+
+    if storage == "tinydb":
+        handle, name = tempfile.mkstemp(suffix=".json")
+        os.close(handle)
+        atexit.register(os.remove, name)
+
+        _Session.database = TinyDB(name)
+        _Session.database.insert_multiple({"user": 1000 + i, "storage": {"counter": i}} for i in range(users))
+
+    ids = iter(range(1 << 62))
+
+    def run():
+        # Cycle through the known users, so the database does not grow
+        return new_session(bot, 1000 + next(ids) % users)
+
+    return run
+
+
+@benchmark("session.prepare_answer", answer=["string", "tuple", "answers", "keyboard"])
+def session_prepare_answer(answer: str):
+    configure()
+    session = new_session(MockBot(), 1000)
+
+    msg = user_message(1000, "/start")
+    _user.set(User(msg["from"]))
+    _message.set(Message(msg))
+    _init_message.set(Message(msg))
+    _storage.set(session.storage)
+
+    def create():
+        return {
+            "string": lambda: "Hello there",
+            "tuple": lambda: ("Hello {}", "there"),
+            "answers": lambda: [Answer("First"), Answer("Second"), Answer("Third")],
+            "keyboard": lambda: Answer("Choose", keyboard=["Yes", "No", "Maybe"]),
+        }[answer]()
+
+    async def run():
+        await session.prepare_answer(create())
+
+    return run
@@ -0,0 +1,123 @@
+"""
+The persistent storage: serializing records in the available formats and reading and writing records of a RedisStore
+against the local stand-in server
+"""
+
+import itertools
+from datetime import datetime, timedelta
+
+from samt.fakeredis import FakeRedisServer
+from samt.serializers import Codec, available_formats, zstandard
+from samt.storage import RedisStore
+from benchmarks.common import benchmark, size_benchmark
+
+USERS = 1000
+
+FORMATS = available_formats()
+COMPRESSIONS = ["none", "zlib"] + (["zstd"] if zstandard is not None else [])
+
+
+def _record(size: str) -> dict:
+    """
+    Creates a user's storage as a bot might keep it
+    :param size: Either small for a few settings or large for a long history in addition
+    :return: The storage
+    """
+
+    record = {
+        "language": "de",
+        "name": "Ann",
+        "counter": 42,
+        "settings": {"notifications": True, "timezone": "Europe/Berlin", "units": "metric"},
+        "last_seen": datetime(2026, 10, 1, 12, 30),
+        "visited": {"start", "help", "settings"},
+    }
+
+    if size == "large":
+        start = datetime(2026, 1, 1)
+        record["history"] = [{"id": i, "text": f"Reminder {i}: buy milk and bread on the way home",
+                              "sent": start + timedelta(minutes=17 * i), "read": i % 3 == 0} for i in range(500)]
+        record["favorites"] = set(range(0, 1000, 7))
+        record["notes"] = {f"note{i}": "Remember to ask about the weekend plans. " * 3 for i in range(50)}
+
+    return record
+
+
+def _codec(format: str, compression: str) -> Codec:
+    return Codec(format, None if compression == "none" else compression)
+
+
+@benchmark("storage.encode", format=FORMATS, compression=COMPRESSIONS, record=["small", "large"])
+def storage_encode(format: str, compression: str, record: str):
+    codec = _codec(format, compression)
+    record = _record(record)
+
+    def run():
+        return codec.dumps(record)
+
+    return run
+
+
+@benchmark("storage.decode", format=FORMATS, compression=COMPRESSIONS, record=["small", "large"])
+def storage_decode(format: str, compression: str, record: str):
+    codec = _codec(format, compression)
+    data = codec.dumps(_record(record))
+
+    def run():
+        return codec.loads(data)
+
+    return run
+
+
+@size_benchmark("storage.size", format=FORMATS, compression=COMPRESSIONS, record=["small", "large"])
+def storage_size(format: str, compression: str, record: str):
+    return len(_codec(format, compression).dumps(_record(record)))
+
+
+_server = FakeRedisServer(port=6390)
+_started = False
+
+# The stores are kept until the end, so their listeners are cancelled with the loop
+_stores = []
+
+
+async def _start() -> None:
+    """
+    Starts the stand-in server on first use, as the benchmarks are set up inside the running loop
+    """
+
+    global _started
+    if not _started:
+        await _server.start()
+        _started = True
+
+
+@benchmark("storage.load", cached=[True, False], keys=[1, 2])
+def storage_load(cached: bool, keys: int):
+    # Without cache every load misses and takes a round trip to the server
+    store = RedisStore(_server.url, prefix="bench:load:", cache_size=USERS if cached else 1)
+    _stores.append(store)
+    ids = itertools.cycle(range(1000, 1000 + USERS))
+
+    async def run():
+        await _start()
+        return await store.load(*itertools.islice(ids, keys))
+
+    return run
+
+
+@benchmark("storage.write", batch=[1, 100])
+def storage_write(batch: int):
+    store = RedisStore(_server.url, prefix="bench:write:")
+    _stores.append(store)
+    ids = itertools.cycle(range(1000, 1000 + USERS))
+
+    async def run():
+        await _start()
+        for user in itertools.islice(ids, batch):
+            record, = await store.load(user)
+            record["counter"] = record.get("counter", 0) + 1
+            store.put(user, record)
+        await store.flush()
+
+    return run
@@ -0,0 +1,156 @@
+"""
+Shared helpers for the benchmarks, which allow using the framework without a configuration file or network access
+"""
+
+import asyncio
+import itertools
+import time
+from typing import Callable, Dict, List
+
+import telepot.aio
+
+import samt.samt
+
+# All registered benchmarks in the order of their definition
+registry: List["Benchmark"] = []
+
+
+class Benchmark:
+    """
+    A single benchmark, which creates the timed function for every combination of parameters
+    """
+
+    def __init__(self, name: str, setup: Callable, params: Dict[str, list], kind: str = "time"):
+        self.name = name
+        self.setup = setup
+        self.params = params
+        self.kind = kind
+
+    def variants(self):
+        """
+        Yields the name and the parameters of every combination of parameters
+        """
+
+        keys = list(self.params)
+        for values in itertools.product(*(self.params[key] for key in keys)):
+            kwargs = dict(zip(keys, values))
+            suffix = ",".join(f"{key}={value}" for key, value in kwargs.items())
+            yield (f"{self.name}[{suffix}]" if suffix else self.name), kwargs
+
+
+def benchmark(name: str = None, **params: list) -> Callable:
+    """
+    Registers a setup function, which returns the function to be timed. It may be a coroutine function, which will then
+    be awaited inside a task of the framework's async context.
+    :param name: The name of the benchmark, defaults to the setup function's name
+    :param params: Lists of values for each keyword parameter of the setup function
+    :return: The decorator
+    """
+
+    def decorator(setup: Callable) -> Callable:
+        registry.append(Benchmark(name or setup.__name__, setup, params))
+        return setup
+
+    return decorator
+
+
+def memory_benchmark(name: str = None, **params: list) -> Callable:
+    """
+    Registers a setup function, which returns the number of items and a function creating them. The memory held by the
+    created objects is measured.
+    :param name: The name of the benchmark, defaults to the setup function's name
+    :param params: Lists of values for each keyword parameter of the setup function
+    :return: The decorator
+    """
+
+    def decorator(setup: Callable) -> Callable:
+        registry.append(Benchmark(name or setup.__name__, setup, params, kind="memory"))
+        return setup
+
+    return decorator
+
+
+def size_benchmark(name: str = None, **params: list) -> Callable:
+    """
+    Registers a function, which returns a size in bytes to be reported instead of a time
+    :param name: The name of the benchmark, defaults to the function's name
+    :param params: Lists of values for each keyword parameter of the function
+    :return: The decorator
+    """
+
+    def decorator(setup: Callable) -> Callable:
+        registry.append(Benchmark(name or setup.__name__, setup, params, kind="size"))
+        return setup
+
+    return decorator
+
+
+def configure(config: Dict = None, language: Dict = None) -> None:
+    """
+    Configures the framework as if it was loaded from a configuration file
+    :param config: The configuration dictionary
+    :param language: The language dictionary
+    """
+
+    samt.samt._config = config or {"bot": {"token": "123456:BENCHMARK"}}
+    samt.samt.Answer._load_defaults(language)
+    samt.samt._Session._load_defaults()
+    samt.samt._Session.database = None
+
+
+class MockBot(telepot.aio.DelegatorBot):
+    """
+    A telepot bot which answers every api call locally with a plausible message
+    """
+
+    def __init__(self):
+        super().__init__("123456:BENCHMARK", [])
+        self._message_ids = itertools.count(1)
+
+    async def _api_request(self, method, params=None, files=None, **kwargs):
+        params = params or {}
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": params.get("chat_id"), "type": "private"},
+            "text": params.get("text"),
+        }
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the event loop telepot is bound to
+    :return: The event loop
+    """
+
+    return asyncio.get_event_loop()
+
+
+def user_message(user_id: int, text: str, message_id: int = 1, language_code: str = "en") -> Dict:
+    """
+    Creates a message as telepot delivers it
+    :param user_id: The sender's id
+    :param text: The message's text
+    :param message_id: The message's id
+    :param language_code: The sender's language code
+    :return: The message as dictionary
+    """
+
+    return {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "from": {"id": user_id, "is_bot": False, "first_name": "User", "language_code": language_code},
+        "chat": {"id": user_id, "type": "private"},
+        "text": text,
+    }
+
+
+def new_session(bot: telepot.aio.Bot, user_id: int) -> "samt.samt._Session":
+    """
+    Creates a session in the way the delegator bot would
+    :param bot: The bot to be used by the session
+    :param user_id: The id of the session's user
+    :return: The session
+    """
+
+    return samt.samt._Session((bot, user_message(user_id, "/start"), user_id), event_space=0, timeout=3600)
@@ -0,0 +1,100 @@
+"""
+Compares the memory of running several bots in one process with running every bot in a process of its own.
+
+Usage: python -m benchmarks.multibot --bots 10
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+from samt.fakeapi import FakeTelegramServer
+from samt.loadtest import _rss
+
+# A bot script, which runs the bots with the given indices in one process
+SCRIPT = '''
+import sys
+from samt import Bot
+
+bots = []
+for i in map(int, sys.argv[1:]):
+    bot = Bot({{"general": {{"logging": "error"}}, "bot": {{"token": f"{{i}}:MULTIBOT", "api_url": "{url}"}}}})
+
+    @bot.answer("/start")
+    def start(i=i):
+        return f"Bot {{i}}"
+
+    bots.append(bot)
+
+Bot.listen_all(*bots)
+'''
+
+
+async def measure(bots: int, settle: float, server: FakeTelegramServer) -> Dict[str, int]:
+    """
+    Starts the bots both ways and measures the resident set size of the processes
+    :param bots: The number of bots
+    :param settle: The seconds to wait after the bots started polling
+    :param server: The fake server the bots poll
+    :return: The total size in bytes of each setup
+    """
+
+    await server.start()
+
+    with tempfile.TemporaryDirectory(prefix="samt-multibot-") as folder:
+        script = Path(folder) / "Bot.py"
+        script.write_text(SCRIPT.format(url=server.url))
+
+        # Make this very checkout importable for the bots
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(Path(__file__).parent.parent), env.get("PYTHONPATH")]))
+
+        async def run(groups: List[List[int]]) -> int:
+            server.polled.clear()
+            processes = [subprocess.Popen([sys.executable, str(script), *map(str, group)], cwd=folder, env=env)
+                         for group in groups]
+            try:
+                await asyncio.wait_for(server.polled.wait(), 30)
+                await asyncio.sleep(settle)
+                return sum(_rss(process.pid) or 0 for process in processes)
+            finally:
+                for process in processes:
+                    process.send_signal(signal.SIGINT)
+                for process in processes:
+                    try:
+                        process.wait(5)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+
+        try:
+            separate = await run([[i] for i in range(bots)])
+            shared = await run([list(range(bots))])
+        finally:
+            await server.stop()
+
+    return {"bots": bots, "separate": separate, "shared": shared}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the memory of bots in one process and in separate ones")
+    parser.add_argument("--bots", type=int, default=10, help="The number of bots")
+    parser.add_argument("--settle", type=float, default=2, help="Seconds to wait before measuring")
+    parser.add_argument("--port", type=int, default=8081, help="The port of the fake server")
+    args = parser.parse_args()
+
+    report = asyncio.run(measure(args.bots, args.settle, FakeTelegramServer(port=args.port)))
+
+    print(f"One process per bot:  {report['separate'] / 2 ** 20:.1f} MiB "
+          f"({report['separate'] / report['bots'] / 2 ** 20:.1f} MiB per bot)")
+    print(f"All bots in one process: {report['shared'] / 2 ** 20:.1f} MiB "
+          f"({report['shared'] / report['bots'] / 2 ** 20:.1f} MiB per bot)")
+
+
+if __name__ == "__main__":
+    main()
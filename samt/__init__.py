@@ -1,2 +1,2 @@
-from .samt import Bot, Answer, logger
+from .samt import Bot, Answer, Stream, logger
 from .helper import *
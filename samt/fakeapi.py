@@ -0,0 +1,397 @@
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from collections import defaultdict, deque
+from typing import Dict, Callable, List, Any, Optional
+
+from aiohttp import web, ClientSession
+
+logger = logging.getLogger(__name__)
+
+
+class FakeTelegramServer:
+    """
+    A local stand-in for the Telegram Bot API, which allows running bots offline for testing and load measurements.
+    Bots are pointed to it by setting the configuration key api_url in the section bot.
+    """
+
+    # The methods which count as sending and are therefore subject to latency and flood injection
+    sending_methods = ("sendMessage", "sendPhoto", "sendDocument", "sendSticker", "sendVoice", "sendAudio",
+                       "sendVideo", "sendMediaGroup", "editMessageText", "answerCallbackQuery",
+                       "answerInlineQuery")
+
+    # The methods which carry a file and the key of the result
+    file_methods = {
+        "sendPhoto": "photo",
+        "sendDocument": "document",
+        "sendSticker": "sticker",
+        "sendVoice": "voice",
+        "sendAudio": "audio",
+        "sendVideo": "video",
+    }
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081, latency: float = 0.0, jitter: float = 0.0,
+                 flood_ratio: float = 0.0, retry_after: int = 1):
+        """
+        Initializes the server without starting it
+        :param host: The interface to bind to
+        :param port: The port to listen on
+        :param latency: The artificial delay of every sending method in seconds
+        :param jitter: The maximal random addition to the latency in seconds
+        :param flood_ratio: The probability of a sending method to be rejected with 429 Too Many Requests
+        :param retry_after: The retry_after value reported on an injected 429
+        """
+
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_ratio = flood_ratio
+        self.retry_after = retry_after
+
+        # The pending updates and their signal for waiting long polls
+        self.updates: deque = deque()
+        self._update_event = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = defaultdict(lambda: itertools.count(1))
+        self._file_ids = itertools.count(1)
+
+        # Set when the bot polled for the first time
+        self.polled = asyncio.Event()
+
+        # The content of files available for download, keyed by their path
+        self.files: Dict[str, bytes] = {}
+
+        self.webhook: Optional[str] = None
+        self._client: Optional[ClientSession] = None
+
+        # Every successful call as tuple of time, method, and parameters
+        self.calls: List[tuple] = []
+        self.rejected = 0
+        self.listeners: List[Callable[[str, Dict, Any], None]] = []
+
+        self.me = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "FakeBot"}
+
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        """
+        The base url to be used as api_url in the configuration
+        """
+
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        """
+        Starts the web server on the current event loop
+        """
+
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._dispatch)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._download)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Fake Bot API listening on {self.url}")
+
+    async def stop(self) -> None:
+        """
+        Stops the web server and closes the webhook connection
+        """
+
+        if self._client is not None:
+            await self._client.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def push_update(self, update: Dict) -> int:
+        """
+        Enqueues an update for the bot or pushes it to the webhook, if one is set
+        :param update: The update without an update_id
+        :return: The assigned update_id
+        """
+
+        update["update_id"] = next(self._update_ids)
+
+        if self.webhook is not None:
+            asyncio.ensure_future(self._push_webhook(update))
+        else:
+            self.updates.append(update)
+            self._update_event.set()
+
+        return update["update_id"]
+
+    def push_message(self, user_id: int, text: str, first_name: str = "User", language_code: str = "en",
+                     chat_type: str = "private", chat_id: int = None, **extra) -> int:
+        """
+        Enqueues a text message as if it was sent by a user
+        :param user_id: The id of the sending user
+        :param text: The message's text
+        :param first_name: The sender's name
+        :param language_code: The sender's language code
+        :param chat_type: The type of the chat the message was sent in
+        :param chat_id: The chat's id, defaults to the user's id
+        :param extra: Additional fields of the message, e.g. a sticker
+        :return: The assigned update_id
+        """
+
+        chat_id = user_id if chat_id is None else chat_id
+        message = {
+            "message_id": next(self._message_ids[chat_id]),
+            "date": int(time.time()),
+            "from": {"id": user_id, "is_bot": False, "first_name": first_name, "language_code": language_code},
+            "chat": {"id": chat_id, "type": chat_type, "first_name": first_name},
+        }
+        if text is not None:
+            message["text"] = text
+        message.update(extra)
+
+        return self.push_update({"message": message})
+
+    def add_file(self, content: bytes, file_name: str = None) -> Dict:
+        """
+        Stores a file, which the bot can download afterwards
+        :param content: The file's content
+        :param file_name: The file's name
+        :return: The file's information as it is embedded into a message, e.g. as document
+        """
+
+        file_id = f"file{next(self._file_ids)}"
+        self.files[file_id] = content
+
+        media = {"file_id": file_id, "file_unique_id": file_id, "file_size": len(content)}
+        if file_name is not None:
+            media["file_name"] = file_name
+        return media
+
+    def push_callback_query(self, user_id: int, message_id: int, data: str, first_name: str = "User") -> int:
+        """
+        Enqueues a callback query as if a user pressed an inline button
+        :param user_id: The id of the pressing user
+        :param message_id: The id of the message carrying the keyboard
+        :param data: The callback data of the button
+        :param first_name: The user's name
+        :return: The assigned update_id
+        """
+
+        sender = {"id": user_id, "is_bot": False, "first_name": first_name, "language_code": "en"}
+        return self.push_update({"callback_query": {
+            "id": str(next(self._file_ids)),
+            "from": sender,
+            "data": data,
+            "chat_instance": str(user_id),
+            "message": {"message_id": message_id, "date": int(time.time()), "from": self.me,
+                        "chat": {"id": user_id, "type": "private"}},
+        }})
+
+    def push_inline_query(self, user_id: int, query: str, offset: str = "", first_name: str = "User") -> int:
+        """
+        Enqueues an inline query as if a user typed in the message field
+        :param user_id: The id of the typing user
+        :param query: The text of the query
+        :param offset: The offset of the requested page
+        :param first_name: The user's name
+        :return: The assigned update_id
+        """
+
+        sender = {"id": user_id, "is_bot": False, "first_name": first_name, "language_code": "en"}
+        return self.push_update({"inline_query": {
+            "id": str(next(self._file_ids)),
+            "from": sender,
+            "query": query,
+            "offset": offset,
+        }})
+
+    async def _push_webhook(self, update: Dict) -> None:
+        """
+        Delivers an update to the registered webhook
+        :param update: The update to be delivered
+        """
+
+        if self._client is None:
+            self._client = ClientSession()
+
+        try:
+            async with self._client.post(self.webhook, json=update) as response:
+                await response.read()
+        except Exception as e:
+            logger.warning(f"Webhook delivery of update {update['update_id']} failed: {e}")
+
+    async def _dispatch(self, request: web.Request) -> web.Response:
+        """
+        Routes an incoming api call to the matching method
+        :param request: The http request
+        :return: The json response
+        """
+
+        method = request.match_info["method"]
+
+        # Merge query string and body, uploaded files are kept as field objects
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            else:
+                params.update(await request.post())
+
+        if method in self.sending_methods:
+
+            # Simulate the network and processing delay
+            delay = self.latency + random.uniform(0, self.jitter)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            # Inject flood control errors
+            if self.flood_ratio > 0 and random.random() < self.flood_ratio:
+                self.rejected += 1
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after}
+                }, status=429)
+
+        handler = getattr(self, "_api_" + method, None)
+        if handler is None:
+            handler = self._api_send_file if method in self.file_methods else None
+        if handler is None:
+            return web.json_response({"ok": False, "error_code": 404, "description": "Not Found: method not found"},
+                                     status=404)
+
+        if method == "getUpdates":
+            result = await handler(params)
+        else:
+            result = handler(method, params)
+
+            self.calls.append((time.perf_counter(), method, params))
+            for listener in self.listeners:
+                listener(method, params, result)
+
+        return web.json_response({"ok": True, "result": result})
+
+    async def _api_getUpdates(self, params: Dict) -> List[Dict]:
+        """
+        Returns the pending updates, waiting up to the given timeout if there are none
+        """
+
+        self.polled.set()
+
+        # Confirm all updates below the offset
+        offset = int(params.get("offset") or 0)
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+
+        timeout = float(params.get("timeout") or 0)
+        if not self.updates and timeout > 0:
+            self._update_event.clear()
+            try:
+                await asyncio.wait_for(self._update_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        limit = int(params.get("limit") or 100)
+        return list(itertools.islice(self.updates, limit))
+
+    def _api_getMe(self, method: str, params: Dict) -> Dict:
+        return self.me
+
+    def _api_setWebhook(self, method: str, params: Dict) -> bool:
+        self.webhook = params.get("url") or None
+        return True
+
+    def _api_deleteWebhook(self, method: str, params: Dict) -> bool:
+        self.webhook = None
+        return True
+
+    def _api_getFile(self, method: str, params: Dict) -> Dict:
+        file_id = params["file_id"]
+        return {"file_id": file_id, "file_size": len(self.files.get(file_id, b"")), "file_path": file_id}
+
+    async def _download(self, request: web.Request) -> web.Response:
+        """
+        Serves the content of a stored file
+        :param request: The http request
+        :return: The file's content
+        """
+
+        content = self.files.get(request.match_info["path"])
+        if content is None:
+            return web.Response(status=404)
+        return web.Response(body=content, content_type="application/octet-stream")
+
+    def _api_answerCallbackQuery(self, method: str, params: Dict) -> bool:
+        return True
+
+    def _api_answerInlineQuery(self, method: str, params: Dict) -> bool:
+        return True
+
+    def _new_message(self, params: Dict) -> Dict:
+        """
+        Creates the message object the api returns for a sent message
+        :param params: The parameters of the call
+        :return: The message as dictionary
+        """
+
+        chat_id = int(params["chat_id"])
+        return {
+            "message_id": next(self._message_ids[chat_id]),
+            "date": int(time.time()),
+            "from": self.me,
+            "chat": {"id": chat_id, "type": "private"},
+        }
+
+    def _api_sendMessage(self, method: str, params: Dict) -> Dict:
+        message = self._new_message(params)
+        message["text"] = params.get("text", "")
+        return message
+
+    def _api_send_file(self, method: str, params: Dict) -> Dict:
+        message = self._new_message(params)
+        key = self.file_methods[method]
+        field = params.get(key)
+
+        # Uploaded files arrive as field objects, file ids and urls as strings
+        if isinstance(field, web.FileField):
+            size = len(field.file.read())
+            name = field.filename
+        else:
+            size, name = 0, str(field)
+
+        media = {"file_id": f"file{next(self._file_ids)}", "file_size": size}
+        if key == "photo":
+            message["photo"] = [dict(media, width=1, height=1)]
+        else:
+            message[key] = dict(media, file_name=name)
+
+        if "caption" in params:
+            message["caption"] = params["caption"]
+
+        return message
+
+    def _api_sendMediaGroup(self, method: str, params: Dict) -> List[Dict]:
+        media = json.loads(params["media"]) if isinstance(params["media"], str) else params["media"]
+
+        messages = []
+        for item in media:
+            message = self._new_message(params)
+            entry = {"file_id": f"file{next(self._file_ids)}", "file_size": 0}
+            message[item["type"]] = [dict(entry, width=1, height=1)] if item["type"] == "photo" else entry
+            if "caption" in item:
+                message["caption"] = item["caption"]
+            messages.append(message)
+
+        return messages
+
+    def _api_editMessageText(self, method: str, params: Dict) -> Dict:
+        return {
+            "message_id": int(params["message_id"]),
+            "date": int(time.time()),
+            "from": self.me,
+            "chat": {"id": int(params["chat_id"]), "type": "private"},
+            "text": params.get("text", ""),
+        }
+
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Set
+
+from samt.storage import _read_reply
+
+logger = logging.getLogger(__name__)
+
+
+class FakeRedisServer:
+    """
+    A local stand-in for a Redis server, which allows testing several bot processes sharing their storage offline.
+    It understands the commands used by the RedisStore: strings, transactions with WATCH and publish/subscribe.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379):
+        """
+        Initializes the server without starting it
+        :param host: The interface to bind to
+        :param port: The port to listen on
+        """
+
+        self.host = host
+        self.port = port
+
+        self.data: Dict[bytes, bytes] = dict()
+
+        # Every write raises a key's revision, which lets transactions detect changes of watched keys
+        self._revisions: Dict[bytes, int] = defaultdict(int)
+        self._subscribers: Dict[bytes, Set[asyncio.StreamWriter]] = defaultdict(set)
+        self._connections: Dict[asyncio.StreamWriter, asyncio.Task] = dict()
+
+        # The number of received commands
+        self.commands = 0
+
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        """
+        The url to be used as storage_file in the configuration
+        """
+
+        return f"redis://{self.host}:{self.port}/0"
+
+    async def start(self) -> None:
+        """
+        Starts the server on the current event loop
+        """
+
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        logger.info(f"Fake Redis listening on {self.url}")
+
+    async def stop(self) -> None:
+        """
+        Stops the server and closes the open connections
+        """
+
+        if self._server is not None:
+            self._server.close()
+        for writer in self._connections:
+            writer.close()
+        await asyncio.gather(*self._connections.values(), return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Answers the commands of a connection until it is closed
+        :param reader: The incoming stream
+        :param writer: The outgoing stream
+        """
+
+        # The connection's watched keys with their revisions and the commands queued in a transaction
+        watched: Dict[bytes, int] = dict()
+        queued: Optional[List[List[bytes]]] = None
+        self._connections[writer] = asyncio.current_task()
+
+        try:
+            while True:
+                command = await _read_reply(reader)
+                self.commands += 1
+
+                name = command[0].upper()
+                if queued is not None and name not in (b"EXEC", b"DISCARD", b"WATCH", b"MULTI"):
+                    queued.append(command)
+                    writer.write(b"+QUEUED\r\n")
+                elif name == b"MULTI":
+                    queued = []
+                    writer.write(b"+OK\r\n")
+                elif name == b"DISCARD":
+                    queued = None
+                    watched.clear()
+                    writer.write(b"+OK\r\n")
+                elif name == b"WATCH":
+                    watched.update((key, self._revisions[key]) for key in command[1:])
+                    writer.write(b"+OK\r\n")
+                elif name == b"UNWATCH":
+                    watched.clear()
+                    writer.write(b"+OK\r\n")
+                elif name == b"EXEC":
+                    if queued is None:
+                        writer.write(b"-ERR EXEC without MULTI\r\n")
+                    elif any(self._revisions[key] != revision for key, revision in watched.items()):
+                        writer.write(b"*-1\r\n")
+                    else:
+                        writer.write(b"*%d\r\n" % len(queued))
+                        for queued_command in queued:
+                            writer.write(self._execute(queued_command))
+                    queued = None
+                    watched.clear()
+                elif name == b"SUBSCRIBE":
+                    for channel in command[1:]:
+                        self._subscribers[channel].add(writer)
+                        writer.write(self._encode([b"subscribe", channel, 1]))
+                else:
+                    writer.write(self._execute(command))
+
+                await writer.drain()
+
+        # Closed by the client or ended together with the loop
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+
+        finally:
+            for writers in self._subscribers.values():
+                writers.discard(writer)
+            del self._connections[writer]
+            writer.close()
+
+    def _execute(self, command: List[bytes]) -> bytes:
+        """
+        Executes a command on the data
+        :param command: The command's name and arguments
+        :return: The encoded reply
+        """
+
+        name, args = command[0].upper(), command[1:]
+
+        if name == b"PING":
+            return b"+PONG\r\n"
+        if name in (b"SELECT", b"AUTH"):
+            return b"+OK\r\n"
+        if name == b"GET":
+            return self._encode(self.data.get(args[0]))
+        if name == b"MGET":
+            return self._encode([self.data.get(key) for key in args])
+        if name == b"SET":
+            self.data[args[0]] = args[1]
+            self._revisions[args[0]] += 1
+            return b"+OK\r\n"
+        if name == b"DEL":
+            deleted = 0
+            for key in args:
+                if self.data.pop(key, None) is not None:
+                    self._revisions[key] += 1
+                    deleted += 1
+            return self._encode(deleted)
+        if name == b"PUBLISH":
+            message = self._encode([b"message", args[0], args[1]])
+            for writer in self._subscribers[args[0]]:
+                writer.write(message)
+            return self._encode(len(self._subscribers[args[0]]))
+
+        return b"-ERR unknown command '%s'\r\n" % name
+
+    def _encode(self, value) -> bytes:
+        """
+        Encodes a reply in the Redis serialization protocol
+        :param value: None, an integer, bytes or a list of them
+        :return: The encoded reply
+        """
+
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(self._encode(item) for item in value)
+        return b"$%d\r\n%s\r\n" % (len(value), value)
@@ -1,10 +1,16 @@
+import inspect
+import io
+import os
 import re
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
 from datetime import datetime
 from enum import Enum
-from typing import Hashable, Any
+from typing import Hashable, Any, List, Tuple, Union, Iterable, Set, Dict
 
+from telepot.aio import api
 from tinydb import TinyDB, Query
-import aiotask_context
 import parse
 
 
@@ -13,6 +19,8 @@ class User:
     A wrapper around the user information which are by default contained in a dictionary
     """
 
+    __slots__ = ("id", "is_bot", "first_name", "last_name", "username", "language_code")
+
     def __init__(self, user: dict):
         # Safe all useful information as attributes
         self.id = user.get("id")
@@ -22,6 +30,17 @@ class User:
         self.username = user.get('username', "")
         self.language_code = user.get('language_code', "")
 
+    def update(self, user: dict) -> None:
+        """
+        Refreshes the attributes, which the user may have changed since the last message
+        :param user: The user information as dictionary
+        """
+
+        self.first_name = user.get('first_name')
+        self.last_name = user.get('last_name', "")
+        self.username = user.get('username', "")
+        self.language_code = user.get('language_code', "")
+
     def __str__(self):
         return "{} {}".format(self.first_name, self.last_name)
 
@@ -34,12 +53,25 @@ class Message:
     A wrapper around the message information which are by default contained in a dictionary
     """
 
+    __slots__ = ("_date", "text", "id")
+
     def __init__(self, msg: dict):
-        # Safe all useful information as attributes
-        self.date = datetime.fromtimestamp(msg['date'])
-        self.text = msg.get('text', None)
+        # Safe all useful information as attributes, the date is converted on first access
+        # Media messages carry their text as caption
+        self._date = msg['date']
+        self.text = msg.get('text', msg.get('caption'))
         self.id = msg['message_id']
 
+    @property
+    def date(self) -> datetime:
+        """
+        The date of the message
+        """
+
+        if not isinstance(self._date, datetime):
+            self._date = datetime.fromtimestamp(self._date)
+        return self._date
+
     def __str__(self):
         return self.text
 
@@ -52,6 +84,8 @@ class Sticker:
     A wrapper around the sticker information which are by default contained in a dictionary
     """
 
+    __slots__ = ("emoji", "file_id", "file_size", "height", "set_name")
+
     def __init__(self, sticker: dict):
         # Safe all useful information as attributes
         self.emoji = sticker['emoji']
@@ -61,20 +95,137 @@ class Sticker:
         self.set_name = sticker['set_name']
 
 
+class File:
+    """
+    A lazy accessor to a file attached to a received message. Nothing is downloaded until it is requested.
+    """
+
+    __slots__ = ("file_id", "file_unique_id", "file_size", "file_name", "mime_type", "max_size", "_bot", "_path")
+
+    # The size of the chunks a download is streamed in
+    chunk_size = 65536
+
+    def __init__(self, media: dict, bot, max_size: int = None):
+        """
+        Initializes the accessor without contacting the server
+        :param media: The file's information as dictionary, e.g. the document of a message
+        :param bot: The telepot bot to request the file with
+        :param max_size: The maximal number of bytes to download, None for no limit
+        """
+
+        self.file_id = media['file_id']
+        self.file_unique_id = media.get('file_unique_id')
+        self.file_size = media.get('file_size')
+        self.file_name = media.get('file_name')
+        self.mime_type = media.get('mime_type')
+        self.max_size = max_size
+        self._bot = bot
+        self._path = None
+
+    async def path(self) -> str:
+        """
+        Requests the file's path on the server via getFile, which is done only once
+        :return: The path of the file on the server
+        """
+
+        if self._path is None:
+            info = await self._bot.getFile(self.file_id)
+            self.file_size = info.get('file_size', self.file_size)
+            self._path = info['file_path']
+        return self._path
+
+    async def download(self, dest: Union[str, io.IOBase] = None) -> Union[bytes, str, io.IOBase]:
+        """
+        Streams the file into memory, a file object or a file on disk
+        :param dest: A path or a file object to write to, None to keep the content in memory
+        :return: The content as bytes if no destination was given, else the destination
+        """
+
+        remote = await self.path()
+        self._check_size(self.file_size)
+
+        # Stream into the destination, counting the bytes as the announced size may be missing
+        target = io.BytesIO() if dest is None else dest if isinstance(dest, io.IOBase) else open(dest, "wb")
+        received = 0
+        try:
+            session, request = api.download((self._bot._token, remote))
+            async with session:
+                async with request as response:
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        received += len(chunk)
+                        self._check_size(received)
+                        target.write(chunk)
+
+        except BaseException:
+            # Do not leave a partial file behind
+            if isinstance(dest, str):
+                target.close()
+                os.remove(dest)
+            raise
+
+        if dest is None:
+            return target.getvalue()
+        if isinstance(dest, str):
+            target.close()
+        return dest
+
+    def _check_size(self, size: Union[int, None]) -> None:
+        """
+        Raises an error if a size exceeds the configured limit
+        :param size: The size in bytes, None if unknown
+        """
+
+        if self.max_size is not None and size is not None and size > self.max_size:
+            raise FileTooLargeError(f"The file {self.file_id} exceeds the limit of {self.max_size} bytes")
+
+    def __repr__(self):
+        return "File({}, {} bytes)".format(self.file_name or self.file_id, self.file_size)
+
+
+# The values describing the update currently handled. Every task runs in a copy of the context it was created in,
+# so setting them in one session's task does not affect any other one.
+_user: ContextVar = ContextVar("user", default=None)
+_message: ContextVar = ContextVar("message", default=None)
+_init_message: ContextVar = ContextVar("init_message", default=None)
+_storage: ContextVar = ContextVar("storage", default=None)
+_chat_storage: ContextVar = ContextVar("chat_storage", default=None)
+_history: ContextVar = ContextVar("history", default=None)
+_media: ContextVar = ContextVar("media", default=None)
+
+# The keys of the framework's values, which are looked up before the session storage
+_framework_keys: Dict[Hashable, ContextVar] = {
+    "user": _user,
+    "message": _message,
+    "init_message": _init_message,
+    "_<[storage]>_": _storage,
+    "_<[chat_storage]>_": _chat_storage,
+    "history": _history,
+    "media": _media,
+}
+
+
 class Context:
     """
-    A wrapper around the aiotask_context to use additional functions
+    Access to the values of the current update and the session storage
     """
 
     @staticmethod
     def user() -> User:
         """Shortcut for the sake of convenience"""
-        return Context.get('user')
+        return _user.get()
 
     @staticmethod
     def message() -> Message:
         """Shortcut for the sake of convenience"""
-        return Context.get('message')
+        return _message.get()
+
+    @staticmethod
+    def media() -> Union[File, dict, None]:
+        """
+        The attachment of the current message, a File for downloadable media or the
+        dictionary of a location or contact
+        """
+        return _media.get()
 
     @staticmethod
     def get(key: Hashable, default=None) -> Any:
@@ -86,11 +237,12 @@ class Context:
         """
 
         # First try to find the value in the context
-        value = aiotask_context.get(key)
+        var = _framework_keys.get(key)
+        value = var.get() if var is not None else None
 
         # If not found, try to find it in the session storage
         if value is None:
-            value = aiotask_context.get('_<[storage]>_').get(key, default)
+            value = _storage.get().get(key, default)
 
         return value
 
@@ -103,10 +255,33 @@ class Context:
         """
 
         # Check for a conflict
-        if aiotask_context.get(key) is not None:
+        var = _framework_keys.get(key)
+        if var is not None and var.get() is not None:
             raise KeyError("This key is occupied by the framework")
         else:
-            aiotask_context.get('_<[storage]>_')[key] = value
+            _storage.get()[key] = value
+
+    @staticmethod
+    def get_chat(key: Hashable, default=None) -> Any:
+        """
+        Retrieves a value of the chat's storage, which is shared by all members of a group.
+        In private chats, this is the same as the user's storage.
+        :param key: The key to get
+        :param default: The value to return, if nothing is found
+        :return:
+        """
+
+        return _chat_storage.get().get(key, default)
+
+    @staticmethod
+    def set_chat(key: Hashable, value: Any) -> None:
+        """
+        Puts the given key value pair into the chat's storage
+        :param key: The key for the value to be associated with
+        :param value: The value to be inserted
+        """
+
+        _chat_storage.get()[key] = value
 
 
 # Source: https://djangosnippets.org/snippets/309/
@@ -201,6 +376,458 @@ class ParsingDict(object):
         self._entries[parse.compile(pattern)] = value
 
 
+class CommandDict(object):
+    """
+    A dictionary-like object for commands, which looks up the first word of a text once, ignoring its case and the
+    name of the addressed bot, e.g. /Start@MyBot. The following words are split into the arguments named by the
+    parameters of the registered handler, the last one receiving the remaining text.
+    """
+
+    def __init__(self):
+        self._commands: Dict[str, Tuple[Any, Tuple[str, ...]]] = dict()
+
+        # The bot's username in lower case, commands addressed to other bots are ignored once it is known
+        self.username: Union[str, None] = None
+
+        # The last tested item and result
+        self.last_request = None
+        self.last_result = None
+
+    def __getitem__(self, text: str) -> Tuple[Any, Dict[str, str]]:
+
+        # Check for a possible speedup
+        if self.last_request == text:
+            return self.last_result
+
+        if not text.startswith("/"):
+            raise KeyError('Text is not a command')
+
+        # The command is the first word, optionally followed by the bot's name
+        words = text.split(None, 1)
+        command, _, name = words[0].partition("@")
+        if name and self.username is not None and name.lower() != self.username:
+            raise KeyError('Command is addressed to another bot')
+
+        entry = self._commands.get(command.lower())
+        if entry is None:
+            raise KeyError('Key does not match any command')
+
+        value, params = entry
+        if len(words) == 1 or not params:
+            return value, {}
+        return value, dict(zip(params, words[1].split(None, len(params) - 1)))
+
+    def __contains__(self, item):
+
+        # Check existence by accessing the item in question
+        try:
+
+            # Remember the last questioned item to speed up access
+            self.last_result = self[item]
+            self.last_request = item
+        except KeyError:
+            return False
+        else:
+            return True
+
+    def __setitem__(self, command: str, value):
+        self._commands[command.lower()] = value, self._parameters(value)
+
+    def get(self, command: str, default=None):
+        """
+        Returns the value registered for a command
+        :param command: The command, e.g. /start
+        :param default: The value to return, if the command is not registered
+        :return: The registered or the default value
+        """
+
+        entry = self._commands.get(command.lower())
+        return entry[0] if entry is not None else default
+
+    @staticmethod
+    def _parameters(func) -> Tuple[str, ...]:
+        """
+        Determines the names of the arguments a handler takes, looking through decorators which name the handler
+        :param func: The handler
+        :return: The names in order
+        """
+
+        try:
+            signature = inspect.signature(inspect.unwrap(func))
+        except (TypeError, ValueError):
+            return ()
+
+        return tuple(name for name, param in signature.parameters.items()
+                     if param.kind in (param.POSITIONAL_OR_KEYWORD, param.KEYWORD_ONLY))
+
+
+class TTLCache(object):
+    """
+    A dictionary-like cache, whose entries expire after a given time.
+    If it exceeds its maximal size, the least recently used entries are evicted.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        """
+        Initializes an empty cache
+        :param ttl: The time in seconds after which an entry expires
+        :param maxsize: The maximal number of entries
+        """
+
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+        # Statistics of the lookups
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default=None) -> Any:
+        """
+        Retrieves an entry, if it exists and has not expired
+        :param key: The key to get
+        :param default: The value to return, if nothing is found
+        :return: The cached or the default value
+        """
+
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default=None) -> Any:
+        """
+        Removes an entry
+        :param key: The key to remove
+        :param default: The value to return, if nothing is found
+        :return: The removed value regardless of its expiry or the default value
+        """
+
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def keys(self) -> List[Hashable]:
+        """
+        The keys of all entries, including expired ones
+        """
+
+        return list(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class AccessList(object):
+    """
+    Sets of allowed and denied chat or user ids, so checking a message costs two lookups regardless of the lists' sizes.
+    Unless the list is restricted, everyone who is not denied is allowed. The changes made at runtime are kept apart,
+    so only they are persisted and applied to the configured lists on the next start.
+    """
+
+    # The key the lists are stored under in the persistent storage
+    storage_key = "_<[access]>_"
+
+    def __init__(self, allowed: Iterable = None, denied: Iterable = None):
+        """
+        Initializes the lists
+        :param allowed: The allowed ids, None for no restriction
+        :param denied: The denied ids, which take precedence
+        """
+
+        self.restricted = allowed is not None
+        self.allowed: Set[int] = {int(i) for i in allowed or ()}
+        self.denied: Set[int] = {int(i) for i in denied or ()}
+
+        # If an id was added to or removed from the lists at runtime, the last change per id counts
+        self._allowed_changes: Dict[int, bool] = dict()
+        self._denied_changes: Dict[int, bool] = dict()
+
+    def is_allowed(self, chat_id: int, user_id: int = None) -> bool:
+        """
+        Tests, if a message in a chat by a user may be processed
+        :param chat_id: The chat's id
+        :param user_id: The sender's id, if any
+        :return: If neither is denied and, for a restricted list, either is allowed
+        """
+
+        if self.denied and (chat_id in self.denied or user_id in self.denied):
+            return False
+
+        return not self.restricted or chat_id in self.allowed or user_id in self.allowed
+
+    def allow(self, *ids: int) -> None:
+        ids = [int(i) for i in ids]
+        self.allowed.update(ids)
+        self._allowed_changes.update(dict.fromkeys(ids, True))
+
+    def revoke(self, *ids: int) -> None:
+        ids = [int(i) for i in ids]
+        self.allowed.difference_update(ids)
+        self._allowed_changes.update(dict.fromkeys(ids, False))
+
+    def deny(self, *ids: int) -> None:
+        ids = [int(i) for i in ids]
+        self.denied.update(ids)
+        self._denied_changes.update(dict.fromkeys(ids, True))
+
+    def undeny(self, *ids: int) -> None:
+        ids = [int(i) for i in ids]
+        self.denied.difference_update(ids)
+        self._denied_changes.update(dict.fromkeys(ids, False))
+
+    @staticmethod
+    def read(filename: str) -> Set[int]:
+        """
+        Reads ids from a text file with one id per line, text after # is ignored
+        :param filename: The file's name
+        :return: The ids
+        """
+
+        with open(filename) as f:
+            return {int(line) for line in (line.split("#", 1)[0].strip() for line in f) if line}
+
+    def to_dict(self) -> dict:
+        """
+        Converts the changes made at runtime into a form, which can be put into the persistent storage
+        :return: The changed ids as dictionary
+        """
+
+        return {"allow": sorted(i for i, added in self._allowed_changes.items() if added),
+                "revoke": sorted(i for i, added in self._allowed_changes.items() if not added),
+                "deny": sorted(i for i, added in self._denied_changes.items() if added),
+                "undeny": sorted(i for i, added in self._denied_changes.items() if not added)}
+
+    def update(self, changes: dict) -> None:
+        """
+        Applies the changes converted by to_dict to the lists
+        :param changes: The changed ids as dictionary
+        """
+
+        self.allow(*changes.get("allow", ()))
+        self.revoke(*changes.get("revoke", ()))
+        self.deny(*changes.get("deny", ()))
+        self.undeny(*changes.get("undeny", ()))
+
+
+class DedupWindow(object):
+    """
+    Remembers the most recent keys to detect duplicates, forgetting the oldest key once it is full
+    """
+
+    def __init__(self, size: int = 1000):
+        """
+        Initializes an empty window
+        :param size: The number of keys to remember
+        """
+
+        self.size = size
+        self._keys = set()
+        self._order = deque()
+
+    def seen(self, key: Hashable) -> bool:
+        """
+        Tests if the key was seen before and remembers it otherwise
+        :param key: The key to test
+        :return: If the key is a duplicate
+        """
+
+        if key in self._keys:
+            return True
+
+        self._keys.add(key)
+        self._order.append(key)
+        if len(self._order) > self.size:
+            self._keys.discard(self._order.popleft())
+
+        return False
+
+    def __len__(self):
+        return len(self._order)
+
+
+_html_tag = re.compile(r"<(/?)([a-zA-Z-]+)[^>]*>")
+
+# The entity markers of Telegram's markdown styles, longer ones first
+_markdown_markers = {
+    "markdown": ("```", "`", "*", "_"),
+    "markdownv2": ("```", "`", "||", "__", "*", "_", "~"),
+}
+
+
+# Code spans with their content, and the markers which are not escaped
+_markdown_code = re.compile(r"`+([^`]*)`*")
+_markdown_marker = re.compile(r"(?<!\\)[*_~|\[\]]")
+
+
+def _find_cut(text: str, budget: int, markup: Union[str, None]) -> int:
+    """
+    Finds a position at most budget characters into the text, at which the text can be split without breaking words,
+    HTML tags or entities and markdown links
+    :param text: The text to be split
+    :param budget: The maximal length of the first part
+    :param markup: The parse mode of the text
+    :return: The position to split at
+    """
+
+    cut = budget
+
+    # Prefer paragraphs, then lines, then words, but do not accept too short parts
+    for separator in ("\n\n", "\n", " "):
+        position = text.rfind(separator, 0, budget)
+        if position > budget // 4:
+            cut = position + len(separator)
+            break
+
+    # Do not split inside a tag or an entity
+    if markup == "html":
+        for opening, closing in (("<", ">"), ("&", ";")):
+            position = text.rfind(opening, 0, cut)
+            if position > text.rfind(closing, 0, cut):
+                cut = position
+
+    # Do not split inside a link
+    elif markup in _markdown_markers:
+        position = text.rfind("[", 0, cut)
+        if position > text.rfind(")", 0, cut):
+            cut = position
+
+    return cut if cut > 0 else budget
+
+
+def _has_text(chunk: str, markup: Union[str, None]) -> bool:
+    """
+    Determines if a chunk shows any text besides its formatting
+    :param chunk: The chunk
+    :param markup: The parse mode of the text
+    :return: A boolean answering the call
+    """
+
+    if markup == "html":
+        return bool(_html_tag.sub("", chunk).strip())
+
+    if markup in _markdown_markers:
+        # Markers inside code are shown as they are
+        if any(code.strip() for code in _markdown_code.findall(chunk)):
+            return True
+        return bool(_markdown_marker.sub("", _markdown_code.sub("", chunk)).replace("\\", "").strip())
+
+    return bool(chunk.strip())
+
+
+def _balance(chunk: str, markup: Union[str, None]) -> Tuple[str, str]:
+    """
+    Determines the formatting left open at the end of a chunk
+    :param chunk: The chunk including the formatting reopened from the previous chunk
+    :param markup: The parse mode of the text
+    :return: The markup closing the formatting and the markup reopening it in the next chunk
+    """
+
+    if markup == "html":
+        stack = []
+        for match in _html_tag.finditer(chunk):
+            if not match.group(1):
+                stack.append((match.group(2).lower(), match.group(0)))
+            elif stack and stack[-1][0] == match.group(2).lower():
+                stack.pop()
+
+        return "".join(f"</{name}>" for name, _ in reversed(stack)), "".join(tag for _, tag in stack)
+
+    if markup in _markdown_markers:
+        markers = _markdown_markers[markup]
+        stack = []
+        i = 0
+        while i < len(chunk):
+
+            # Skip escaped characters and link targets
+            if chunk[i] == "\\":
+                i += 2
+                continue
+            if chunk.startswith("](", i) and not (stack and stack[-1] in ("```", "`")):
+                end = chunk.find(")", i)
+                i = end + 1 if end > 0 else len(chunk)
+                continue
+
+            for marker in markers:
+                if chunk.startswith(marker, i):
+                    # Inside code, only the matching marker counts
+                    if stack and stack[-1] in ("```", "`") and marker != stack[-1]:
+                        continue
+                    if stack and stack[-1] == marker:
+                        stack.pop()
+                    else:
+                        stack.append(marker)
+                    i += len(marker) - 1
+                    break
+            i += 1
+
+        return "".join(reversed(stack)), "".join(stack)
+
+    return "", ""
+
+
+def split_message(text: str, limit: int = 4096, markup: str = None) -> List[str]:
+    """
+    Splits a text into parts not exceeding the length limit, preferably at paragraphs, lines and words.
+    For HTML and markdown, formatting open at a split is closed and reopened in the next part. Whitespace around the
+    parts is removed and parts without text are dropped, as Telegram rejects empty messages.
+    :param text: The text to be split
+    :param limit: The maximal length of each part
+    :param markup: The parse mode of the text, either HTML, Markdown, MarkdownV2 or None
+    :return: The parts in order
+    """
+
+    markup = markup.lower() if markup is not None else None
+
+    if limit < 1:
+        raise ValueError(f"The length limit must be positive, not {limit}")
+
+    parts = []
+    prefix = ""
+    text = text.strip()
+    while len(prefix) + len(text) > limit:
+        budget = limit - len(prefix)
+
+        # Shrink the part until it fits including the closing markup
+        while budget > 0:
+            cut = _find_cut(text, budget, markup)
+            chunk = (prefix + text[:cut].rstrip()).strip()
+            closing, reopening = _balance(chunk, markup)
+            if len(chunk) + len(closing) <= limit:
+                break
+            budget -= len(chunk) + len(closing) - limit
+
+        # If the formatting cannot be closed and reopened within the limit, the part is split without balancing it
+        if budget <= 0:
+            cut = _find_cut(text, limit, markup)
+            chunk, closing, reopening = text[:cut].rstrip(), "", ""
+
+        # The formatting opened in a dropped part is still reopened in the next one
+        if _has_text(chunk, markup):
+            parts.append(chunk + closing)
+        prefix = reopening
+        text = text[cut:].lstrip()
+
+    if _has_text(prefix + text, markup):
+        parts.append(prefix + text)
+    return parts
+
+
 class Mode(Enum):
     """
     An Enum to ease the specification of the processing mode of a route
@@ -215,10 +842,13 @@ class Mode(Enum):
     PARSE = 2
     """Matching using a python format string"""
 
+    COMMAND = 3
+    """Matching a command like /start, regardless of its case and an appended bot name, followed by arguments"""
+
 
 class Media(Enum):
     """
-    An Enum to describe the media type of an answer
+    An Enum to describe the media type of an answer or a received message
     """
 
     TEXT = 0
@@ -242,6 +872,19 @@ class Media(Enum):
     DOCUMENT = 6
     """Any file for download"""
 
+    VIDEO_NOTE = 7
+    """A round video message, only received"""
+
+    LOCATION = 8
+    """A shared location, only received"""
+
+    CONTACT = 9
+    """A shared contact, only received"""
+
 
 class AuthorizationError(Exception):
     pass
+
+
+class FileTooLargeError(Exception):
+    pass
@@ -0,0 +1,227 @@
+"""
+Load generator for SAMT bots, running them against the local fake Bot API server.
+
+Usage: python -m samt.loadtest "examples/00 echo/Echo.py" --users 100 --messages 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import toml
+
+from samt.fakeapi import FakeTelegramServer
+
+# The token handed to the bot under test, it only has to look plausible
+TOKEN = "123456:LOADTEST"
+
+
+def _rss(pid: int) -> Optional[int]:
+    """
+    Reads the resident set size of a process
+    :param pid: The process id
+    :return: The size in bytes or None, if it is not available on this platform
+    """
+
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+
+def _percentile(values: List[float], p: float) -> Optional[float]:
+    """
+    Computes a percentile by the nearest rank method
+    :param values: The sorted values
+    :param p: The percentile between 0 and 100
+    :return: The value or None for an empty list
+    """
+
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+
+def _prepare_bot(script: Path, folder: Path, api_url: str, extra_config: Dict) -> Path:
+    """
+    Copies a bot with its configuration into a temporary folder and points it to the fake server
+    :param script: The bot's main file
+    :param folder: The destination folder
+    :param api_url: The url of the fake server
+    :param extra_config: Additional values for the section bot
+    :return: The path of the copied script
+    """
+
+    shutil.copytree(script.parent, folder, dirs_exist_ok=True)
+
+    config_file = folder / "config" / "config.toml"
+    config = toml.load(config_file) if config_file.exists() else {}
+    config.setdefault("general", {})
+    config.setdefault("bot", {})
+
+    # Keep the log quiet and away from the original folder
+    config["general"]["logging"] = "error"
+    config["general"]["persistent_storage"] = False
+    config["bot"]["token"] = TOKEN
+    config["bot"]["api_url"] = api_url
+    config["bot"].update(extra_config)
+
+    config_file.parent.mkdir(exist_ok=True)
+    with open(config_file, "w") as f:
+        toml.dump(config, f)
+
+    return folder / script.name
+
+
+async def run(script: Path, users: int, messages: int, texts: List[str], timeout: float, server: FakeTelegramServer,
+              extra_config: Dict = None) -> Dict:
+    """
+    Runs a load test against a bot
+    :param script: The bot's main file
+    :param users: The number of simulated users
+    :param messages: The number of messages every user sends
+    :param texts: The texts the users send in rotation
+    :param timeout: The time to wait for an answer before counting a message as unanswered
+    :param server: The fake server to use
+    :param extra_config: Additional values for the section bot of the bot's configuration
+    :return: The report as dictionary
+    """
+
+    await server.start()
+
+    # Every chat gets a queue of the times the bot's answers arrived
+    answers: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+    server.listeners.append(
+        lambda method, params, result: answers[int(params["chat_id"])].put_nowait(time.perf_counter())
+        if "chat_id" in params and method != "editMessageText" else None)
+
+    with tempfile.TemporaryDirectory(prefix="samt-loadtest-") as folder:
+        bot_script = _prepare_bot(script, Path(folder), server.url, extra_config or {})
+
+        # Make this very checkout importable for the bot
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(Path(__file__).parent.parent), env.get("PYTHONPATH")]))
+        process = subprocess.Popen([sys.executable, str(bot_script)], cwd=folder, env=env)
+
+        try:
+            await asyncio.wait_for(server.polled.wait(), 30)
+            rss_before = _rss(process.pid)
+
+            latencies: List[float] = []
+            unanswered = 0
+
+            async def user(user_id: int) -> None:
+                nonlocal unanswered
+                queue = answers[user_id]
+
+                for i in range(messages):
+                    sent = time.perf_counter()
+                    server.push_message(user_id, texts[i % len(texts)], first_name=f"User{user_id}")
+
+                    try:
+                        received = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        unanswered += 1
+                    else:
+                        latencies.append(received - sent)
+
+                        # Discard further answers to the same message
+                        while not queue.empty():
+                            queue.get_nowait()
+
+            start = time.perf_counter()
+            await asyncio.gather(*(user(1000 + i) for i in range(users)))
+            duration = time.perf_counter() - start
+
+            rss_after = _rss(process.pid)
+
+        finally:
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            await server.stop()
+
+    latencies.sort()
+    return {
+        "bot": str(script),
+        "users": users,
+        "messages": users * messages,
+        "answered": len(latencies),
+        "unanswered": unanswered,
+        "rejected_calls": server.rejected,
+        "duration": duration,
+        "messages_per_second": len(latencies) / duration if duration > 0 else None,
+        "latency_p50": _percentile(latencies, 50),
+        "latency_p90": _percentile(latencies, 90),
+        "latency_p99": _percentile(latencies, 99),
+        "latency_max": latencies[-1] if latencies else None,
+        "rss_before": rss_before,
+        "rss_after": rss_after,
+        "memory_per_session": (rss_after - rss_before) / users if rss_before and rss_after else None,
+    }
+
+
+def _print_report(report: Dict) -> None:
+    """
+    Prints a human readable version of a report
+    :param report: The report as returned by run
+    """
+
+    def ms(value):
+        return "n/a" if value is None else f"{value * 1000:.1f} ms"
+
+    print(f"Bot:                {report['bot']}")
+    print(f"Messages:           {report['answered']}/{report['messages']} answered "
+          f"({report['unanswered']} unanswered, {report['rejected_calls']} calls rejected with 429)")
+    print(f"Duration:           {report['duration']:.2f} s")
+    print(f"Throughput:         {report['messages_per_second'] or 0:.1f} messages/s")
+    print(f"Latency p50/p90/p99/max: {ms(report['latency_p50'])} / {ms(report['latency_p90'])} / "
+          f"{ms(report['latency_p99'])} / {ms(report['latency_max'])}")
+    if report["memory_per_session"] is not None:
+        print(f"Memory per session: {report['memory_per_session'] / 1024:.1f} KiB "
+              f"(RSS {report['rss_before'] / 2 ** 20:.1f} -> {report['rss_after'] / 2 ** 20:.1f} MiB)")
+    else:
+        print("Memory per session: n/a")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test a SAMT bot against a local fake Bot API server")
+    parser.add_argument("script", type=Path, help="The bot's main file, its config folder is copied along")
+    parser.add_argument("--users", type=int, default=10, help="The number of simulated users")
+    parser.add_argument("--messages", type=int, default=10, help="The number of messages per user")
+    parser.add_argument("--text", action="append", dest="texts", help="A text to send, may be repeated")
+    parser.add_argument("--timeout", type=float, default=5, help="Seconds to wait for an answer")
+    parser.add_argument("--latency", type=float, default=0, help="Artificial api latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0, help="Maximal random addition to the latency")
+    parser.add_argument("--flood", type=float, default=0, help="Probability of injecting a 429 error per call")
+    parser.add_argument("--port", type=int, default=8081, help="The port of the fake server")
+    parser.add_argument("--json", type=Path, help="Write the report as json to this file")
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(port=args.port, latency=args.latency, jitter=args.jitter, flood_ratio=args.flood)
+    report = asyncio.run(run(args.script.resolve(), args.users, args.messages, args.texts or ["/start", "Hello"],
+                             args.timeout, server))
+
+    _print_report(report)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+Profiling of a running bot without restarting it. A profile is started by the command configured as command in the
+section profiling, which only the ids in admins may use, or through the local socket configured as socket:
+
+Usage: python -m samt.profiler profile.sock --seconds 30 --mode sampling
+"""
+
+import argparse
+import asyncio
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from os import path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+# Messages go to the bot's log
+logger = logging.getLogger("samt.samt")
+
+# The profilers and the extension of their files
+MODES = {"cprofile": "pstats", "sampling": "collapsed"}
+
+
+def parse_options(text: str) -> Dict[str, Any]:
+    """
+    Parses the options of a profile given as text, e.g. "30 mode=sampling" or "updates=100 route=/status"
+    :param text: The options as key=value pairs, a single number is taken as seconds
+    :return: The options as keyword arguments of Bot.profile
+    """
+
+    options = dict()
+    for word in text.split():
+        key, _, value = word.partition("=")
+        if not value:
+            key, value = "seconds", key
+
+        try:
+            if key == "seconds":
+                options[key] = float(value)
+            elif key == "updates":
+                options[key] = int(value)
+            elif key in ("route", "mode"):
+                options[key] = value
+            else:
+                raise ValueError(f"Unknown option {key}, use seconds, updates, route or mode")
+        except ValueError as e:
+            raise ValueError(f"Invalid option {word}: {e}")
+
+    return options
+
+
+class Profiler(object):
+    """
+    Profiles the thread of the event loop, either deterministically with cProfile or by sampling its stack. If the
+    profile is scoped to a route, only the time spent in the route's handler is recorded. As handlers of other messages
+    run while an asynchronous handler awaits, a scoped cProfile includes them as well.
+    """
+
+    def __init__(self, mode: str = "cprofile", route: str = None, directory: str = "profiles",
+                 sample_interval: float = 0.005):
+        """
+        Initializes the profiler without starting it
+        :param mode: Either cprofile, written as pstats file, or sampling, written as collapsed stacks for flame graphs
+        :param route: The name of the handler to profile, None for everything
+        :param directory: The directory the profile is written to
+        :param sample_interval: The seconds between two samples of the stack
+        """
+
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode {mode}, use {' or '.join(MODES)}")
+
+        self.mode = mode
+        self.route = route
+        self.directory = directory
+        self.sample_interval = sample_interval
+
+        # The number of processed updates or calls of the scoped handler and the number after which the profile ends
+        self.updates = 0
+        self._limit: Optional[int] = None
+        self._done = asyncio.Event()
+
+        # The running scoped handlers, the profile is only recorded while one runs
+        self._inside = 0
+
+        self._profile: Optional[cProfile.Profile] = None
+        self._samples: Counter = Counter()
+        self._thread: Optional[int] = None
+        self._sampling = False
+
+    def enter(self, route: str) -> None:
+        """
+        Notes the start of a handler
+        :param route: The handler's name
+        """
+
+        if self.route is None or route != self.route:
+            return
+
+        self._inside += 1
+        if self._inside == 1 and self._profile is not None:
+            self._profile.enable()
+
+    def leave(self, route: str) -> None:
+        """
+        Notes the end of a handler, which counts as processed update of a scoped profile
+        :param route: The handler's name
+        """
+
+        if self.route is None or route != self.route:
+            return
+
+        self._inside -= 1
+        if self._inside == 0 and self._profile is not None:
+            self._profile.disable()
+        self._count()
+
+    def processed(self) -> None:
+        """
+        Counts a processed update of a profile, which is not scoped to a route
+        """
+
+        if self.route is None:
+            self._count()
+
+    def _count(self) -> None:
+        self.updates += 1
+        if self._limit is not None and self.updates >= self._limit:
+            self._done.set()
+
+    def wrap(self, func: Callable, route: str) -> Callable:
+        """
+        Wraps a handler, so its calls are noted
+        :param func: The handler, either synchronous or asynchronous
+        :param route: The handler's name
+        :return: The asynchronous wrapper
+        """
+
+        async def profiled(*args, **kwargs):
+            self.enter(route)
+            try:
+                if asyncio.iscoroutinefunction(func):
+                    return await func(*args, **kwargs)
+                return func(*args, **kwargs)
+            finally:
+                self.leave(route)
+
+        return profiled
+
+    async def run(self, seconds: float = None, updates: int = None, max_seconds: float = 300) -> str:
+        """
+        Records a profile and writes it to a file
+        :param seconds: The seconds to profile
+        :param updates: The number of updates to profile, the profile ends with whichever limit is reached first
+        :param max_seconds: The longest time a profile may take
+        :return: A summary naming the written file
+        """
+
+        if seconds is None and updates is None:
+            seconds = 10.0
+        self._limit = updates
+
+        self._start()
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._done.wait(), min(seconds or max_seconds, max_seconds))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._stop()
+
+        return self._write(time.monotonic() - started)
+
+    def _start(self) -> None:
+        """
+        Starts recording on the thread of the event loop
+        """
+
+        self._thread = threading.get_ident()
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            if self.route is None:
+                self._profile.enable()
+        else:
+            self._sampling = True
+            threading.Thread(target=self._sample, name="samt-profiler", daemon=True).start()
+
+    def _stop(self) -> None:
+        """
+        Stops recording
+        """
+
+        if self._profile is not None:
+            self._profile.disable()
+        self._sampling = False
+
+    def _sample(self) -> None:
+        """
+        Samples the stack of the event loop's thread until stopped
+        """
+
+        while self._sampling:
+            time.sleep(self.sample_interval)
+            if self.route is not None and self._inside == 0:
+                continue
+
+            frame = sys._current_frames().get(self._thread)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self._samples[";".join(reversed(stack))] += 1
+
+    def _write(self, duration: float) -> str:
+        """
+        Writes the profile to a file
+        :param duration: The profiled seconds
+        :return: A summary of the profile
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+        file = path.join(self.directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.{MODES[self.mode]}")
+
+        if self.mode == "cprofile":
+            self._profile.dump_stats(file)
+            lines = self._top_functions()
+        else:
+            with open(file, "w") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in self._samples.items())
+            lines = self._top_samples()
+
+        scope = f" for {self.route}" if self.route is not None else ""
+        logger.info(f"Profile{scope} of {duration:.1f} seconds and {self.updates} updates written to {file}")
+        return "\n".join([f"Profile{scope} of {duration:.1f} seconds and {self.updates} updates written to {file}"]
+                         + lines)
+
+    def _top_functions(self, count: int = 5) -> List[str]:
+        """
+        Lists the functions which took the most time themselves
+        :param count: The number of functions
+        :return: The functions with their time
+        """
+
+        try:
+            stats = pstats.Stats(self._profile).stats
+        except TypeError:
+            # Nothing was recorded
+            return []
+
+        # The loop waiting for the next update is idle time
+        idle = sum(total for (_, _, name), (_, _, total, _, _) in stats.items() if "of 'select." in name)
+        top = sorted(((key, value) for key, value in stats.items() if "of 'select." not in key[2]),
+                     key=lambda item: item[1][2], reverse=True)[:count]
+        return [f"{idle:8.3f} s  idle"] + [f"{total:8.3f} s  {name} ({path.basename(file)}:{line})"
+                                            for (file, line, name), (_, _, total, _, _) in top]
+
+    def _top_samples(self, count: int = 5) -> List[str]:
+        """
+        Lists the functions which were on top of the stack most often
+        :param count: The number of functions
+        :return: The functions with their share of the samples
+        """
+
+        leaves = Counter()
+        for stack, samples in self._samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += samples
+
+        total = sum(leaves.values())
+        if total == 0:
+            return []
+
+        # The loop waiting for the next update is idle time
+        idle = sum(samples for leaf, samples in leaves.items() if "(selectors.py:" in leaf)
+        top = [(leaf, samples) for leaf, samples in leaves.most_common() if "(selectors.py:" not in leaf][:count]
+        return [f"{idle / total:8.1%}  idle"] + [f"{samples / total:8.1%}  {leaf}" for leaf, samples in top]
+
+
+async def serve(socket_path: str, profile: Callable[..., Awaitable[str]]) -> asyncio.AbstractServer:
+    """
+    Accepts profiling requests on a local socket, which only the bot's user may access. A request is a line of options
+    as understood by parse_options, it is answered with the summary once the profile is written.
+    :param socket_path: The path of the socket
+    :param profile: The function recording a profile, called with the parsed options
+    :return: The server
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            line = await reader.readline()
+            try:
+                reply = await profile(**parse_options(line.decode()))
+            except (ValueError, RuntimeError) as e:
+                reply = str(e)
+            writer.write(reply.encode() + b"\n")
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # A socket left over by a previous instance is replaced
+    if path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server = await asyncio.start_unix_server(handle, socket_path)
+    os.chmod(socket_path, 0o600)
+    logger.info(f"Profiling requests are accepted on {socket_path}")
+    return server
+
+
+async def _request(socket_path: str, options: str) -> str:
+    """
+    Sends a profiling request to a running bot
+    :param socket_path: The path of the bot's socket
+    :param options: The options as text
+    :return: The bot's reply
+    """
+
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    writer.write(options.encode() + b"\n")
+    await writer.drain()
+    reply = await reader.read()
+    writer.close()
+    return reply.decode().rstrip()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Profile a running SAMT bot through its profiling socket")
+    parser.add_argument("socket", help="The socket configured as socket in the section profiling")
+    parser.add_argument("--seconds", type=float, help="The seconds to profile, 10 by default")
+    parser.add_argument("--updates", type=int, help="The number of updates to profile")
+    parser.add_argument("--route", help="The route or handler to profile, e.g. /status")
+    parser.add_argument("--mode", choices=list(MODES), default="cprofile",
+                        help="cprofile writes a pstats file, sampling collapsed stacks for flame graphs")
+    args = parser.parse_args()
+
+    options: List[str] = [f"mode={args.mode}"]
+    for key in ("seconds", "updates", "route"):
+        value: Union[str, float, int, None] = getattr(args, key)
+        if value is not None:
+            options.append(f"{key}={value}")
+
+    print(asyncio.run(_request(args.socket, " ".join(options))))
+
+
+if __name__ == "__main__":
+    main()
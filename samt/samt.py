@@ -1,31 +1,53 @@
 import asyncio
+import copy
+import functools
+import io
+import json
 import logging
 import math
-import platform
+import os
 import signal
 import sys
+import threading
+import time
 import traceback
 import types
+import uuid
+import warnings
 from collections import deque
+from contextvars import ContextVar, copy_context
+from datetime import datetime, timedelta
+from heapq import heappush, heappop
 from inspect import iscoroutinefunction, isgenerator, isasyncgen
-from os import path, system
-from typing import Dict, Callable, Tuple, Iterable, Union, Collection
+from itertools import takewhile, count
+from os import path
+from types import MappingProxyType
+from typing import Dict, Callable, Tuple, Iterable, Union, Collection, List, AsyncIterable, NamedTuple, \
+    Mapping, Set
 
-import aiotask_context as _context
-import collections
+import collections.abc
 import telepot
 import telepot.aio.delegate
 import toml
-from telepot.aio.loop import MessageLoop
+from telepot.loop import _extract_message
 from telepot.exception import TelegramError
 from telepot.namedtuple import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup, \
-    ReplyKeyboardRemove
+    ReplyKeyboardRemove, InputMediaPhoto, InputMediaVideo, InlineQueryResultArticle, InputTextMessageContent
 from more_itertools import flatten, first_true
 
 from samt.helper import *
+from samt.helper import _user, _message, _init_message, _storage, _chat_storage, _history, _media
+from samt.serializers import Codec
+from samt.storage import KeyValueStore, RedisStore
 
 logger = logging.getLogger(__name__)
 
+# The configuration of the bot created last, which is used outside of any bot's context
+_config: Dict = dict()
+
+# The bot whose update, job or startup is currently handled
+_bot: ContextVar = ContextVar("bot", default=None)
+
 
 def _load_configuration(filename: str) -> dict:
     """
@@ -46,8 +68,9 @@ def _config_value(*keys, default: Any = None) -> Any:
     :return: Either the desired or the default value
     """
 
-    # Traverse through the dictionaries
-    step = _config
+    # Traverse through the dictionaries, starting at the configuration of the current bot
+    bot = _bot.get()
+    step = bot.config if bot is not None else _config
     for key in keys:
         try:
 
@@ -61,95 +84,489 @@ def _config_value(*keys, default: Any = None) -> Any:
     return step
 
 
+def _storage_codec() -> Union[Codec, None]:
+    """
+    Creates the serialization of stored records as configured
+    :return: The codec or None, if records are kept as json documents
+    """
+
+    storage_format = _config_value('general', 'storage_format', default=None)
+    if storage_format is None:
+        return None
+
+    return Codec(storage_format, _config_value('general', 'storage_compression', default=None),
+                 _config_value('general', 'storage_compress_min_size', default=1024))
+
+
+def _per_chat_member(types: Collection[str]) -> Callable:
+    """
+    Creates a seeder for telepot, which assigns a session to every member of a chat, so members are served concurrently
+    while the messages of each member stay in order. Channel posts have no sender and share one session per channel.
+    :param types: The chat types to be handled
+    :return: The seeder function
+    """
+
+    def seeder(msg: dict) -> Union[Tuple[int, Union[int, None]], None]:
+        chat = msg.get('chat')
+
+        # Callback queries are captured by the existing sessions
+        if chat is None or chat['type'] not in types:
+            return None
+
+        return chat['id'], msg['from']['id'] if 'from' in msg else None
+
+    return seeder
+
+
+class _DefaultBot(object):
+    """
+    A decorator of the bot, which can still be used on the class as in earlier versions, where it applies to the first
+    created bot with a deprecation warning. Decorators used before a bot was created are applied once the first one is.
+    """
+
+    # The registrations made before the first bot was created, as decorator, arguments and decorated function
+    pending: List[Tuple[Callable, tuple, dict, Union[Callable, None]]] = []
+
+    def __init__(self, method: Callable, factory: bool = False):
+        """
+        Wraps a decorator of the bot
+        :param method: The decorator as function of the bot
+        :param factory: If the decorator takes arguments and returns the actual decorator
+        """
+
+        self.method = method
+        self.factory = factory
+        functools.update_wrapper(self, method)
+
+        # Used on the class, the decorator keeps its name and documentation
+        @functools.wraps(method)
+        def forward(*args, **kwargs):
+            return self._forward(*args, **kwargs)
+
+        self.forward = forward
+
+    def __get__(self, instance, owner):
+        if instance is not None:
+            return self.method.__get__(instance, owner)
+        return self.forward
+
+    def _forward(self, *args, **kwargs):
+        warnings.warn(f"Bot.{self.method.__name__} is deprecated, use the decorator of the bot instance instead",
+                      DeprecationWarning, stacklevel=3)
+
+        if Bot.instances:
+            return self.method(Bot.instances[0], *args, **kwargs)
+
+        if self.factory:
+            def decorator(func: Callable) -> Callable:
+                _DefaultBot.pending.append((self.method, args, kwargs, func))
+                return func
+
+            return decorator
+
+        _DefaultBot.pending.append((self.method, args, kwargs, None))
+        return args[0] if args else None
+
+    @staticmethod
+    def apply(bot: "Bot") -> None:
+        """
+        Applies the registrations made before the first bot was created
+        :param bot: The first bot
+        """
+
+        for method, args, kwargs, func in _DefaultBot.pending:
+            registration = method(bot, *args, **kwargs)
+            if func is not None:
+                registration(func)
+        _DefaultBot.pending.clear()
+
+
+def _on_default_bot(factory: bool = False) -> Callable:
+    """
+    Marks a decorator of the bot, which was usable on the class in earlier versions
+    :param factory: If the decorator takes arguments and returns the actual decorator
+    :return: The marking decorator
+    """
+
+    return lambda method: _DefaultBot(method, factory)
+
+
 class Bot:
     """
-    The main class of this framework
+    The main class of this framework. Several bots can run in one process, each with its own configuration, routes
+    and sessions, while they share the event loop, the http connection pool, the storage engine and the job scheduler.
     """
 
-    _on_termination = lambda: None
+    # All bots created in this process
+    instances: List["Bot"] = []
+
+    # The scheduler of the jobs of all bots
+    _jobs: "_Scheduler" = None
+
+    # The monitor of the event loop shared by all bots
+    _watchdog: Union["_Watchdog", None] = None
+
+    # The opened storage engines keyed by their file, so bots using the same file share one
+    _databases: Dict[str, Any] = dict()
+
+    # The servers the api calls are redirected to, keyed by the bots' tokens
+    _api_urls: Dict[str, str] = dict()
+
+    # The task running the scheduler and the one shutting the bots down after a signal
+    _scheduling: Union[asyncio.Task, None] = None
+    _stopping: Union[asyncio.Task, None] = None
 
-    def __init__(self):
+    # If a shutdown started, so the sessions do not take further messages from their mailboxes
+    _draining = False
+
+    # The running profile
+    _profiling: Union["Profiler", None] = None
+
+    def __init__(self, config: Union[str, Dict] = "config", name: str = None):
         """
         Initialize the framework using the configuration file(s)
+        :param config: The name of the configuration file in the directory config without its extension, or the
+            configuration as dictionary
+        :param name: The name of the bot's table in a storage file shared with other bots, defaults to the name of the
+            configuration file or the bot's id. The bot using the file config keeps its records in the default table.
         """
 
-        # Read configuration
+        # Read configuration, it is used by everything running in the bot's context
         global _config
-        try:
-            _config = _load_configuration("config")
-        except FileNotFoundError:
-            logger.critical("The configuration file could not be found. Please make sure there is a file called " +
-                            "config.toml in the directory config.")
-            quit(-1)
+        if isinstance(config, dict):
+            _config = config
+        else:
+            try:
+                _config = _load_configuration(config)
+            except FileNotFoundError:
+                logger.critical(f"The configuration file could not be found. Please make sure there is a file called "
+                                f"{config}.toml in the directory config.")
+                quit(-1)
+        self.config = _config
+        self.name = name or (config if isinstance(config, str) else str(_config_value('bot', 'token')).split(":")[0])
+
+        self.context = copy_context()
+        self.context.run(_bot.set, self)
+        Bot.instances.append(self)
 
         # Initialize logger
         self._configure_logger()
 
         # Read language files
+        language = None
         if _config_value('bot', 'language_feature', default=False):
             try:
-                _Session.language = _load_configuration("lang")
+                language = _load_configuration(_config_value('bot', 'language_file', default="lang"))
             except FileNotFoundError:
                 logger.critical("The language file could not be found. Please make sure there is a file called " +
                                 "lang.toml in the directory config or disable this feature.")
                 quit(-1)
 
         signal.signal(signal.SIGINT, Bot.signal_handler)
+        signal.signal(signal.SIGTERM, Bot.signal_handler)
 
         # Prepare empty stubs
         self._on_startup = None
+        self._on_termination = lambda: None
+        self._updates = None
+        self._polling = None
+        self._access_flush = None
+        self._handed: Dict[Hashable, list] = dict()
 
-        # Create access level dictionary
+        # Create access level dictionary and the cache of the checkers' results per level and user
         self.access_checker = dict()
+        ttl = _config_value('access', 'cache_ttl', default=0)
+        self.access_cache = TTLCache(ttl, _config_value('access', 'cache_size', default=10000)) if ttl > 0 else None
 
-        # Config Answer class
-        Answer._load_defaults()
+        # The caches of the routes' results by their message
+        self.route_caches: Dict[str, _RouteCache] = dict()
+
+        # Config Answer and the bot's own session classes
+        self.answer_defaults = Answer._load_defaults(language)
+        self._session = _Session._derive()
+        self._session._load_defaults()
+        self._inline_session = type(_InlineSession.__name__, (_InlineSession,), {})
+
+        # The command starting a profile, which only admins may use
+        command = _config_value('profiling', 'command', default=None)
+        if command is not None:
+            self._session.command_routes[command] = self._profile_command
 
         # Load database
         if _config_value('general', 'persistent_storage', default=False):
             name = _config_value('general', 'storage_file', default="db.json")
             args = _config_value('general', 'storage_args', default=" ").split(" ")
-            _Session.database = self._initialize_persistent_storage(name, *args)
+            database = Bot._databases.get(name)
+            if database is None:
+                database = Bot._databases[name] = self._initialize_persistent_storage(name, *args)
+
+            # Other bots keep their records in tables of their own
+            if self.name != "config" and hasattr(database, "table"):
+                database = database.table(self.name)
+            self._session.database = database
         else:
-            _Session.database = None
+            self._session.database = None
+
+        # Load the allowed and denied ids
+        self._load_access_list()
 
         # Initialize bot
         self._create_bot()
-        logger.info("Bot started")
+
+        # The first bot creates the scheduler and the watchdog
+        if Bot._jobs is None:
+            Bot._jobs = _Scheduler(max_concurrent=_config_value('jobs', 'max_concurrent', default=16),
+                                   flush_interval=_config_value('jobs', 'flush_interval', default=1.0),
+                                   lease_duration=_config_value('jobs', 'lease_duration', default=30.0))
+        if Bot._watchdog is None and _config_value('watchdog', 'enabled', default=True):
+            Bot._watchdog = _Watchdog(interval=_config_value('watchdog', 'interval', default=0.1),
+                                      threshold=_config_value('watchdog', 'threshold', default=0.5),
+                                      findings=_config_value('watchdog', 'findings', default=100))
+
+        # Handlers registered on the class before are added to the first bot
+        if len(Bot.instances) == 1:
+            _DefaultBot.apply(self)
+
+        logger.info(f"Bot {self.name} started")
 
     def listen(self) -> None:
         """
         Activates the bot by running it in a never ending asynchronous loop
         """
 
+        Bot.listen_all(self)
+
+    @staticmethod
+    def listen_all(*bots: "Bot") -> None:
+        """
+        Activates several bots by running them in one never ending asynchronous loop
+        :param bots: The bots to run, defaults to all created ones
+        """
+
         # Creates an event loop
         global loop
         loop = asyncio.get_event_loop()
 
-        # Changes its task factory to use the async context provided by aiotask_context
-        loop.set_task_factory(_context.copying_task_factory)
+        # Every bot's tasks are created in its context
+        for bot in bots or Bot.instances:
+            bot.context.run(bot._start)
+
+        # Run the scheduled jobs when they are due
+        Bot._scheduling = loop.create_task(Bot._jobs.run_forever())
+
+        # Watch the loop for blocking callbacks
+        if Bot._watchdog is not None:
+            loop.create_task(Bot._watchdog.run_forever())
+
+        # Accept profiling requests on a local socket
+        socket_path = (bots or Bot.instances)[0].context.run(_config_value, 'profiling', 'socket', default=None)
+        if socket_path is not None:
+            # Imported on use, so python -m samt.profiler does not import the module twice
+            from samt.profiler import serve as serve_profiling
+            loop.run_until_complete(serve_profiling(path.join(path.dirname(path.realpath(sys.argv[0])), socket_path),
+                                                    Bot.profile))
+
+        # Start the event loop to never end (of itself)
+        loop.run_forever()
+
+        # Stopped by the signal handler, write the changes shared storages have not written yet
+        if Bot._watchdog is not None:
+            Bot._watchdog.stop()
+        stores = {bot._session.database for bot in Bot.instances if isinstance(bot._session.database, KeyValueStore)}
+        if stores:
+            loop.run_until_complete(asyncio.gather(*(store.close() for store in stores)))
+
+        logger.info("Bot shuts down")
+        quit(0)
+
+    def _start(self) -> None:
+        """
+        Creates the tasks of the bot on the event loop
+        """
+
+        # Read the state and what the previous instance handed over
+        state_file = _config_value('general', 'state_file', default=None)
+        self._updates = _UpdateLoop(self._bot,
+                                    state_file=f"{path.dirname(path.realpath(sys.argv[0]))}/{state_file}"
+                                    if state_file is not None else None,
+                                    window=_config_value('bot', 'dedup_window', default=1000))
+        self._session.updates = self._updates
+        handoff = self._updates.handoff
+
+        # Load what is kept in the persistent storage, whose functions may have been replaced after the initialization
+        # The records of recently active users are read ahead as well
+        # The jobs of a shared storage are only loaded by the process holding the lease on them
+        if isinstance(self._session.database, KeyValueStore):
+            loop.run_until_complete(self._session.database.load(AccessList.storage_key, *handoff.get("users", ())))
+            loop.run_until_complete(Bot._jobs.acquire(self))
+        elif self._session.database is not None:
+            Bot._jobs.load(self)
+        if self._session.database is not None:
+            self._session.access.update(self._session.load_user_data(AccessList.storage_key))
+        Bot._jobs.restore(self, handoff.get("jobs", {}))
+        logger.debug(f"Access list of {self.name} with {len(self._session.access.allowed)} allowed and "
+                     f"{len(self._session.access.denied)} denied ids")
 
         # Creates the forever running bot listening function as task
-        loop.create_task(MessageLoop(self._bot).run_forever(timeout=None))
+        self._polling = loop.create_task(self._updates.run_forever(timeout=None))
 
         # Create the startup as a separated task
         loop.create_task(self.schedule_startup())
 
-        # Start the event loop to never end (of itself)
-        loop.run_forever()
+        # Commands may name the bot they are addressed to
+        username = _config_value('bot', 'username', default=None)
+        if username is not None:
+            self._session.command_routes.username = username.lower()
+        else:
+            loop.create_task(self._identify())
+
+    async def _identify(self) -> None:
+        """
+        Asks Telegram for the bot's username, so commands addressed to other bots can be told apart
+        """
+
+        try:
+            me = await self._bot.getMe()
+        except Exception as e:
+            logger.warning(f"The username of {self.name} could not be determined, so commands addressed to any bot "
+                           f"are answered:\n\t\t{e!r}")
+            return
+
+        self._session.command_routes.username = (me.get('username') or "").lower() or None
 
     def _create_bot(self) -> None:
         """
         Creates the bot using the telepot API
         """
 
-        self._bot = telepot.aio.DelegatorBot(_config_value('bot', 'token'), [
-            telepot.aio.delegate.pave_event_space()(
+        # Redirect all api calls, e.g. to a local stand-in server
+        api_url = _config_value('bot', 'api_url', default=None)
+        if api_url is not None:
+            self._redirect_api(api_url)
+
+        chat_types = _config_value('bot', 'chat_types', default=["private"])
+        timeout = _config_value('bot', 'timeout', default=31536000)
+
+        # Private chats get a session per chat, other chats a session per member
+        delegates = []
+        if "private" in chat_types:
+            delegates.append(telepot.aio.delegate.pave_event_space()(
                 telepot.aio.delegate.per_chat_id(types=["private"]),
                 telepot.aio.delegate.create_open,
-                _Session,
-                timeout=_config_value('bot', 'timeout', default=31536000)),
-        ])
+                self._session,
+                timeout=timeout))
+
+        other_types = [chat_type for chat_type in chat_types if chat_type != "private"]
+        if other_types:
+            delegates.append(telepot.aio.delegate.pave_event_space()(
+                _per_chat_member(other_types),
+                telepot.aio.delegate.create_open,
+                self._session,
+                timeout=timeout))
+
+        # Inline queries are handled per user, independent of any chat
+        delegates.append(telepot.aio.delegate.pave_event_space()(
+            telepot.aio.delegate.per_inline_from_id(),
+            telepot.aio.delegate.create_open,
+            self._inline_session,
+            timeout=timeout))
+
+        self._bot = telepot.aio.DelegatorBot(_config_value('bot', 'token'), delegates)
+
+    def _redirect_api(self, url: str) -> None:
+        """
+        Replaces the Telegram server in the urls telepot builds for this bot's api calls and file downloads
+        :param url: The base url of the server to use instead
+        """
+
+        # The urls of other bots are still built by telepot
+        if not Bot._api_urls:
+            methodurl, fileurl = telepot.aio.api._methodurl, telepot.aio.api._fileurl
+            telepot.aio.api._methodurl = lambda req, **user_kw: f"{Bot._api_urls[req[0]]}/bot{req[0]}/{req[1]}" \
+                if req[0] in Bot._api_urls else methodurl(req, **user_kw)
+            telepot.aio.api._fileurl = lambda req: f"{Bot._api_urls[req[0]]}/file/bot{req[0]}/{req[1]}" \
+                if req[0] in Bot._api_urls else fileurl(req)
+
+        Bot._api_urls[_config_value('bot', 'token')] = url.rstrip("/")
+        logger.info(f"Api calls of {self.name} are redirected to {url}")
+
+    def _load_access_list(self) -> None:
+        """
+        Builds the access list from the ids in the configuration and the given files, the changes kept in the persistent
+        storage are applied on startup
+        """
+
+        script_path = path.dirname(path.realpath(sys.argv[0]))
+
+        def ids(key: str) -> Union[set, None]:
+            listed = _config_value('general', key)
+            filename = _config_value('general', key + '_file')
+            if listed is None and filename is None:
+                return None
+            return set(listed or ()) | (AccessList.read(path.join(script_path, filename)) if filename else set())
+
+        self._session.access = AccessList(ids('allowed_ids'), ids('denied_ids'))
+
+    def _save_access_list(self) -> None:
+        """
+        Writes the access list into the persistent storage after the flush interval, if enabled, collecting further
+        changes until then
+        """
+
+        if self._session.database is None or self._access_flush is not None:
+            return
+
+        interval = self.context.run(_config_value, 'general', 'access_flush_interval', default=1.0)
+        self._access_flush = asyncio.get_event_loop().call_later(interval, self._flush_access_list,
+                                                                 context=self.context)
+
+    def _flush_access_list(self) -> None:
+        """
+        Writes the changes of the access list into the persistent storage
+        """
+
+        if self._access_flush is None:
+            return
+
+        self._access_flush.cancel()
+        self._access_flush = None
+        self._session.update_user_data(AccessList.storage_key, self._session.access.to_dict())
+
+    def allow(self, *users: Union[int, User]) -> None:
+        """
+        Adds chats or users to the allowed ones
+        :param users: The ids or user objects
+        """
+
+        self._session.access.allow(*(user.id if isinstance(user, User) else user for user in users))
+        self._save_access_list()
+
+    def revoke(self, *users: Union[int, User]) -> None:
+        """
+        Removes chats or users from the allowed ones
+        :param users: The ids or user objects
+        """
+
+        self._session.access.revoke(*(user.id if isinstance(user, User) else user for user in users))
+        self._save_access_list()
+
+    def deny(self, *users: Union[int, User]) -> None:
+        """
+        Adds chats or users to the denied ones
+        :param users: The ids or user objects
+        """
+
+        self._session.access.deny(*(user.id if isinstance(user, User) else user for user in users))
+        self._save_access_list()
+
+    def undeny(self, *users: Union[int, User]) -> None:
+        """
+        Removes chats or users from the denied ones
+        :param users: The ids or user objects
+        """
+
+        self._session.access.undeny(*(user.id if isinstance(user, User) else user for user in users))
+        self._save_access_list()
 
     @staticmethod
     def _configure_logger() -> None:
@@ -169,6 +586,10 @@ class Bot:
                  "critical": logging.CRITICAL
                  }.get(_config_value('general', 'logging', default="error").lower(), logging.WARNING)
 
+        # Bots created later log through the handlers of the first one
+        if logger.handlers:
+            return
+
         # Configure the logger
         logger.setLevel(level)
         shandler = logging.StreamHandler()
@@ -183,10 +604,14 @@ class Bot:
     @staticmethod
     def _initialize_persistent_storage(*args):
         """
-        Creates the default database
-        :param args: The file name to be used
+        Creates the default database, which is shared with other processes for a redis url
+        :param args: The file name or url to be used
         :return: The database connection
         """
+        if args[0].startswith("redis://"):
+            return RedisStore(args[0], cache_size=_config_value('general', 'storage_cache_size', default=10000),
+                              flush_interval=_config_value('general', 'storage_flush_interval', default=0.0),
+                              codec=_storage_codec())
         return TinyDB(args[0])
 
     @staticmethod
@@ -199,30 +624,34 @@ class Bot:
         Bot._initialize_persistent_storage = func
         return func
 
-    @staticmethod
-    def load_storage(func: Callable):
+    @_on_default_bot()
+    def load_storage(self, func: Callable):
         """
         Decorator to replace the default load method for the persistent storage
         :param func: The function which loads the user date
         :return: The unchanged function
         """
-        _Session.load_user_data = func
+        self._session.load_user_data = func
 
-    @staticmethod
-    def update_storage(func: Callable):
+    @_on_default_bot()
+    def update_storage(self, func: Callable):
         """
         Decorator to replace the default update method for the persistent storage
         :param func: The function which updates the user data
         :return: The unchanged function
         """
-        _Session.update_user_data = func
+        self._session.update_user_data = func
 
-    @staticmethod
-    def answer(message: str, mode: Mode = Mode.DEFAULT) -> Callable:
+    @_on_default_bot(factory=True)
+    def answer(self, message: str, mode: Mode = Mode.DEFAULT, cache_ttl: float = None,
+               cache_key: Union[str, Callable] = "global") -> Callable:
         """
         The wrapper for the inner decorator
         :param message: The message to react upon
         :param mode: The mode by which to interpret the given string
+        :param cache_ttl: The seconds the handler's result is reused for further messages, None disables the cache
+        :param cache_key: Whom a result is shared with, either global, language or user, or a function called with the
+            route's arguments returning the key. Different arguments of a route are always cached separately.
         :return: The decorator itself
         """
 
@@ -233,21 +662,36 @@ class Bot:
             :return: The function unchanged
             """
 
+            # Route to the cache of the results, which calls the function on a miss
+            handler = func
+            if cache_ttl is not None:
+                cache = self.route_caches[message] = _RouteCache(
+                    self, func, cache_ttl, cache_key,
+                    self.context.run(_config_value, 'bot', 'route_cache_size', default=1024))
+
+                async def handler(**kwargs):
+                    return await cache(**kwargs)
+
+                handler.__qualname__ = getattr(func, "__qualname__", str(func))
+                handler.__wrapped__ = func
+
             # Add the function keyed by the given message
             if mode == Mode.REGEX:
-                _Session.regex_routes[message] = func
-            if mode == Mode.PARSE:
-                _Session.parse_routes[message] = func
+                self._session.regex_routes[message] = handler
+            elif mode == Mode.PARSE:
+                self._session.parse_routes[message] = handler
+            elif mode == Mode.COMMAND:
+                self._session.command_routes[message] = handler
             else:
-                _Session.simple_routes[message] = func
+                self._session.simple_routes[message] = handler
 
             return func
 
         # Return the decorator
         return decorator
 
-    @staticmethod
-    def default_answer(func: Callable) -> Callable:
+    @_on_default_bot()
+    def default_answer(self, func: Callable) -> Callable:
         """
         A decorator for the function to be called if no other handler matches
         :param func: The function to be registered
@@ -255,11 +699,25 @@ class Bot:
         """
 
         # Remember the function
-        _Session.default_answer = func
+        self._session.default_answer = func
         return func
 
-    @staticmethod
-    def default_sticker_answer(func: Callable) -> Callable:
+    def inline_answer(self, func: Callable) -> Callable:
+        """
+        A decorator for the function to be called with the text of an inline query. It returns a list of results, either
+        as strings or as telepot's InlineQueryResult objects.
+        :param func: The function to be registered
+        :return: The unchanged function
+        """
+
+        # Remember the function and prepare the result cache
+        self._inline_session.handler = func
+        self._inline_session.cache = TTLCache(self.context.run(_config_value, 'inline', 'cache_ttl', default=60),
+                                              self.context.run(_config_value, 'inline', 'cache_size', default=1024))
+        return func
+
+    @_on_default_bot()
+    def default_sticker_answer(self, func: Callable) -> Callable:
         """
         A decorator for the function to be called if no other handler matches
         :param func: The function to be registered
@@ -267,7 +725,39 @@ class Bot:
         """
 
         # Remember the function
-        _Session.default_sticker_answer = func
+        self._session.default_sticker_answer = func
+        return func
+
+    def on_media(self, media: Media) -> Callable:
+        """
+        The wrapper for the inner decorator
+        :param media: The type of received media to react upon, e.g. Media.PHOTO
+        :return: The decorator itself
+        """
+
+        def decorator(func: Callable) -> Callable:
+            """
+            Adds the given method to the known media routes. The attachment is available via Context.media().
+            :param func: The function to be called
+            :return: The function unchanged
+            """
+
+            self._session.media_routes[media] = func
+            return func
+
+        # Return the decorator
+        return decorator
+
+    def on_edit(self, func: Callable) -> Callable:
+        """
+        A decorator for the function to be called if a user edits a message. The edited message is available via
+        Context.message(). Without this handler, edited messages are processed like new ones.
+        :param func: The function to be registered
+        :return: The unchanged function
+        """
+
+        # Remember the function
+        self._session.edit_answer = func
         return func
 
     async def schedule_startup(self):
@@ -280,6 +770,7 @@ class Bot:
 
         dummy = Dummy()
         dummy.user_id = None
+        dummy.chat_id = None
         dummy.bot = self._bot
 
         if self._on_startup is None:
@@ -301,160 +792,1554 @@ class Bot:
         # Remember the function
         self._on_startup = func
 
-    @classmethod
-    def on_termination(cls, func):
+    def every(self, interval: Union[float, timedelta], receiver: Union[str, int, User] = None) -> Callable:
+        """
+        The wrapper for the inner decorator
+        :param interval: The time between two calls, either in seconds or as timedelta
+        :param receiver: The recipient of returned answers which do not name one
+        :return: The decorator itself
+        """
+
+        if isinstance(interval, timedelta):
+            interval = interval.total_seconds()
+        if isinstance(receiver, User):
+            receiver = receiver.id
+
+        def decorator(func: Callable) -> Callable:
+            """
+            Registers the function to be called periodically, it returns answers like any other handler
+            :param func: The function to be called
+            :return: The function unchanged
+            """
+
+            Bot._jobs.every(self, interval, func, receiver)
+            return func
+
+        # Return the decorator
+        return decorator
+
+    def schedule_at(self, user: Union[str, int, User], when: Union[datetime, timedelta, float],
+                    answer: Union["Answer", str]) -> int:
+        """
+        Schedules an answer to be sent later, which is kept across restarts if the persistent storage is enabled.
+        Callbacks and keyboards of the answer are not kept.
+        :param user: The recipient, either as id or user object
+        :param when: The time to send the answer at, either as datetime or as delay in seconds or as timedelta
+        :param answer: The answer to be sent
+        :return: The job's id, which can be used to cancel it
+        """
+
+        if isinstance(when, datetime):
+            when = when.timestamp()
+        elif isinstance(when, timedelta):
+            when = time.time() + when.total_seconds()
+        else:
+            when = time.time() + when
+
+        if not isinstance(answer, Answer):
+            answer = Answer(str(answer))
+
+        # Remember the user's language for the language feature
+        language = user.language_code if isinstance(user, User) and user.language_code else None
+        receiver = user.id if isinstance(user, User) else user
+
+        return Bot._jobs.schedule(self, receiver, when, answer, language)
+
+    @staticmethod
+    def cancel_job(job_id: int) -> bool:
+        """
+        Cancels a scheduled job
+        :param job_id: The id returned on scheduling
+        :return: If the job was still pending
+        """
+
+        return Bot._jobs.cancel(job_id)
+
+    def queue_depths(self, include_idle: bool = False) -> Dict[Hashable, int]:
+        """
+        Reports the number of messages waiting in the sessions' mailboxes
+        :param include_idle: If sessions without waiting messages are included
+        :return: The depth keyed by the chat id, or the tuple of chat and user id for members of group chats
+        """
+
+        return {key: len(session.mailbox) for key, session in self._session.sessions.items()
+                if include_idle or session.mailbox}
+
+    def errors(self) -> List[Dict[str, Any]]:
+        """
+        Reports the errors which occurred while processing messages, aggregated by route, type and line
+        :return: A dictionary per kind of error with its count, first and last occurrence, last message and the
+            formatted tracebacks of the last error_samples occurrences
+        """
+
+        return [dict(entry, samples=["".join(traceback.format_exception(type(error), error, error.__traceback__))
+                                     for error in entry["samples"]])
+                for entry in self._session.errors.entries.values()]
+
+    @_on_default_bot()
+    def on_termination(self, func):
         """
         A decorator for a function to be called on the program's termination
         :param func:
         """
 
-        cls._on_termination = func
+        self._on_termination = func
 
-    @classmethod
-    def on_message_overflow(cls, func):
+    @_on_default_bot()
+    def on_message_overflow(self, func):
         """
         A decorator for a function to be called when a message exceeds the maximal length
         :param func:
         """
 
-        cls._on_message_overflow = func
+        self._on_message_overflow = func
 
     @staticmethod
     def _on_message_overflow(answer):
         """
-
+        Converts the overflowing text into a document, which is uploaded from memory
         :param answer: The answer which exceeded the maximal length
         :return: A tuple with a new message, media type, and media
         """
 
-        with open("Temp" + str(hash(answer)) + ".txt", "w") as f:
-            f.write(answer.msg + "\n")
-
-        # Schedule removal of the temp file after 5 seconds
-        if platform.system() == "Windows":
-            system('start /B cmd /C "sleep 5 && del Temp' + str(hash(answer)) + '.txt"')
-        else:
-            system('bash -c "sleep 5; rm Temp' + str(hash(answer)) + '.txt" &')
-
-        return "", Media.DOCUMENT, "Temp" + str(hash(answer)) + ".txt"
+        return "", Media.DOCUMENT, ("message.txt", io.BytesIO((answer.msg + "\n").encode("utf-8")))
 
     @staticmethod
     def signal_handler(sig, frame):
         """
-        A signal handler to catch a termination via CTR-C
+        A signal handler to catch a termination via CTR-C or SIGTERM, which shuts all bots down gracefully.
+        A second signal stops them without waiting any longer.
         """
 
-        Bot._on_termination()
-        logger.info("Bot shuts down")
-        quit(0)
+        running = asyncio.get_event_loop()
+        if not running.is_running():
+            Bot._hand_off_all()
+            logger.info("Bot shuts down")
+            quit(0)
+
+        # The loop is woken up, as it may wait for the next update
+        running.call_soon_threadsafe(Bot._on_signal)
 
     @staticmethod
-    def before_processing(func: Callable):
+    def _on_signal() -> None:
         """
-        A decorator for a function, which shall be called before each message procession
-        :param func:
+        Starts the shutdown on the first signal and cuts it short on the second
         """
 
-        Bot._before_function = func
+        if Bot._stopping is None:
+            Bot._stopping = asyncio.ensure_future(Bot.shutdown())
+        else:
+            logger.warning("Shutting down without waiting for the running handlers")
+            Bot._stopping.cancel()
 
-    def check_access_level(self, level: str):
+    @staticmethod
+    async def shutdown(timeout: float = None) -> None:
         """
-        The wrapper for the inner decorator
-        :param level: The access level that is evaluated by the decorated function
-        :return: The decorator
+        Shuts all bots down: stops receiving updates and starting jobs, lets the running handlers and jobs finish until
+        the timeout, hands the waiting and interrupted messages over to the next instance and stops the loop. Pending
+        writes to shared storages are completed afterwards by listen_all.
+        :param timeout: The seconds to wait, defaults to shutdown_timeout in the section general of the first bot
         """
 
-        def decorator(func: Callable):
-            """
+        if timeout is None:
+            timeout = Bot.instances[0].context.run(_config_value, 'general', 'shutdown_timeout', default=10.0)
+        logger.info(f"Shutting down, waiting up to {timeout} seconds for running handlers and jobs")
 
-            :param func: The function to be registered
-            :return: The unchanged function
-            """
+        # Stop receiving updates and starting jobs
+        for bot in Bot.instances:
+            if bot._polling is not None:
+                bot._polling.cancel()
+        if Bot._scheduling is not None:
+            Bot._scheduling.cancel()
 
-            self.access_checker[level] = func
+        # Messages still waiting are handed over right away, only the running handlers are finished
+        Bot._draining = True
+        for bot in Bot.instances:
+            bot._take_mailboxes()
 
-            return func
+        deadline = time.monotonic() + timeout
+        try:
+            while not Bot._idle() and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+        finally:
+            Bot._hand_off_all()
+            asyncio.get_event_loop().stop()
 
-        return decorator
+    @staticmethod
+    def _idle() -> bool:
+        """
+        Determines if no handler or job is running
+        :return: A boolean answering the call
+        """
 
-    def access_level(self, *levels: str):
+        if Bot._jobs is not None and Bot._jobs.running:
+            return False
+        return not any(session.current is not None
+                       for bot in Bot.instances for session in bot._session.sessions.values())
+
+    @staticmethod
+    def _hand_off_all() -> None:
         """
-        The wrapper for the inner decorator
-        :param levels: The access levels that grant permission for the decorated function.
-        :return: The decorator
+        Persists the state of all bots, which is otherwise only written in batches
         """
 
-        def decorator(func: Callable):
-            """
-            Wrapper for the decorating function
-            :param func: The function to be protected
-            :return: The decorated function
-            """
+        for bot in Bot.instances:
+            bot.context.run(bot._hand_off)
 
-            async def inner(**kwargs):
+        if Bot._jobs is not None:
+            Bot._jobs.save_state()
+
+    def _hand_off(self) -> None:
+        """
+        Writes the snapshot for the next instance into the state file: the last update id, the received messages which
+        were not processed, the pending jobs if they are not persisted by this process and the recently active users
+        """
+
+        # Messages being processed are interrupted and handed over before those which were still waiting
+        interrupted = 0
+        for key, session in self._session.sessions.items():
+            if session.current is not None:
+                interrupted += 1
+                self._handed.setdefault(key, []).insert(0, session.current)
+            if session._worker is not None:
+                session._worker.cancel()
+        self._take_mailboxes()
+        updates = [msg for messages in self._handed.values() for msg in messages]
+        self._handed.clear()
+
+        if interrupted:
+            logger.warning(f"{interrupted} handlers of {self.name} were interrupted by the shutdown")
+
+        self._on_termination()
+        self._flush_access_list()
+
+        # Summarize the errors which were only counted
+        self._session.errors.report()
+
+        if self._updates is None:
+            return
+        if self._updates.state_file is None:
+            if updates:
+                logger.warning(f"{len(updates)} received messages of {self.name} were not processed and are lost, as "
+                               f"no state_file is configured")
+            return
+
+        database = self._session.database
+        jobs = Bot._jobs.stored(self) if Bot._jobs is not None and not Bot._jobs.persists(self) else {}
+        users = database.recent() if isinstance(database, KeyValueStore) else []
+        self._updates.hand_off(updates, jobs, users)
+
+        if updates:
+            logger.info(f"{len(updates)} received messages of {self.name} are handed over to the next instance")
+
+    def _take_mailboxes(self) -> None:
+        """
+        Takes the waiting messages out of the sessions' mailboxes, as they are not processed by this instance anymore
+        """
+
+        for key, session in self._session.sessions.items():
+            if session.mailbox:
+                self._handed.setdefault(key, []).extend(session.mailbox)
+                session.mailbox.clear()
+
+    @_on_default_bot()
+    def before_processing(self, func: Callable):
+        """
+        A decorator for a function, which shall be called before each message procession
+        :param func:
+        """
+
+        self._session.before_function = func
+
+    def check_access_level(self, level: str):
+        """
+        The wrapper for the inner decorator
+        :param level: The access level that is evaluated by the decorated function
+        :return: The decorator
+        """
+
+        def decorator(func: Callable):
+            """
+
+            :param func: The function to be registered, either synchronous or asynchronous
+            :return: The unchanged function
+            """
+
+            self.access_checker[level] = func
+
+            return func
+
+        return decorator
+
+    def invalidate_access(self, user: Union[int, User] = None, level: str = None) -> None:
+        """
+        Removes cached results of the access checkers, e.g. after a user's role changed
+        :param user: The user whose results are removed, None for all users
+        :param level: The level whose results are removed, None for all levels
+        """
+
+        if self.access_cache is None:
+            return
+
+        if isinstance(user, User):
+            user = user.id
+
+        if user is None and level is None:
+            self.access_cache.clear()
+        elif user is None:
+            for key in [key for key in self.access_cache.keys() if key[0] == level]:
+                self.access_cache.pop(key)
+        else:
+            for checked in (self.access_checker if level is None else (level,)):
+                self.access_cache.pop((checked, user))
+
+    def invalidate_cache(self, message: str = None) -> None:
+        """
+        Removes cached results of routes, e.g. after the content they show changed
+        :param message: The message the route was registered with, None for all routes
+        """
+
+        for cache in (self.route_caches.values() if message is None else (self.route_caches[message],)):
+            cache.results.clear()
+
+    @staticmethod
+    async def profile(seconds: float = None, updates: int = None, route: str = None, mode: str = "cprofile") -> str:
+        """
+        Profiles all bots of the process for a number of seconds or updates, whichever is reached first, and writes the
+        result to the directory configured as output in the section profiling
+        :param seconds: The seconds to profile, 10 if neither seconds nor updates are given
+        :param updates: The number of updates to profile, or of calls of the route if one is given
+        :param route: A simple route or command like /status, or the name of a handler, whose calls are profiled only
+        :param mode: Either cprofile, written as pstats file, or sampling, written as collapsed stacks for flame graphs
+        :return: A summary naming the written file and the functions taking the most time
+        """
+
+        from samt.profiler import Profiler
+
+        if Bot._profiling is not None:
+            raise RuntimeError("A profile is already running")
+
+        bot = Bot.instances[0]
+        directory = bot.context.run(_config_value, 'profiling', 'output', default="profiles")
+        profiler = Profiler(mode, Bot._handler_name(route) if route is not None else None,
+                            path.join(path.dirname(path.realpath(sys.argv[0])), directory),
+                            bot.context.run(_config_value, 'profiling', 'sample_interval', default=0.005))
+
+        Bot._profiling = profiler
+        try:
+            return await profiler.run(seconds, updates,
+                                      bot.context.run(_config_value, 'profiling', 'max_seconds', default=300))
+        finally:
+            Bot._profiling = None
+
+    @staticmethod
+    def _handler_name(route: str) -> str:
+        """
+        Determines the name of the handler registered for a route
+        :param route: A simple route or command, or the name of a handler
+        :return: The handler's name
+        """
+
+        for bot in Bot.instances:
+            handler = bot._session.simple_routes.get(route) or bot._session.command_routes.get(route)
+            if handler is not None:
+                return getattr(handler, "__qualname__", route)
+
+        return route
+
+    async def _profile_command(self, options: str = "") -> Union["Answer", None]:
+        """
+        Starts a profile on request of an admin
+        :param options: The options as understood by samt.profiler.parse_options
+        :return: The summary of the profile
+        """
+
+        user = _user.get()
+        if user is None or user.id not in _config_value('profiling', 'admins', default=[]):
+            logger.warning(f"User {user} requested a profile without being admin")
+            return None
+
+        from samt.profiler import parse_options
+
+        try:
+            summary = await Bot.profile(**parse_options(options))
+        except (ValueError, RuntimeError) as e:
+            summary = str(e)
+
+        # Names like <lambda> must not be taken as markup
+        answer = Answer(summary)
+        answer.markup = None
+        answer.language_feature = False
+        return answer
+
+    @staticmethod
+    def loop_stats() -> Dict[str, Any]:
+        """
+        Summarizes the lag of the event loop and the callbacks which blocked it, most recent last
+        :return: The lag's median, 99th percentile and maximum in seconds, the number of blocks and their findings with
+            the time, duration, bot, route, user and stack
+        """
+
+        if Bot._watchdog is None:
+            return {}
+        return Bot._watchdog.stats()
+
+    def cache_stats(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        """
+        Summarizes the lookups of the cached routes
+        :return: The numbers of hits, misses, coalesced misses and cached results and the hit rate by route
+        """
+
+        return {message: cache.stats() for message, cache in self.route_caches.items()}
+
+    async def _check_access(self, levels: Tuple[str, ...]) -> bool:
+        """
+        Evaluates the checkers of the given levels concurrently until one of them grants access
+        :param levels: The access levels that grant permission
+        :return: If any level granted access
+        """
+
+        user = _user.get()
+        cache = self.access_cache if user is not None else None
+
+        # Cached results spare calling the checkers
+        pending = []
+        for level in levels:
+            if cache is not None:
+                granted = cache.get((level, user.id))
+                if granted is not None:
+                    if granted:
+                        return True
+                    continue
+            pending.append(level)
+
+        # Synchronous checkers are called directly, asynchronous ones are awaited together
+        tasks = {}
+        try:
+            for level in pending:
+                checker = self.access_checker.get(level, lambda: False)
+                if iscoroutinefunction(checker):
+                    tasks[asyncio.ensure_future(checker())] = level
+                    continue
+
+                granted = bool(checker())
+                if cache is not None:
+                    cache[(level, user.id)] = granted
+                if granted:
+                    return True
+
+            # Stop at the first level granting access
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    level = tasks.pop(task)
+                    granted = bool(task.result())
+                    if cache is not None:
+                        cache[(level, user.id)] = granted
+                    if granted:
+                        return True
+
+            return False
+
+        # Checkers still running are not needed anymore
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def access_level(self, *levels: str):
+        """
+        The wrapper for the inner decorator
+        :param levels: The access levels that grant permission for the decorated function.
+        :return: The decorator
+        """
+
+        def decorator(func: Callable):
+            """
+            Wrapper for the decorating function
+            :param func: The function to be protected
+            :return: The decorated function
+            """
+
+            async def inner(**kwargs):
                 """
                 Checks all given access levels and calls the given function if one of them evaluated to true
                 :return: The message handler's usual output or None
                 """
 
-                # Iterate through all given levels
-                for level in levels:
-                    if self.access_checker.get(level, lambda: False)():
+                # If one level evaluated to True, call the function as usual
+                if await self._check_access(levels):
+                    if iscoroutinefunction(func):
+                        return await func(**kwargs)
+                    else:
+                        return func(**kwargs)
+
+                # If no level evaluated to True, raise error
+                raise AuthorizationError()
+
+            # Cached routes check the levels themselves
+            inner.access_levels = levels
+            inner.__wrapped__ = func
+            return inner
+
+        return decorator
+
+    def ensure_parameter(self, name: str, phrase: str, choices: Collection[str] = None):
+        """
+        The wrapper for the inner decorator
+        :param name: The name of the parameter to provide
+        :param phrase: The phrase to use when asking the user for the parameter
+        :param choices: The choices to show the user as callback
+        :return: The decorator
+        """
+
+        def decorator(func: Callable):
+            """
+            Wrapper for the decorating function
+            :param func: The function to be protected
+            :return: The decorated function
+            """
+
+            async def inner(**kwargs):
+                """
+                Checks if the requested parameter exists and aks the user to provide it, if it misses
+                :return: The message handler's usual output
+                """
+
+                # Check if the parameter exists
+                if name not in kwargs:
+                    # If not, ask the user for it
+                    temp = (yield Answer(phrase, choices=choices))
+                    kwargs[name] = temp
+
+                # If one level evaluated to True, call the function as usual
+                if iscoroutinefunction(func):
+                    yield await func(**kwargs)
+                else:
+                    yield func(**kwargs)
+
+            # Commands split their arguments by the function's parameters
+            inner.__wrapped__ = func
+            return inner
+
+        return decorator
+
+
+class _UpdateLoop(object):
+    """
+    Polls the updates from Telegram and passes them to telepot like its MessageLoop, but skips duplicates and persists the
+    id of the last update, which was processed as well as all before, so a restarted bot resumes where it stopped
+    """
+
+    def __init__(self, bot: telepot.aio.DelegatorBot, state_file: str = None, window: int = 1000,
+                 flush_every: int = 100, flush_interval: float = 1.0):
+        """
+        Initializes the loop and loads the last update id
+        :param bot: The telepot bot
+        :param state_file: The file to persist the last update id in, or None to disable it
+        :param window: The number of recent messages and queries remembered to detect duplicates
+        :param flush_every: The number of updates after which the update id is persisted
+        :param flush_interval: The seconds after which the update id is persisted
+        """
+
+        self._bot = bot
+        self.state_file = state_file
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.duplicates = DedupWindow(window)
+
+        self.state = dict()
+        if state_file is not None and path.exists(state_file):
+            with open(state_file) as f:
+                self.state = json.load(f)
+
+        # What the previous instance handed over is only taken once
+        self.handoff: Dict[str, Any] = self.state.pop("handoff", {})
+
+        # The last received update id, the last one processed as well as all before and the last persisted one
+        self.update_id = self.state.get("update_id")
+        self.confirmed_id = self.update_id
+        self._saved_id = self.update_id
+        self._saved_time = time.monotonic()
+
+        # The updates of the last poll, which sessions may still take up, and those taken up by a session and not
+        # processed yet, keyed by the identity of their message
+        self._dispatched: Dict[int, Tuple[int, Dict]] = dict()
+        self._processing: Dict[int, Tuple[int, Dict]] = dict()
+
+    def _handle(self, msg: Dict) -> None:
+        # The delegator bot dispatches synchronously to its sessions, a plain bot's handler is a coroutine
+        if iscoroutinefunction(self._bot.handle):
+            self._bot.loop.create_task(self._bot.handle(msg))
+        else:
+            self._bot.handle(msg)
+
+    async def run_forever(self, relax: float = 0.1, timeout: int = None) -> None:
+        """
+        Polls and dispatches the updates until cancelled
+        :param relax: The seconds to wait between two polls
+        :param timeout: The timeout for long polling
+        """
+
+        # Timeouts of the sessions are dispatched as well
+        self._bot.scheduler.on_event(self._handle)
+
+        # The messages the previous instance received but did not process come first
+        updates = self.handoff.pop("updates", [])
+        for msg in updates:
+            self._handle(msg)
+        if updates:
+            logger.info(f"Processing {len(updates)} messages handed over by the previous instance")
+            self._write(self.update_id)
+
+        while True:
+            try:
+                self._confirm()
+                if self._due():
+                    await asyncio.get_event_loop().run_in_executor(None, self.save_state)
+
+                # Telegram drops the updates before the offset, only those after the persisted id may be delivered again
+                offset = self.update_id + 1 if self.update_id is not None else None
+                for update in await self._bot.getUpdates(offset=offset, timeout=timeout):
+
+                    # Updates processed before a restart are skipped
+                    if self.update_id is not None and update['update_id'] <= self.update_id:
+                        continue
+                    self.update_id = update['update_id']
+
+                    flavor, msg = _extract_message(update)
+                    if self.duplicates.seen(self._key(flavor, msg)):
+                        logger.debug(f"Skipped duplicate update {update['update_id']}")
+                        continue
+
+                    self._dispatched[id(msg)] = (update['update_id'], msg)
+                    self._handle(msg)
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.warning(f"Polling the updates failed: {e!r}")
+
+            await asyncio.sleep(relax)
+
+    def take(self, msg: Dict) -> None:
+        """
+        Notes that a session took up a message, whose update is not confirmed until the session processed it
+        :param msg: The received message as dictionary
+        """
+
+        entry = self._dispatched.pop(id(msg), None)
+        if entry is not None:
+            self._processing[id(msg)] = entry
+
+    def done(self, msg: Dict) -> None:
+        """
+        Notes that a session processed, dropped or rejected a message
+        :param msg: The received message as dictionary
+        """
+
+        self._processing.pop(id(msg), None)
+
+    def _confirm(self) -> None:
+        """
+        Advances the id of the last update, which was processed as well as all before
+        """
+
+        # The messages of the last poll, which no session took up in the meantime, are not processed at all
+        self._dispatched.clear()
+
+        if self._processing:
+            self.confirmed_id = min(update_id for update_id, _ in self._processing.values()) - 1
+        else:
+            self.confirmed_id = self.update_id
+
+    @staticmethod
+    def _key(flavor: str, msg: Dict) -> Hashable:
+        """
+        Determines the key identifying a message or query independent of its update
+        :param flavor: The kind of the update
+        :param msg: The message or query as dictionary
+        :return: The key
+        """
+
+        if flavor in ("message", "channel_post"):
+            return msg['chat']['id'], msg['message_id']
+        elif flavor in ("edited_message", "edited_channel_post"):
+            return msg['chat']['id'], msg['message_id'], msg.get('edit_date')
+        else:
+            return flavor, msg.get('id')
+
+    def _due(self) -> bool:
+        """
+        Determines if enough updates or time passed to persist the update id
+        :return: A boolean answering the call
+        """
+
+        if self.state_file is None or self.confirmed_id == self._saved_id:
+            return False
+        if self._saved_id is None or self.confirmed_id - self._saved_id >= self.flush_every:
+            return True
+        return time.monotonic() - self._saved_time >= self.flush_interval
+
+    def save_state(self) -> None:
+        """
+        Writes the id of the last update, which was processed as well as all before, to the state file, replacing it
+        atomically
+        """
+
+        if self.state_file is None or self.confirmed_id == self._saved_id:
+            return
+
+        self._write(self.confirmed_id)
+
+    def hand_off(self, updates: List[Dict], jobs: Dict[str, Dict], users: List[Hashable]) -> None:
+        """
+        Writes the last received update id to the state file together with a snapshot for the next instance
+        :param updates: The received messages, which were not processed
+        :param jobs: The pending one-off jobs, which are not kept in a persistent storage
+        :param users: The keys of the records to read ahead
+        """
+
+        self.state["handoff"] = {"updates": updates, "jobs": jobs, "users": users}
+        try:
+            self._write(self.update_id)
+        finally:
+            del self.state["handoff"]
+
+    def _write(self, update_id: Union[int, None]) -> None:
+        """
+        Replaces the state file atomically
+        :param update_id: The id of the last update, which does not need to be processed again
+        """
+
+        if self.state_file is None:
+            return
+
+        self.state["update_id"] = update_id
+        with open(self.state_file + ".tmp", "w") as f:
+            json.dump(self.state, f)
+        os.replace(self.state_file + ".tmp", self.state_file)
+
+        self._saved_id = update_id
+        self._saved_time = time.monotonic()
+
+
+class _ErrorLog(object):
+    """
+    Aggregates exceptions by route, type and line. Only the first occurrence of each is logged in full, repetitions are
+    counted and summarized periodically, and only the most recent exceptions are kept as samples, whose tracebacks are
+    formatted when they are reported.
+    """
+
+    def __init__(self, samples: int = 3, report_interval: float = 60.0):
+        """
+        Initializes an empty log
+        :param samples: The number of tracebacks kept per kind of error
+        :param report_interval: The minimal seconds between two summaries of the same error
+        """
+
+        self.samples = samples
+        self.report_interval = report_interval
+        self.entries: Dict[Tuple[str, str, str, int], Dict[str, Any]] = dict()
+
+    def record(self, route: str, error: BaseException) -> bool:
+        """
+        Counts an exception
+        :param route: The name of the handler or step which failed
+        :param error: The caught exception
+        :return: If this is the first occurrence, which should be logged in full
+        """
+
+        # The innermost frame is found without extracting the whole traceback
+        tb = error.__traceback__
+        while tb is not None and tb.tb_next is not None:
+            tb = tb.tb_next
+        filename, line = (tb.tb_frame.f_code.co_filename, tb.tb_lineno) if tb is not None else ("", 0)
+
+        key = (route, type(error).__name__, filename, line)
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = {
+                "route": route, "type": type(error).__name__, "file": filename.split("/")[-1], "line": line,
+                "count": 0, "first_seen": now, "last_seen": now, "reported": now, "unreported": 0,
+                "message": "", "samples": deque(maxlen=self.samples)
+            }
+
+        entry["count"] += 1
+        entry["last_seen"] = now
+        entry["message"] = str(error)
+        entry["samples"].append(error)
+
+        if entry["count"] == 1:
+            return True
+
+        entry["unreported"] += 1
+        if now - entry["reported"] >= self.report_interval:
+            self._summarize(entry, now)
+        return False
+
+    def report(self) -> None:
+        """
+        Logs the summaries of all errors which occurred since their last summary
+        """
+
+        now = time.time()
+        for entry in self.entries.values():
+            if entry["unreported"] > 0:
+                self._summarize(entry, now)
+
+    @staticmethod
+    def _summarize(entry: Dict[str, Any], now: float) -> None:
+        logger.warning(f"{entry['type']} in {entry['route']} ({entry['file']}:{entry['line']}) occurred "
+                       f"{entry['unreported']} more times since the last report, {entry['count']} times in total"
+                       f"\n\tLast message: {entry['message']}")
+        entry["unreported"] = 0
+        entry["reported"] = now
+
+
+class _RouteCache(object):
+    """
+    The cached results of a route, shared by all messages with the same key until they expire. Concurrent misses of a
+    key wait for the first one instead of calling the handler as well.
+    """
+
+    # The marker of a missing result, as None is a valid one
+    _missing = object()
+
+    def __init__(self, bot: "Bot", func: Callable, ttl: float, key: Union[str, Callable] = "global",
+                 maxsize: int = 1024):
+        """
+        Initializes an empty cache
+        :param bot: The bot whose access checkers protect the route
+        :param func: The handler, possibly protected by access levels, which are still checked on every message
+        :param ttl: The seconds a result is kept
+        :param key: Either global, language or user, or a function called with the route's arguments returning the key
+        :param maxsize: The maximal number of cached results
+        """
+
+        if not callable(key) and key not in ("global", "language", "user"):
+            raise ValueError(f"Unknown cache key {key}, use global, language, user or a function")
+
+        # The access levels are checked before the lookup, the unprotected handler is called on a miss
+        self.bot = bot
+        self.levels: Union[Tuple[str, ...], None] = getattr(func, "access_levels", None)
+        self.func = func.__wrapped__ if self.levels is not None else func
+        self.key = key
+        self.results = TTLCache(ttl, maxsize)
+        self._pending: Dict[Hashable, asyncio.Future] = dict()
+
+        # Statistics of the lookups, misses are the calls of the handler
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _key(self, kwargs: Dict[str, Any]) -> Hashable:
+        """
+        Determines the key of a message
+        :param kwargs: The route's arguments
+        :return: The key
+        """
+
+        if callable(self.key):
+            return self.key(**kwargs)
+
+        if self.key == "global":
+            part = None
+        elif self.key == "language":
+            part = Answer._language_code()
+        else:
+            user = _user.get()
+            part = user.id if user is not None else None
+
+        return part, tuple(sorted(kwargs.items()))
+
+    @staticmethod
+    def _cacheable(value: Any) -> bool:
+        """
+        Determines if a result can be sent again, which generators and streams cannot
+        :param value: The handler's result
+        :return: If the result may be cached
+        """
+
+        if value is None or isgenerator(value) or isasyncgen(value):
+            return False
+        return not any(isinstance(item, Stream) for item in (value if isinstance(value, (tuple, list)) else (value,)))
+
+    @staticmethod
+    def _copy(value: Any) -> Any:
+        """
+        Copies the answers of a result, as sending changes them
+        :param value: A cached result
+        :return: The result with copied answers
+        """
+
+        if isinstance(value, Answer):
+            return copy.copy(value)
+        if isinstance(value, (tuple, list)):
+            return type(value)(_RouteCache._copy(item) for item in value)
+        return value
+
+    async def __call__(self, **kwargs) -> Any:
+        """
+        Returns the cached result of a message or calls the handler
+        :param kwargs: The route's arguments
+        :return: The handler's result
+        """
+
+        # Cached results are only given to permitted users
+        if self.levels is not None and not await self.bot._check_access(self.levels):
+            raise AuthorizationError()
+
+        key = self._key(kwargs)
+        try:
+            value = self.results.get(key, self._missing)
+        except TypeError:
+            # Arguments which cannot be hashed are not cached
+            self.misses += 1
+            return await self._call(kwargs)
+
+        if value is not self._missing:
+            self.hits += 1
+            return self._copy(value)
+
+        # Wait for a concurrent miss, which calls the handler anyway
+        pending = self._pending.get(key)
+        if pending is not None:
+            value = await asyncio.shield(pending)
+            if value is not self._missing:
+                self.coalesced += 1
+                return self._copy(value)
+
+        self.misses += 1
+        future = self._pending[key] = asyncio.get_event_loop().create_future()
+        shared = self._missing
+        try:
+            value = await self._call(kwargs)
+            if not self._cacheable(value):
+                return value
+
+            shared = self.results[key] = value
+            return self._copy(value)
+
+        # Waiting messages call the handler themselves, if it failed or its result cannot be shared
+        finally:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+            future.set_result(shared)
+
+    async def _call(self, kwargs: Dict[str, Any]) -> Any:
+        if iscoroutinefunction(self.func):
+            return await self.func(**kwargs)
+        return self.func(**kwargs)
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Summarizes the lookups
+        :return: The numbers of hits, misses, coalesced misses and cached results and the rate of spared calls
+        """
+
+        total = self.hits + self.coalesced + self.misses
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "size": len(self.results),
+                "hit_rate": (self.hits + self.coalesced) / total if total else 0.0}
+
+
+class _Watchdog(object):
+    """
+    Measures the lag of the event loop and finds the callbacks blocking it. The loop beats periodically, while a thread
+    checks the beats and captures the stack of the loop's thread, if the loop did not respond for longer than the
+    threshold. The handler and user responsible are looked up by the running task.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.5, samples: int = 1000, findings: int = 100):
+        """
+        Initializes the watchdog without starting it
+        :param interval: The seconds between two beats of the loop
+        :param threshold: The seconds the loop may lag before the blocking callback is reported
+        :param samples: The number of recent lags kept for the statistics
+        :param findings: The number of recent blocking callbacks kept
+        """
+
+        self.interval = interval
+        self.threshold = threshold
+        self.lags: deque = deque(maxlen=samples)
+        self.findings: deque = deque(maxlen=findings)
+        self.blocked = 0
+
+        # The handlers of the running tasks with the names of their bots and their users
+        self.active: Dict[asyncio.Future, List] = dict()
+
+        self._loop: Union[asyncio.AbstractEventLoop, None] = None
+        self._loop_thread: Union[int, None] = None
+        self._beat = time.monotonic()
+        self._open: Union[Dict[str, Any], None] = None
+        self._stopped = False
+
+    def track(self, route: str, user: Any = None) -> None:
+        """
+        Remembers the handler the current task runs, replacing the one remembered before
+        :param route: The name of the handler
+        :param user: The user whose message is processed
+        """
+
+        bot = _bot.get()
+        self.active[asyncio.current_task()] = [bot.name if bot is not None else None, route, user]
+
+    def untrack(self) -> None:
+        """
+        Forgets the handler of the current task
+        """
+
+        self.active.pop(asyncio.current_task(), None)
+
+    async def run_forever(self) -> None:
+        """
+        Beats until cancelled and starts the watching thread
+        """
+
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        threading.Thread(target=self._watch, name="samt-watchdog", daemon=True).start()
+
+        try:
+            while True:
+                start = time.monotonic()
+                await asyncio.sleep(self.interval)
+                self._beat = now = time.monotonic()
+                lag = now - start - self.interval
+                self.lags.append(lag)
+
+                # The loop responds again, so a reported block is over
+                finding, self._open = self._open, None
+                if finding is not None:
+                    finding["duration"] = lag
+                    logger.info(f"The event loop was blocked for {lag:.3f} seconds by {finding['route']}")
+        finally:
+            self._stopped = True
+
+    def stop(self) -> None:
+        """
+        Ends the watching thread
+        """
+
+        self._stopped = True
+
+    def _watch(self) -> None:
+        """
+        Checks the beats of the loop from a separate thread
+        """
+
+        while not self._stopped:
+            time.sleep(self.interval)
+            lag = time.monotonic() - self._beat - self.interval
+            if lag > self.threshold and self._open is None and not self._stopped:
+                self._capture(lag)
+
+    def _capture(self, lag: float) -> None:
+        """
+        Records the callback blocking the loop with its stack and the handler of the running task
+        :param lag: The seconds the loop did not respond so far
+        """
+
+        # The frames of the loop itself, up to the call of the blocking callback, are left out
+        frame = sys._current_frames().get(self._loop_thread)
+        entries = traceback.extract_stack(frame) if frame is not None else []
+        for i in range(len(entries) - 1, -1, -1):
+            if entries[i].filename.endswith(path.join("asyncio", "events.py")):
+                entries = entries[i + 1:]
+                break
+        stack = "".join(traceback.format_list(entries))
+        task = asyncio.current_task(self._loop)
+        bot, route, user = self.active.get(task, (None, None, None))
+        if route is None:
+            route = "a callback outside of any handler"
+
+        self.blocked += 1
+        self._open = finding = {"time": time.time(), "duration": lag, "bot": bot, "route": route,
+                                "user": str(user) if user is not None else None, "stack": stack}
+        self.findings.append(finding)
+
+        logger.warning(f"The event loop is blocked for more than {self.threshold} seconds by {route}"
+                       + (f" of bot {bot}" if bot is not None else "")
+                       + (f" processing a message of {user}" if user is not None else "")
+                       + "\n" + stack)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Summarizes the recent lags and blocking callbacks
+        :return: The lags' percentiles and maximum in seconds, the number of blocks and the recent findings
+        """
+
+        lags = sorted(self.lags)
+
+        def percentile(p: float) -> float:
+            return lags[min(len(lags) - 1, int(p * len(lags)))] if lags else 0.0
+
+        return {"samples": len(lags), "lag_p50": percentile(0.5), "lag_p99": percentile(0.99),
+                "lag_max": lags[-1] if lags else 0.0, "blocked": self.blocked,
+                "findings": [dict(finding) for finding in self.findings]}
+
+
+class _Job(object):
+    """
+    A pending job, either a persisted one-off answer or a registered periodic function
+    """
+
+    __slots__ = ("id", "when", "owner", "answer", "func", "interval", "receiver")
+
+    def __init__(self, id: int, when: float, owner: "Bot", answer: Dict = None, func: Callable = None,
+                 interval: float = None, receiver: Union[str, int] = None):
+        self.id = id
+        self.when = when
+        self.owner = owner
+        self.answer = answer
+        self.func = func
+        self.interval = interval
+        self.receiver = receiver
+
+
+class _Scheduler(object):
+    """
+    Runs delayed and periodic jobs by keeping their due times in a heap, which is consumed by a single timer task.
+    It is shared by all bots of the process, so the limit of running jobs applies to all of them together.
+    One-off jobs are persisted in buckets of consecutive ids under reserved keys of their bot's persistent storage, so
+    a change only rewrites its bucket, and reloaded on startup. If several processes share the storage, only the one
+    holding the lease on a bot's jobs runs and persists them, the others keep their jobs like without a storage.
+    """
+
+    # The key of the record listing the buckets in the persistent storage and the number of ids per bucket
+    storage_key = "_<[jobs]>_"
+    bucket_size = 1000
+
+    # The key of the lease on the persisted jobs in a shared storage
+    lease_key = "_<[jobs:lease]>_"
+
+    def __init__(self, max_concurrent: int = 16, flush_interval: float = 1.0, lease_duration: float = 30.0):
+        """
+        Initializes the scheduler
+        :param max_concurrent: The maximal number of jobs running at the same time
+        :param flush_interval: The seconds changes are collected before they are persisted
+        :param lease_duration: The seconds until the lease on the jobs in a shared storage expires, unless renewed
+        """
+
+        self.max_concurrent = max_concurrent
+        self.flush_interval = flush_interval
+        self.lease_duration = lease_duration
+
+        self.jobs: Dict[int, _Job] = dict()
+        self._heap: List[Tuple[float, int]] = []
+        self._ids = count(1)
+        self._wakeup = asyncio.Event()
+        self._semaphore: Union[asyncio.Semaphore, None] = None
+        self._flush_handle = None
+
+        # The ids of the one-off jobs by their bot and bucket, the persisted buckets of each bot and the changed ones
+        self._buckets: Dict[Tuple["Bot", int], Set[int]] = dict()
+        self._stored_buckets: Dict["Bot", Set[int]] = dict()
+        self._dirty: Set[Tuple["Bot", int]] = set()
+
+        # The bots with a shared storage whose persisted jobs this process runs or another one does, and the name the
+        # leases are held with
+        self._leased: Set["Bot"] = set()
+        self._shared: Set["Bot"] = set()
+        self._holder = uuid.uuid4().hex
+
+        # The jobs currently running
+        self.running: Set[asyncio.Future] = set()
+
+    @staticmethod
+    def _bucket_key(bucket: int) -> str:
+        return f"_<[jobs:{bucket}]>_"
+
+    def bucket_keys(self, owner: "Bot") -> List[str]:
+        """
+        Lists the keys of a bot's persisted buckets, e.g. to read them ahead from a shared storage
+        :param owner: The bot
+        :return: The keys
+        """
+
+        buckets = owner._session.load_user_data(self.storage_key).get("buckets", [])
+        return [self._bucket_key(bucket) for bucket in buckets]
+
+    def persists(self, owner: "Bot") -> bool:
+        """
+        Determines if the one-off jobs of a bot are persisted by this process
+        :param owner: The bot
+        :return: A boolean answering the call
+        """
+
+        return owner._session.database is not None and owner not in self._shared
+
+    async def acquire(self, owner: "Bot") -> None:
+        """
+        Takes or renews the lease on the persisted jobs of a bot with a shared storage. Taking it loads the jobs and
+        persists those kept in memory so far, losing it drops the persisted jobs, as another process runs them now.
+        :param owner: The bot
+        """
+
+        store = owner._session.database
+        try:
+            held = await store.lease(self.lease_key, self._holder, self.lease_duration)
+        except Exception as e:
+            logger.warning(f"Renewing the lease on the jobs of {owner.name} failed:\n\t\t{e!r}")
+            held = False
+
+        if held and owner not in self._leased:
+            logger.info(f"This process runs the persisted jobs of {owner.name}")
+            self._shared.discard(owner)
+            self._leased.add(owner)
+
+            # The buckets of the jobs kept so far are read as well, as their records may exist without being listed
+            kept = [job for job in self.jobs.values() if job.owner is owner and job.func is None]
+            await store.load(self.storage_key)
+            await store.load(*self.bucket_keys(owner), *{self._bucket_key(job.id // self.bucket_size) for job in kept})
+            self.load(owner)
+            for job in kept:
+                self._track(job)
+
+        elif not held and owner in self._leased:
+            logger.warning(f"The lease on the jobs of {owner.name} expired, another process runs them now")
+            self._leased.discard(owner)
+            self._shared.add(owner)
+            for job in [job for job in self.jobs.values() if job.owner is owner and job.func is None]:
+                del self.jobs[job.id]
+            for bucket in [bucket for bucket in self._buckets if bucket[0] is owner]:
+                del self._buckets[bucket]
+            self._dirty = {bucket for bucket in self._dirty if bucket[0] is not owner}
+
+        elif not held and owner not in self._shared:
+            logger.info(f"Another process runs the persisted jobs of {owner.name}, jobs scheduled here are kept in "
+                        f"memory")
+            self._shared.add(owner)
+
+    async def _renew_forever(self) -> None:
+        """
+        Renews the leases on jobs in shared storages, and takes over those which expired
+        """
+
+        while True:
+            await asyncio.sleep(self.lease_duration / 3)
+            for owner in list(self._leased | self._shared):
+                try:
+                    await owner.context.run(asyncio.ensure_future, self.acquire(owner))
+                except Exception as e:
+                    logger.warning(f"Taking over the jobs of {owner.name} failed:\n\t\t{e!r}")
+
+    def load(self, owner: "Bot") -> None:
+        """
+        Loads the persisted jobs of a bot with their ids. Periodic jobs registered before are numbered after them, as
+        their ids are not kept anyway. A stored job whose id is taken by another bot's job gets a new one.
+        :param owner: The bot whose jobs are loaded
+        """
+
+        index = owner._session.load_user_data(self.storage_key)
+        self._stored_buckets[owner] = set(index.get("buckets", []))
+
+        stored = dict()
+        for key in self.bucket_keys(owner):
+            stored.update(owner._session.load_user_data(key).get("jobs", {}))
+
+        # Earlier versions kept all jobs in a single record, they are moved into buckets
+        legacy = index.get("jobs", {})
+        stored.update(legacy)
+
+        self.restore(owner, stored, persisted=not legacy)
+
+        # Buckets which became empty are not listed anymore, but their records are kept, so their ids are not reused
+        highest = index.get("highest")
+        if highest is not None and highest not in self._stored_buckets[owner]:
+            self._ids = count(max(next(self._ids), (highest + 1) * self.bucket_size))
+
+    def restore(self, owner: "Bot", stored: Dict[str, Dict], persisted: bool = False) -> None:
+        """
+        Adds stored jobs of a bot, keeping their ids where possible
+        :param owner: The bot whose jobs are added
+        :param stored: The jobs' values by their ids
+        :param persisted: If the jobs are persisted under their ids already, so only renumbered ones are written
+        """
+
+        self._ids = count(max(max(self.jobs, default=0), max(map(int, stored), default=0)) + 1)
+
+        for key, job in stored.items():
+            job_id = int(key)
+            taken = self.jobs.get(job_id)
+            if taken is not None and taken.func is not None:
+                del self.jobs[job_id]
+                taken.id = next(self._ids)
+                self._push(taken)
+            elif taken is not None:
+                job_id = next(self._ids)
+
+            job = _Job(job_id, job["when"], owner, answer=job["answer"], receiver=job["answer"]["receiver"])
+            self._push(job)
+            self._track(job, changed=not persisted or job_id != int(key))
+
+            # The bucket of a renumbered job is written without it
+            if persisted and job_id != int(key):
+                self._changed((owner, int(key) // self.bucket_size))
+
+        if stored:
+            logger.info(f"Loaded {len(stored)} scheduled jobs")
+
+    def _push(self, job: _Job) -> None:
+        """
+        Adds a job to the heap and wakes the timer if it became the next one due
+        :param job: The job to be added
+        """
+
+        self.jobs[job.id] = job
+        heappush(self._heap, (job.when, job.id))
+        if self._heap[0][1] == job.id:
+            self._wakeup.set()
+
+    def schedule(self, owner: "Bot", receiver: Union[str, int], when: float, answer: "Answer",
+                 language: str = None) -> int:
+        """
+        Schedules a one-off answer
+        :param owner: The bot sending the answer
+        :param receiver: The id of the receiving chat
+        :param when: The due time as timestamp
+        :param answer: The answer to be sent
+        :param language: The language code to apply the language feature with
+        :return: The job's id
+        """
+
+        # Only the plain values of the answer are kept, so it can be persisted
+        # Arguments which cannot be stored as they are, like users, are formatted beforehand
+        job = _Job(next(self._ids), when, owner, receiver=receiver, answer={
+            "receiver": receiver,
+            "language": language,
+            "msg": answer._msg,
+            "format_content": [value if isinstance(value, (str, int, float, bool)) or value is None else str(value)
+                               for value in answer.format_content],
+            "media_type": answer.media_type.name if answer.media_type is not None else None,
+            "media": answer.media if isinstance(answer.media, str) else None,
+            "caption": answer.caption,
+        })
+        if answer.callback is not None or answer.choices is not None or answer.keyboard is not None:
+            logger.warning(f"Callbacks and keyboards of the scheduled job {job.id} are not kept")
+
+        self._push(job)
+        self._track(job)
+        return job.id
+
+    def every(self, owner: "Bot", interval: float, func: Callable, receiver: Union[str, int] = None) -> int:
+        """
+        Registers a function to be called periodically, which is not persisted as it is registered again on startup
+        :param owner: The bot sending the function's answers
+        :param interval: The seconds between two calls
+        :param func: The function returning the answers to be sent
+        :param receiver: The recipient of answers which do not name one
+        :return: The job's id
+        """
+
+        job = _Job(next(self._ids), time.time() + interval, owner, func=func, interval=interval, receiver=receiver)
+        self._push(job)
+        return job.id
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        Removes a pending job, its heap entry is skipped when it becomes due
+        :param job_id: The job's id
+        :return: If the job was pending
+        """
+
+        job = self.jobs.pop(job_id, None)
+        if job is not None:
+            self._untrack(job)
+        return job is not None
 
-                        # If one level evaluated to True, call the function as usual
-                        if iscoroutinefunction(func):
-                            return await func(**kwargs)
-                        else:
-                            return func(**kwargs)
+    async def run_forever(self) -> None:
+        """
+        Waits for the next job to become due and starts it, as long as the limit of running jobs permits
+        """
 
-                # If no level evaluated to True, raise error
-                raise AuthorizationError()
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        renewing = asyncio.ensure_future(self._renew_forever())
 
-            return inner
+        while True:
+            try:
+                # Drop entries of cancelled or rescheduled jobs
+                while self._heap and (self._heap[0][1] not in self.jobs or
+                                      self.jobs[self._heap[0][1]].when != self._heap[0][0]):
+                    heappop(self._heap)
+
+                # Sleep until the next job is due or an earlier one is added
+                self._wakeup.clear()
+                delay = self._heap[0][0] - time.time() if self._heap else None
+                if delay is None or delay > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                when, job_id = heappop(self._heap)
+                job = self.jobs[job_id]
+
+                # Periodic jobs stay registered for their next run, one-off jobs are done
+                if job.func is not None:
+                    job.when = max(when + job.interval, time.time())
+                    heappush(self._heap, (job.when, job.id))
+                else:
+                    del self.jobs[job_id]
+                    self._untrack(job)
 
-        return decorator
+                # The job runs in its bot's context, so it uses the bot's configuration
+                await self._semaphore.acquire()
+                task = job.owner.context.run(asyncio.ensure_future, self._run(job))
+                self.running.add(task)
+                task.add_done_callback(self.running.discard)
 
-    def ensure_parameter(self, name: str, phrase: str, choices: Collection[str] = None):
+            except asyncio.CancelledError:
+                renewing.cancel()
+                break
+
+    async def _run(self, job: _Job) -> None:
         """
-        The wrapper for the inner decorator
-        :param name: The name of the parameter to provide
-        :param phrase: The phrase to use when asking the user for the parameter
-        :param choices: The choices to show the user as callback
-        :return: The decorator
+        Executes a job and sends its answers
+        :param job: The due job
         """
 
-        def decorator(func: Callable):
-            """
-            Wrapper for the decorating function
-            :param func: The function to be protected
-            :return: The decorated function
-            """
+        outbound = types.SimpleNamespace(bot=job.owner._bot, chat_id=job.receiver, user_id=None)
+        if Bot._watchdog is not None:
+            Bot._watchdog.track(f"job {job.id}" + (f" ({getattr(job.func, '__qualname__', job.func)})"
+                                                    if job.func is not None else ""))
 
-            async def inner(**kwargs):
-                """
-                Checks if the requested parameter exists and aks the user to provide it, if it misses
-                :return: The message handler's usual output
-                """
+        try:
+            if job.func is not None:
+                if iscoroutinefunction(job.func):
+                    answers = await job.func()
+                else:
+                    answers = job.func()
+            else:
+                answers = self._restore(job.answer)
 
-                # Check if the parameter exists
-                if name not in kwargs:
-                    # If not, ask the user for it
-                    temp = (yield Answer(phrase, choices=choices))
-                    kwargs[name] = temp
+            if answers is None:
+                return
 
-                # If one level evaluated to True, call the function as usual
-                if iscoroutinefunction(func):
-                    yield await func(**kwargs)
-                else:
-                    yield func(**kwargs)
+            for answer in answers if isinstance(answers, (list, tuple)) else [answers]:
+                if not isinstance(answer, Answer):
+                    answer = Answer(str(answer))
+                if answer.receiver is None and job.receiver is None:
+                    logger.warning(f"The answer of job {job.id} has no receiver and was dropped")
+                    continue
+                await answer._send(outbound)
 
-            return inner
+        except Exception as e:
+            logger.warning(f"The scheduled job {job.id} failed:\n\t\t{e!r}")
 
-        return decorator
+        finally:
+            self._semaphore.release()
+            if Bot._watchdog is not None:
+                Bot._watchdog.untrack()
 
     @staticmethod
-    def _before_function():
-        return True
+    def _restore(answer: Dict) -> "Answer":
+        """
+        Recreates a persisted answer
+        :param answer: The answer's values as dictionary
+        :return: The answer object
+        """
+
+        # The language feature depends on the user in the context
+        if answer["language"] is not None:
+            _user.set(User({"id": answer["receiver"], "language_code": answer["language"]}))
+
+        return Answer(answer["msg"], *answer["format_content"],
+                      media_type=Media[answer["media_type"]] if answer["media_type"] is not None else None,
+                      media=answer["media"],
+                      caption=answer["caption"],
+                      receiver=answer["receiver"])
+
+    def _track(self, job: _Job, changed: bool = True) -> None:
+        """
+        Adds a one-off job to its bucket
+        :param job: The added job
+        :param changed: If the bucket must be written
+        """
+
+        if job.func is not None:
+            return
+
+        bucket = (job.owner, job.id // self.bucket_size)
+        self._buckets.setdefault(bucket, set()).add(job.id)
+        if changed:
+            self._changed(bucket)
+
+    def _untrack(self, job: _Job) -> None:
+        """
+        Removes a one-off job, which ran or was cancelled, from its bucket
+        :param job: The removed job
+        """
+
+        if job.func is None:
+            bucket = (job.owner, job.id // self.bucket_size)
+            self._buckets.get(bucket, set()).discard(job.id)
+            self._changed(bucket)
+
+    def _changed(self, bucket: Tuple["Bot", int]) -> None:
+        """
+        Persists a changed bucket after the flush interval, collecting further changes until then
+        :param bucket: The bot and the number of the bucket
+        """
+
+        if not self.persists(bucket[0]):
+            return
+
+        self._dirty.add(bucket)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(self.flush_interval, self.save_state)
+
+    def save_state(self) -> None:
+        """
+        Writes the changed buckets of one-off jobs to the persistent storage of their bots, and the list of the buckets
+        if it changed
+        """
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        dirty, self._dirty = self._dirty, set()
+        changed = set()
+        for owner, bucket in dirty:
+            ids = self._buckets.get((owner, bucket), set())
+            stored = self._stored_buckets.setdefault(owner, set())
+            key = self._bucket_key(bucket)
+
+            # The record of a new bucket is created by loading it
+            if ids and bucket not in stored:
+                owner._session.load_user_data(key)
+                stored.add(bucket)
+                changed.add(owner)
+            elif not ids:
+                self._buckets.pop((owner, bucket), None)
+                if bucket in stored:
+                    stored.discard(bucket)
+                    changed.add(owner)
+
+            owner._session.update_user_data(key, {"jobs": {str(job_id): self._values(self.jobs[job_id])
+                                                           for job_id in ids}})
+
+        for owner in changed:
+            buckets = sorted(self._stored_buckets[owner])
+            highest = owner._session.load_user_data(self.storage_key).get("highest", -1)
+            owner._session.update_user_data(self.storage_key, {"buckets": buckets,
+                                                               "highest": max([highest, *buckets])})
+
+    @staticmethod
+    def _values(job: _Job) -> Dict[str, Any]:
+        return {"when": job.when, "answer": job.answer}
+
+    def stored(self, owner: "Bot") -> Dict[str, Dict]:
+        """
+        Returns the values of a bot's pending one-off jobs, which are persisted
+        :param owner: The bot
+        :return: The jobs' values by their ids
+        """
+
+        return {str(job.id): self._values(job) for job in self.jobs.values() if job.func is None and job.owner is owner}
 
 
 class Answer(object):
@@ -471,6 +2356,29 @@ class Answer(object):
         'document': Media.DOCUMENT,
     }
 
+    # The sending method and its accepted keyword arguments for every media type
+    send_methods: Dict[Media, Tuple[str, Tuple[str, ...]]] = {
+        Media.TEXT: ("sendMessage", ("parse_mode", "disable_web_page_preview", "disable_notification",
+                                     "reply_to_message_id", "reply_markup")),
+        Media.STICKER: ("sendSticker", ("disable_notification", "reply_to_message_id", "reply_markup")),
+        Media.VOICE: ("sendVoice", ("caption", "parse_mode", "duration", "disable_notification", "reply_to_message_id",
+                                    "reply_markup")),
+        Media.AUDIO: ("sendAudio", ("caption", "parse_mode", "duration", "performer", "title", "disable_notification",
+                                    "reply_to_message_id", "reply_markup")),
+        Media.PHOTO: ("sendPhoto", ("caption", "parse_mode", "disable_notification", "reply_to_message_id",
+                                    "reply_markup")),
+        Media.VIDEO: ("sendVideo", ("duration", "width", "height", "caption", "parse_mode", "supports_streaming",
+                                    "disable_notification", "reply_to_message_id", "reply_markup")),
+        Media.DOCUMENT: ("sendDocument", ("caption", "parse_mode", "disable_notification", "reply_to_message_id",
+                                          "reply_markup")),
+    }
+
+    # The keyword arguments accepted when editing a message's text
+    edit_kwargs = ("parse_mode", "disable_web_page_preview", "reply_markup")
+
+    # The defaults of the configuration loaded last, which are resolved by the bot's ones during its updates
+    defaults: Dict[str, Any] = dict()
+
     def __init__(self, msg: str = None,
                  *format_content: Any,
                  choices: Collection = None,
@@ -519,93 +2427,148 @@ class Answer(object):
         """
 
         # Load the recipient's id
-        if self.receiver is None:
-            ID = session.user_id
-        else:
-            ID = self.receiver
+        ID = self._recipient(session)
+        if self.receiver is not None:
             self.mark_as_answer = False
 
-            if isinstance(ID, User):
-                ID = ID.id
-
         sender = session.bot
         msg = self.msg
         kwargs = self._get_config()
 
         # Catch a to long message text
         if self.media_type == Media.TEXT and len(msg) > 4096:
-            msg, self.media_type, self.media = Bot._on_message_overflow(self)
+            if self.overflow == "split":
+                return await self._send_parts(sender, ID, split_message(msg, 4096, self.markup), kwargs)
+
+            bot = _bot.get()
+            msg, self.media_type, self.media = (bot if bot is not None else Bot)._on_message_overflow(self)
 
         # Check for a request for editing
         if self.edit_id is not None:
             return await sender.editMessageText((ID, self.edit_id), msg,
-                                                **{key: kwargs[key] for key in kwargs if key in ("parse_mode",
-                                                                                                 "disable_web_page_preview",
-                                                                                                 "reply_markup")}
-                                                )
+                                                **{key: kwargs[key] for key in self.edit_kwargs})
 
         # Call the correct method for sending the desired media type and filter the relevant kwargs
+        method, keys = self.send_methods[self.media_type]
         if self.media_type == Media.TEXT:
-            return await sender.sendMessage(ID, msg,
-                                            **{key: kwargs[key] for key in kwargs if key in ("parse_mode",
-                                                                                             "disable_web_page_preview",
-                                                                                             "disable_notification",
-                                                                                             "reply_to_message_id",
-                                                                                             "reply_markup")})
-
+            payload = msg
         elif self.media_type == Media.STICKER:
-            return await sender.sendSticker(ID, self.media,
-                                            **{key: kwargs[key] for key in kwargs if key in ('disable_notification',
-                                                                                             'reply_to_message_id',
-                                                                                             'reply_markup')})
-
-        elif self.media_type == Media.VOICE:
-            return await sender.sendVoice(ID, open(self.media, "rb"),
-                                          **{key: kwargs[key] for key in kwargs if key in ("caption",
-                                                                                           "parse_mode",
-                                                                                           "duration",
-                                                                                           "disable_notification",
-                                                                                           "reply_to_message_id",
-                                                                                           "reply_markup")})
-
-        elif self.media_type == Media.AUDIO:
-            return await sender.sendAudio(ID, open(self.media, "rb"),
-                                          **{key: kwargs[key] for key in kwargs if key in ("caption",
-                                                                                           "parse_mode",
-                                                                                           "duration",
-                                                                                           "performer",
-                                                                                           "title",
-                                                                                           "disable_notification",
-                                                                                           "reply_to_message_id",
-                                                                                           "reply_markup")})
-
-        elif self.media_type == Media.PHOTO:
-            return await sender.sendPhoto(ID, open(self.media, "rb"),
-                                          **{key: kwargs[key] for key in kwargs if key in ("caption",
-                                                                                           "parse_mode",
-                                                                                           "disable_notification",
-                                                                                           "reply_to_message_id",
-                                                                                           "reply_markup")})
-
-        elif self.media_type == Media.VIDEO:
-            return await sender.sendVideo(ID, open(self.media, "rb"),
-                                          **{key: kwargs[key] for key in kwargs if key in ("duration",
-                                                                                           "width",
-                                                                                           "height",
-                                                                                           "caption",
-                                                                                           "parse_mode",
-                                                                                           "supports_streaming",
-                                                                                           "disable_notification",
-                                                                                           "reply_to_message_id",
-                                                                                           "reply_markup")})
-
-        elif self.media_type == Media.DOCUMENT:
-            return await sender.sendDocument(ID, open(self.media, "rb"),
-                                             **{key: kwargs[key] for key in kwargs if key in ("caption",
-                                                                                              "parse_mode",
-                                                                                              "disable_notification",
-                                                                                              "reply_to_message_id",
-                                                                                              "reply_markup")})
+            payload = self.media
+        else:
+            payload = self._media_file()
+
+        return await getattr(sender, method)(ID, payload, **{key: kwargs[key] for key in keys if key in kwargs})
+
+    def __copy__(self) -> "Answer":
+        # Considerably faster than the generic copy, which cached routes do for every hit
+        answer = type(self).__new__(type(self))
+        answer.__dict__.update(self.__dict__)
+        return answer
+
+    def compile(self) -> "CompiledAnswer":
+        """
+        Prepares this answer for being sent repeatedly, e.g. when it is kept as a constant. The text, media type and
+        keyword arguments are resolved once per language and an uploaded file is afterwards sent by its id.
+        :return: The compiled answer, which can be returned instead of this one
+        """
+
+        return CompiledAnswer(self)
+
+    def _recipient(self, session) -> Union[str, int]:
+        """
+        Determines the id of the chat this answer is sent to
+        :param session: The user's instance of _Session
+        :return: The chat id
+        """
+
+        if self.receiver is None:
+            return session.chat_id
+        elif isinstance(self.receiver, User):
+            return self.receiver.id
+        else:
+            return self.receiver
+
+    def _is_album_item(self) -> bool:
+        """
+        Determines if this answer can be sent as part of a media group
+        :return: A boolean answering the call
+        """
+
+        # Resolve the media type
+        _ = self.msg
+
+        return self.media_type in (Media.PHOTO, Media.VIDEO) and self.choices is None and self.keyboard is None \
+            and self.callback is None and self.edit_id is None
+
+    @staticmethod
+    async def _send_album(session, answers: List["Answer"]) -> List[Dict]:
+        """
+        Sends several photos and videos to the same recipient as a single media group
+        :param session: The user's instance of _Session
+        :param answers: Between two and ten answers with photos or videos
+        :return: The sent messages as dictionaries
+        """
+
+        first = answers[0]
+        kwargs = first._get_config()
+
+        media = [(InputMediaPhoto if answer.media_type == Media.PHOTO else InputMediaVideo)(
+            media=answer._media_file(), caption=answer.caption, parse_mode=answer.markup) for answer in answers]
+
+        return await session.bot.sendMediaGroup(first._recipient(session), media,
+                                                disable_notification=kwargs["disable_notification"],
+                                                reply_to_message_id=kwargs["reply_to_message_id"]
+                                                if first.receiver is None else None)
+
+    async def _send_parts(self, sender, ID, parts: List[str], kwargs: Dict[str, Any]) -> Dict:
+        """
+        Sends the parts of a split message in order, only the first one is marked as answer and only the last one
+        carries the keyboard
+        :param sender: The bot to send with
+        :param ID: The recipient's id
+        :param parts: The texts to be sent
+        :param kwargs: The kwargs of the answer
+        :return: The last sent message as dictionary
+        """
+
+        reply_markup = kwargs["reply_markup"]
+        kwargs = {key: kwargs[key] for key in kwargs if key in ("parse_mode",
+                                                                "disable_web_page_preview",
+                                                                "disable_notification",
+                                                                "reply_to_message_id")}
+
+        for index, part in enumerate(parts[:-1]):
+
+            # An edited message is replaced by the first part
+            if index == 0 and self.edit_id is not None:
+                await sender.editMessageText((ID, self.edit_id), part, parse_mode=kwargs["parse_mode"],
+                                             disable_web_page_preview=kwargs["disable_web_page_preview"])
+            else:
+                await sender.sendMessage(ID, part, **kwargs)
+                kwargs["reply_to_message_id"] = None
+
+        return await sender.sendMessage(ID, parts[-1], reply_markup=reply_markup, **kwargs)
+
+    def _media_file(self):
+        """
+        Opens the media to be uploaded, unless it is already given as file object or tuple of file name and object
+        :return: The media as accepted by telepot
+        """
+
+        if isinstance(self.media, str):
+            return open(self.media, "rb")
+        return self.media
+
+    @staticmethod
+    def _language_code() -> str:
+        """
+        Determines the language of the current user
+        :return: The language code, e.g. de
+        """
+
+        # The language code should be something like de, but could be also like de_DE or non-existent
+        usr = _user.get()
+        return usr.language_code.split('_')[0].lower() if usr is not None else "en"
 
     def _apply_language(self) -> str:
         """
@@ -613,19 +2576,17 @@ class Answer(object):
         :return The formatted text
         """
 
-        # The language code should be something like de, but could be also like de_DE or non-existent
-        usr = _context.get('user')
-        lang_code = usr.language_code.split('_')[0].lower() if usr is not None else "en"
+        lang_code = self._language_code()
 
         try:
             # Try to load the string with the given language code
-            answer: str = _Session.language[lang_code][self._msg]
+            answer: str = self.language[lang_code][self._msg]
 
         except KeyError:
 
             # Try to load the answer string in the default segment
             try:
-                answer: str = _Session.language['default'][self._msg]
+                answer: str = self.language['default'][self._msg]
 
             # Catch the key error which might be thrown
             except KeyError as e:
@@ -726,7 +2687,7 @@ class Answer(object):
         elif self.keyboard is not None:
 
             # For anything except a collection, any previous sent keyboard is deleted
-            if not isinstance(self.keyboard, collections.Iterable):
+            if not isinstance(self.keyboard, collections.abc.Iterable):
                 keyboard = ReplyKeyboardRemove()
 
             else:
@@ -740,44 +2701,332 @@ class Answer(object):
                 # Prepare button array
                 buttons = []
 
-                # Loop over all rows
-                for row in self.keyboard:
-                    r = []
-                    # Loop over each entry
-                    for text in row:
-                        # Append the text as a new button
-                        r.append(KeyboardButton(
-                            text=text))
-                    # Append the button row to the list
-                    buttons.append(r)
+                # Loop over all rows
+                for row in self.keyboard:
+                    r = []
+                    # Loop over each entry
+                    for text in row:
+                        # Append the text as a new button
+                        r.append(KeyboardButton(
+                            text=text))
+                    # Append the button row to the list
+                    buttons.append(r)
+
+                # Assemble keyboard
+                keyboard = ReplyKeyboardMarkup(keyboard=buttons, one_time_keyboard=True)
+        else:
+            keyboard = None
+
+        return {
+            'parse_mode': self.markup,
+            'reply_to_message_id': _init_message.get().id if self.mark_as_answer and _message.get() is not None
+            else None,
+            'disable_web_page_preview': self.disable_web_preview,
+            'disable_notification': self.disable_notification,
+            'reply_markup': keyboard,
+            'caption': self.caption
+        }
+
+    def __getattr__(self, name: str) -> Any:
+        """
+        Looks up the defaults of the configuration, which belong to the bot sending the answer
+        :param name: The name of the attribute, which was not set on the answer
+        :return: The default value
+        """
+
+        bot = _bot.get()
+        try:
+            return (bot.answer_defaults if bot is not None else Answer.defaults)[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    @classmethod
+    def _load_defaults(cls, language: Dict = None) -> Dict[str, Any]:
+        """
+        Load default values from config, they are used outside of any bot's context as well
+        :param language: The loaded language file
+        :return: The default values keyed by the attributes' names
+        """
+
+        cls.defaults = {
+            "mark_as_answer": _config_value('bot', 'mark_as_answer', default=False),
+            "markup": _config_value('bot', 'markup', default=None),
+            "language_feature": _config_value('bot', 'language_feature', default=False),
+            "strict_mode": _config_value('bot', 'strict_mode', default=False),
+            "disable_web_preview": _config_value('bot', 'disable_web_preview', default=False),
+            "disable_notification": _config_value('bot', 'disable_notification', default=False),
+            "overflow": _config_value('bot', 'overflow', default="document"),
+            "language": language,
+        }
+        return cls.defaults
+
+
+class _SendPlan(NamedTuple):
+    """
+    The resolved call sending an answer
+    """
+
+    # The name of the bot's method, None if the answer has to be sent the regular way
+    method: Union[str, None]
+    text: Union[str, None]
+    payload: Any
+    kwargs: Mapping[str, Any]
+    reply: bool
+
+
+class CompiledAnswer(Answer):
+    """
+    An answer whose sending call is resolved once, so sending it again costs little more than the api call.
+    The plans are kept per bot and language, as the text may differ between them. Created by Answer.compile().
+    """
+
+    def __init__(self, answer: Answer):
+        """
+        Takes over the values of an answer, which is not changed afterwards
+        :param answer: The answer to be compiled
+        """
+
+        super(CompiledAnswer, self).__init__()
+        self.__dict__.update(answer.__dict__)
+        self._source = answer
+        self._plans: Dict[Tuple[Union["Bot", None], Union[str, None]], _SendPlan] = dict()
+
+        # The ids of the uploaded file per telepot bot, which replace the file for further sends
+        self._file_ids: Dict[telepot.aio.Bot, str] = dict()
+
+    def _plan(self) -> _SendPlan:
+        """
+        Returns the plan for the current bot and language, creating it on first use
+        :return: The plan
+        """
+
+        language = _bot.get(), self._language_code() if self.language_feature else None
+        plan = self._plans.get(language)
+        if plan is not None:
+            return plan
+
+        # Resolve a copy, as resolving changes the answer
+        answer = copy.copy(self._source)
+        text = answer.msg
+        kwargs = answer._get_config()
+        self.media_type, self.media, self.caption = answer.media_type, answer.media, answer.caption
+
+        # Overflowing texts are handled the regular way on every send
+        if self.media_type == Media.TEXT and len(text) > 4096:
+            plan = _SendPlan(None, text, None, MappingProxyType({}), False)
+
+        else:
+            if self.edit_id is not None:
+                method, keys = "editMessageText", self.edit_kwargs
+            else:
+                method, keys = self.send_methods[self.media_type]
+
+            plan = _SendPlan(method, text, text if self.media_type == Media.TEXT else self.media,
+                             MappingProxyType({key: kwargs[key] for key in keys if key in kwargs
+                                               and key != "reply_to_message_id"}),
+                             "reply_to_message_id" in keys and self.mark_as_answer and self.receiver is None)
+
+        self._plans[language] = plan
+        return plan
+
+    @property
+    def msg(self) -> str:
+        """
+        Returns the resolved message
+        :return: The final message to be sent
+        """
+
+        return self._plan().text
+
+    async def _send(self, session) -> Dict:
+        """
+        Sends the answer according to its plan
+        :param session: The user's instance of _Session
+        :return : The send message as dictionary
+        """
+
+        plan = self._plan()
+        if plan.method is None:
+            return await copy.copy(self._source)._send(session)
+
+        ID = self._recipient(session)
+        target = (ID, self.edit_id) if self.edit_id is not None else ID
+
+        # Only the message being answered changes between sends
+        kwargs = plan.kwargs
+        if plan.reply and _message.get() is not None:
+            kwargs = dict(kwargs, reply_to_message_id=_init_message.get().id)
+
+        # Files are uploaded once and referenced by their id afterwards, which is only valid for the same bot
+        payload = plan.payload
+        file_id = self._file_ids.get(session.bot)
+        if self.media_type not in (Media.TEXT, Media.STICKER) and self.edit_id is None:
+            payload = file_id or self._media_file()
+
+        sent = await getattr(session.bot, plan.method)(target, payload, **kwargs)
+
+        if file_id is None and self.media_type not in (Media.TEXT, Media.STICKER) and isinstance(sent, dict):
+            media = sent.get(self.media_type.name.lower())
+            if isinstance(media, list):
+                media = media[-1]
+            if media is not None:
+                self._file_ids[session.bot] = media['file_id']
+
+        return sent
+
+
+class Stream(Answer):
+    """
+    An answer whose text is produced progressively by an iterable of chunks. The message is sent with the first chunk
+    and edited in place as further chunks arrive, at most once per interval and chat. Once the text exceeds the length
+    limit, it is continued in a new message.
+    """
+
+    # The time of the last sent or edited stream message per bot and chat
+    _last_edit: Dict[Tuple[telepot.aio.Bot, Union[int, str]], float] = dict()
+
+    def __init__(self, chunks: Union[Iterable[str], AsyncIterable[str]],
+                 interval: float = None,
+                 markup: str = None,
+                 receiver: Union[str, int, User] = None,
+                 limit: int = 4096):
+        """
+        Initializes the stream
+        :param chunks: The parts of the text in order, preferably an async generator
+        :param interval: The minimal seconds between two edits, defaults to the configuration value stream_interval
+        :param markup: The parse mode of the text. As incomplete formatting would be rejected, it defaults to plain text.
+        :param receiver: The user ID or a user object of the user who should receiver this answer. Will default to the
+            user who sent the triggering message.
+        :param limit: The maximal length of a single message
+        """
+
+        super(Stream, self).__init__(media_type=Media.TEXT, receiver=receiver)
+        self.chunks = chunks
+        self.interval = _config_value('bot', 'stream_interval', default=1.0) if interval is None else interval
+        self.markup = markup
+        self.limit = limit
+
+        # The text of the current message, the text it shows and the message itself
+        self._text = ""
+        self._shown = ""
+        self._sent = None
+        self._done = False
+
+    async def _send(self, session) -> Dict:
+        """
+        Consumes the chunks and updates the message while doing so
+        :param session: The user's instance of _Session
+        :return : The last sent message as dictionary
+        """
+
+        self._chat = self._recipient(session)
+        if self.receiver is not None:
+            self.mark_as_answer = False
+
+        self._sender = session.bot
+        kwargs = self._get_config()
+        self._kwargs = {key: kwargs[key] for key in kwargs if key in ("parse_mode",
+                                                                      "disable_web_page_preview",
+                                                                      "disable_notification",
+                                                                      "reply_to_message_id")}
+
+        # The chunks are collected while the previous text is being sent, so fast producers are coalesced
+        self._changed = asyncio.Event()
+        flusher = asyncio.ensure_future(self._flush_loop())
+        try:
+            if isinstance(self.chunks, collections.abc.AsyncIterable):
+                async for chunk in self.chunks:
+                    self._append(chunk)
+                    if flusher.done():
+                        break
+            else:
+                for chunk in self.chunks:
+                    self._append(chunk)
+                    if flusher.done():
+                        break
+                    await asyncio.sleep(0)
+
+        # Show everything produced so far, even if the producer failed
+        finally:
+            self._done = True
+            self._changed.set()
+            await flusher
+
+        return self._sent
+
+    def _append(self, chunk: str) -> None:
+        """
+        Adds a chunk to the current text and wakes the flushing task
+        :param chunk: The chunk to be added
+        """
+
+        self._text += str(chunk)
+        self._changed.set()
+
+    async def _flush_loop(self) -> None:
+        """
+        Shows the current text whenever it changed, waiting for the interval to pass since the chat's last edit
+        """
+
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+
+            # The first message is sent immediately to keep the perceived latency low
+            if self._sent is not None and not self._done:
+                delay = Stream._last_edit.get((self._sender, self._chat), 0) + self.interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            await self._flush()
+
+            if self._done and not self._changed.is_set():
+                Stream._last_edit.pop((self._sender, self._chat), None)
+                return
+
+    async def _flush(self) -> None:
+        """
+        Shows the current text, rolling over into new messages if it exceeds the length limit
+        """
+
+        snapshot = self._text
+        if snapshot == self._shown:
+            return
 
-                # Assemble keyboard
-                keyboard = ReplyKeyboardMarkup(keyboard=buttons, one_time_keyboard=True)
-        else:
-            keyboard = None
+        # Complete all full parts, the remainder and any chunks received meanwhile open the next message
+        parts = split_message(snapshot, self.limit, self.markup)
+        if len(parts) > 1:
+            for part in parts[:-1]:
+                await self._show(part)
+                self._sent, self._shown = None, ""
+            self._text = parts[-1] + self._text[len(snapshot):]
+            snapshot = parts[-1]
 
-        return {
-            'parse_mode': self.markup,
-            'reply_to_message_id': _context.get('init_message').id if self.mark_as_answer and _context.get(
-                'message') is not None else None,
-            'disable_web_page_preview': self.disable_web_preview,
-            'disable_notification': self.disable_notification,
-            'reply_markup': keyboard,
-            'caption': self.caption
-        }
+        await self._show(snapshot)
 
-    @classmethod
-    def _load_defaults(cls) -> None:
+    async def _show(self, text: str) -> None:
         """
-        Load default values from config
+        Sends the text as new message or edits the current one, if there is any
+        :param text: The text to be shown
         """
 
-        cls.mark_as_answer = _config_value('bot', 'mark_as_answer', default=False)
-        cls.markup = _config_value('bot', 'markup', default=None)
-        cls.language_feature = _config_value('bot', 'language_feature', default=False)
-        cls.strict_mode = _config_value('bot', 'strict_mode', default=False)
-        cls.disable_web_preview = _config_value('bot', 'disable_web_preview', default=False)
-        cls.disable_notification = _config_value('bot', 'disable_notification', default=False)
+        # Telegram rejects empty messages and unchanged edits
+        if not text.strip() or text == self._shown:
+            return
+
+        if self._sent is None:
+            self._sent = await self._sender.sendMessage(self._chat, text, **self._kwargs)
+
+            # Only the first message is marked as answer
+            self._kwargs["reply_to_message_id"] = None
+        else:
+            self._sent = await self._sender.editMessageText((self._chat, self._sent['message_id']), text,
+                                                            parse_mode=self._kwargs["parse_mode"],
+                                                            disable_web_page_preview=self._kwargs[
+                                                                "disable_web_page_preview"])
+
+        self._shown = text
+        Stream._last_edit[(self._sender, self._chat)] = time.monotonic()
 
 
 class _Session(telepot.aio.helper.UserHandler):
@@ -790,9 +3039,47 @@ class _Session(telepot.aio.helper.UserHandler):
     simple_routes: Dict[str, Callable] = dict()
     parse_routes: ParsingDict = ParsingDict()
     regex_routes: RegExDict = RegExDict()
+    media_routes: Dict[Media, Callable] = dict()
+    edit_answer: Callable = None
+
+    # The keys of a message carrying an attachment and the according media type
+    content_types: Dict[str, Media] = {
+        'photo': Media.PHOTO,
+        'document': Media.DOCUMENT,
+        'voice': Media.VOICE,
+        'audio': Media.AUDIO,
+        'video': Media.VIDEO,
+        'video_note': Media.VIDEO_NOTE,
+        'sticker': Media.STICKER,
+        'location': Media.LOCATION,
+        'contact': Media.CONTACT,
+    }
+
+    # The persistent storage, shared by the sessions of a bot, and the serialization of its records
+    database = None
+    codec: Union[Codec, None] = None
+
+    # The open sessions keyed by their chat, or chat and user for members of group chats
+    sessions: Dict[Hashable, "_Session"] = dict()
 
-    # Language files
-    language = None
+    # The loop polling the updates, which is told when a message was processed
+    updates: Union[_UpdateLoop, None] = None
+
+    # The bound of each session's mailbox, the policy for further messages and the reply to rejected ones
+    mailbox_size = 100
+    mailbox_overflow = "drop_oldest"
+    mailbox_reply = None
+
+    # The aggregated errors and the chats which recently received an error reply
+    errors: _ErrorLog = _ErrorLog()
+    error_replies: TTLCache = TTLCache(10, 10000)
+
+    # The allowed and denied chats and users
+    access: AccessList = AccessList()
+
+    # The loaded storages of users and chats, keyed by their id, and the number of open sessions using them
+    storages: Dict[int, dict] = dict()
+    storage_users: Dict[int, int] = dict()
 
     def __init__(self, *args, **kwargs):
         """
@@ -801,20 +3088,29 @@ class _Session(telepot.aio.helper.UserHandler):
         :param kwargs: Used by telepot
         """
 
-        # Call superclasses superclass, allowing callback queries to be processed
-        super(_Session, self).__init__(include_callback_query=True, *args, **kwargs)
+        # Call superclasses superclass without capturing the sender's messages in all chats, which would let a
+        # private session handle its user's group messages as well, messages and callback queries are captured below
+        # Inline queries are left to the _InlineSession
+        super(_Session, self).__init__(flavors=[], *args, **kwargs)
 
-        # Extract the user of the default arguments
-        self.user = User(args[0][1]['from'])
-
-        # Create dictionary to use as persistent storage
-        # Load data from persistent storage
-        if _Session.database is not None:
+        # Extract the chat and the user of the default arguments and cache the user for the following messages
+        # Channel posts have no user
+        msg = args[0][1]
+        self.chat_id = msg['chat']['id']
+        self.chat_type = msg['chat']['type']
+        self.user = User(msg['from']) if 'from' in msg else None
+        self.users: Dict[int, User] = {self.user.id: self.user} if self.user is not None else {}
 
-            self.storage = _Session.load_user_data(self.user_id)
+        # Only capture the messages of the own chat, in other chats than private ones, where the session is seeded per
+        # member, only those of the member
+        member = {'from': {'id': self.user.id}} if self.chat_type != "private" and self.user is not None else {}
+        self.listener.capture([dict(member, chat={'id': self.chat_id})])
+        self.listener.capture([dict(member, message={'chat': {'id': self.chat_id}})])
 
-        else:
-            self.storage = dict()
+        # Load the user's and the chat's storage, which are the same in private chats
+        self.storage_id = self.user.id if self.user is not None else self.chat_id
+        self.storage = self._load_storage(self.storage_id)
+        self.chat_storage = self._load_storage(self.chat_id)
 
         self.callback = None
         self.query_callback = {}
@@ -824,29 +3120,91 @@ class _Session(telepot.aio.helper.UserHandler):
         self.gen_is_async = None
 
         # Prepare dequeue to store sent messages' IDs
-        _context.set("history", deque(maxlen=_config_value("bot", "max_history_entries", default=10)))
+        self.history = deque(maxlen=_config_value("bot", "max_history_entries", default=10))
+
+        # Incoming messages are queued and processed one after another by a single task
+        self.mailbox: deque = deque()
+        self._mail = asyncio.Event()
+        self._worker: Union[asyncio.Future, None] = None
+        self.current: Union[dict, None] = None
+        self.dropped = 0
+        self.key = self.chat_id if self.chat_type == "private" else (self.chat_id, self.storage_id)
+        self.sessions[self.key] = self
 
         logger.info(
-            "User {} connected".format(self.user))
+            "User {} connected".format(self.user) if self.user is not None else "Channel {} connected".format(
+                self.chat_id))
 
-    @staticmethod
-    def load_user_data(user):
+    @classmethod
+    def _load_storage(cls, key: int) -> dict:
+        """
+        Returns the storage of a user or chat, which is loaded from the persistent storage on first use and then cached
+        for all sessions
+        :param key: The id of the user or chat
+        :return: The storage as dictionary
+        """
+
+        # Shared storages may be changed by other processes, so they are refreshed before every message
+        if isinstance(cls.database, KeyValueStore):
+            return cls.database.cached(key)
+
+        storage = cls.storages.get(key)
+        if storage is None:
+            if cls.database is not None:
+                storage = cls.load_user_data(key)
+            else:
+                storage = dict()
+            cls.storages[key] = storage
+
+        cls.storage_users[key] = cls.storage_users.get(key, 0) + 1
+        return storage
+
+    @classmethod
+    def _release_storage(cls, key: int) -> None:
+        """
+        Releases the storage of a user or chat used by a closed session, which is dropped from the cache once no session
+        uses it anymore
+        :param key: The id of the user or chat
+        """
+
+        users = cls.storage_users.get(key, 0) - 1
+        if users > 0:
+            cls.storage_users[key] = users
+            return
+        cls.storage_users.pop(key, None)
+
+        # The storage is written after every message, without persistent storage the cached one is the only copy
+        if cls.database is not None:
+            cls.storages.pop(key, None)
+
+    @classmethod
+    def load_user_data(cls, user):
         """
 
         :param user:
         :return:
         """
 
-        storage = _Session.database.search(Query().user == user)
+        if isinstance(cls.database, KeyValueStore):
+            return cls.database.cached(user)
+
+        storage = cls.database.search(Query().user == user)
 
         if len(storage) == 0:
-            _Session.database.insert({"user": user, "storage": {}})
+            cls.database.insert({"user": user, "storage": {}})
             return dict()
-        else:
-            return storage[0]["storage"]
 
-    @staticmethod
-    def update_user_data(user, storage):
+        # Records stay plain json documents, envelopes embedded as text by earlier versions are converted on their next
+        # update
+        storage = storage[0]["storage"]
+        if isinstance(storage, str):
+            return (cls.codec or Codec()).loads_text(storage)
+        if cls.codec is not None:
+            return cls.codec.from_document(storage)
+        return storage
+
+    @classmethod
+    def update_user_data(cls, user, storage):
         """
 
         :param user:
@@ -854,30 +3212,170 @@ class _Session(telepot.aio.helper.UserHandler):
         :return:
         """
 
-        _Session.database.update({"storage": storage}, Query().user == user)
+        if isinstance(cls.database, KeyValueStore):
+            cls.database.put(user, storage)
+            return
+
+        if cls.codec is not None:
+            storage = cls.codec.to_document(storage)
+        cls.database.update({"storage": storage}, Query().user == user)
+
+    def _get_user(self, user: dict) -> User:
+        """
+        Returns the cached object of a message's sender, refreshed with the received information
+        :param user: The sender as dictionary
+        :return: The user object
+        """
+
+        cached = self.users.get(user['id'])
+        if cached is None:
+            cached = self.users[user['id']] = User(user)
+        else:
+            cached.update(user)
+
+        return cached
 
     def is_allowed(self):
         """
-        Tests, if the current session's user is white listed
+        Tests, if the current session's chat or user is allowed and not denied
         :return: If the user is allowed
         """
 
-        ids = _config_value("general", "allowed_ids")
+        return self.access.is_allowed(self.chat_id, self.user.id if self.user is not None else None)
 
-        # If no IDs are defined, the user is allowed
-        if ids is None:
-            return True
+    @classmethod
+    def _derive(cls) -> type:
+        """
+        Creates the session class of a bot, which keeps its own routes, sessions and storages
+        :return: The subclass
+        """
+
+        return type(cls.__name__, (cls,), {
+            "simple_routes": dict(),
+            "parse_routes": ParsingDict(),
+            "regex_routes": RegExDict(),
+            "command_routes": CommandDict(),
+            "media_routes": dict(),
+            "sessions": dict(),
+            "storages": dict(),
+            "storage_users": dict(),
+        })
+
+    @classmethod
+    def _load_defaults(cls) -> None:
+        """
+        Load default values from config
+        """
+
+        cls.codec = _storage_codec()
+        cls.mailbox_size = _config_value('bot', 'mailbox_size', default=100)
+        cls.mailbox_overflow = _config_value('bot', 'mailbox_overflow', default="drop_oldest")
+        cls.mailbox_reply = _config_value('bot', 'mailbox_reply', default=None)
+        cls.errors = _ErrorLog(_config_value('bot', 'error_samples', default=3),
+                               _config_value('bot', 'error_report_interval', default=60))
+        cls.error_replies = TTLCache(_config_value('bot', 'error_reply_interval', default=10), 10000)
+
+    async def on_message(self, msg: dict) -> None:
+        """
+        The function which will be called by telepot for every message of this session. Chat messages and callback
+        queries are put into the mailbox instead of being processed right away, so at most one handler runs at a time.
+        :param msg: The received message as dictionary
+        """
+
+        # Events like the idle timeout are handled by telepot directly
+        if telepot.flavor(msg) not in ('chat', 'callback_query'):
+            await self._router.route(msg)
+            return
+
+        updates = self.updates
+        if updates is not None:
+            updates.take(msg)
+
+        if len(self.mailbox) >= self.mailbox_size:
+            self.dropped += 1
+
+            if self.mailbox_overflow == "reject":
+                logger.warning(f"The mailbox of {self.key} is full, a message was rejected")
+                if updates is not None:
+                    updates.done(msg)
+                await self._reject(msg)
+                return
+
+            logger.warning(f"The mailbox of {self.key} is full, the oldest message was dropped")
+            dropped = self.mailbox.popleft()
+            if updates is not None:
+                updates.done(dropped)
+
+        self.mailbox.append(msg)
+        self._mail.set()
+
+        # The worker keeps running for the session's lifetime, so it keeps its context as well
+        if self._worker is None:
+            self._worker = asyncio.ensure_future(self._process_mailbox())
+
+    async def _process_mailbox(self) -> None:
+        """
+        Processes the messages of the mailbox in order
+        """
+
+        while True:
+            # After a shutdown started, the messages are left for the next instance
+            while not self.mailbox or Bot._draining:
+                self._mail.clear()
+                await self._mail.wait()
+
+            msg = self.mailbox.popleft()
+            self.current = msg
+            watchdog = Bot._watchdog
+            try:
+                if watchdog is not None:
+                    watchdog.track(telepot.flavor(msg), self.user)
+                if isinstance(self.database, KeyValueStore):
+                    self.storage, self.chat_storage = await self.database.load(self.storage_id, self.chat_id)
+                await self._router.route(msg)
+            except Exception as e:
+                logger.warning(f"Processing a message of {self.key} failed:\n\t\t{e!r}")
+            finally:
+                self.current = None
+                if watchdog is not None:
+                    watchdog.untrack()
+                if Bot._profiling is not None:
+                    Bot._profiling.processed()
+                if self.updates is not None:
+                    self.updates.done(msg)
+
+    async def _reject(self, msg: dict) -> None:
+        """
+        Informs the user that a message was rejected due to a full mailbox, if a reply is configured
+        :param msg: The rejected message as dictionary
+        """
+
+        if self.mailbox_reply is None:
+            # Stop the loading indicator of a pressed button anyway
+            if 'data' in msg:
+                await self.bot.answerCallbackQuery(msg['id'])
+            return
+
+        reply = Answer(self.mailbox_reply).msg
+        if 'data' in msg:
+            await self.bot.answerCallbackQuery(msg['id'], text=reply)
         else:
-            return self.user_id in ids
+            await self.bot.sendMessage(self.chat_id, reply, reply_to_message_id=msg['message_id'])
 
     async def on_close(self, timeout: int) -> None:
         """
-        The function which will be called by telepot when the connection times out. Unused.
+        The function which will be called by telepot when the connection times out
         :param timeout: The length of the exceeded timeout
         """
         logger.info("User {} timed out".format(self.user))
 
-        pass
+        if self._worker is not None:
+            self._worker.cancel()
+        if self.sessions.get(self.key) is self:
+            del self.sessions[self.key]
+
+        self._release_storage(self.storage_id)
+        self._release_storage(self.chat_id)
 
     async def on_callback_query(self, query: Dict) -> None:
         """
@@ -903,7 +3401,7 @@ class _Session(telepot.aio.helper.UserHandler):
                 replacement = first_true(choices, pred=lambda x: str(x[1]) == query['data'], default=("", ""))[0]
 
             # Edit the message
-            await self.bot.editMessageText((self.user.id, query['message']['message_id']),
+            await self.bot.editMessageText((self.chat_id, query['message']['message_id']),
                                            # The message and chat ids are inquired in this way to prevent an error when
                                            # the user clicks on old queries
                                            text=("{}\n<b>{}</b>" if lastMessage.markup == "HTML" else "{}\n**{}**")
@@ -934,35 +3432,69 @@ class _Session(telepot.aio.helper.UserHandler):
         if not self.is_allowed():
             return
 
+        # Edited messages are routed separately, if a handler is registered
+        if 'edit_date' in msg and type(self).edit_answer is not None:
+            await self.handle_edit(msg)
+            return
+
         # Tests, if it is normal message or something special
         if 'text' in msg:
             await self.handle_text_message(msg)
-        elif 'sticker' in msg:
+            return
+
+        media = self._content_type(msg)
+        if media in self.media_routes:
+            await self.handle_media(msg, media)
+        elif media == Media.STICKER:
             await self.handle_sticker(msg)
 
-    async def handle_text_message(self, msg: dict) -> None:
+    @staticmethod
+    def _content_type(msg: dict) -> Union[Media, None]:
         """
-        Processes a text message by routing it to the registered handlers and applying formatting
+        Determines the type of a message's attachment
         :param msg: The received message as dictionary
+        :return: The media type or None, if the message has no known attachment
         """
 
-        text = msg['text']
-        log = f'Message by {self.user}: "{text}"'
+        for key in msg.keys() & _Session.content_types.keys():
+            return _Session.content_types[key]
+
+        return None
+
+    def _prepare_context(self, msg: dict) -> bool:
+        """
+        Sets the context for processing a message and calls the preprocessing function
+        :param msg: The received message as dictionary
+        :return: If the message shall be processed further
+        """
 
-        # Prepare the context
-        _context.set('user', self.user)
-        _context.set('message', Message(msg))
-        _context.set('_<[storage]>_', self.storage)
+        message = Message(msg)
+        _user.set(self._get_user(msg['from']) if 'from' in msg else None)
+        _message.set(message)
+        _storage.set(self.storage)
+        _chat_storage.set(self.chat_storage)
+        _history.set(self.history)
+        _media.set(None)
 
         # If there is currently no generator ongoing, save this message additionally as init
         # This may be of use when inside a generator the starting message is needed
         if self.gen is None:
-            _context.set("init_message", Message(msg))
+            _init_message.set(message)
 
         # Calls the preprocessing function
-        if not Bot._before_function():
+        return type(self).before_function()
+
+    async def handle_text_message(self, msg: dict) -> None:
+        """
+        Processes a text message by routing it to the registered handlers and applying formatting
+        :param msg: The received message as dictionary
+        """
+
+        text = msg['text']
+        if not self._prepare_context(msg):
             return
 
+        log = f'Message by {_user.get()}: "{text}"'
         args: Tuple = ()
         kwargs: Dict = {}
 
@@ -984,24 +3516,81 @@ class _Session(telepot.aio.helper.UserHandler):
             args = tuple(text)
 
         # Check, if the message is covered by one of the known simple routes
-        elif text in _Session.simple_routes:
-            func = _Session.simple_routes[text]
+        elif text in self.simple_routes:
+            func = self.simple_routes[text]
+
+        # Check, if the message starts with one of the known commands
+        elif text in self.command_routes:
+            func, kwargs = self.command_routes[text]
 
         # Check, if the message is covered by one of the known parse routes
-        elif text in _Session.parse_routes:
-            func, matching = _Session.parse_routes[text]
+        elif text in self.parse_routes:
+            func, matching = self.parse_routes[text]
             kwargs = matching.named
 
         # Check, if the message is covered by one of the known regex routes
-        elif text in _Session.regex_routes:
-            func, matching = _Session.regex_routes[text]
+        elif text in self.regex_routes:
+            func, matching = self.regex_routes[text]
             kwargs = matching.groupdict()
 
         # After everything else has not matched, call the default handler
         else:
-            func = _Session.default_answer
+            func = type(self).default_answer
+
+        await self.call_handler(func, log, *args, **kwargs)
+
+    async def handle_media(self, msg: dict, media: Media) -> None:
+        """
+        Processes a message with an attachment by calling the route registered for its type
+        :param msg: The received message as dictionary
+        :param media: The type of the attachment
+        """
+
+        if not self._prepare_context(msg):
+            return
+
+        # Files are only wrapped, they are downloaded if the handler asks for it
+        # Of a photo, the largest size is used
+        attachment = msg[media.name.lower()]
+        if media == Media.PHOTO:
+            attachment = attachment[-1]
+        if media not in (Media.LOCATION, Media.CONTACT):
+            attachment = File(attachment, self.bot, _config_value('bot', 'max_download_size', default=20 * 2 ** 20))
+        _media.set(attachment)
+
+        await self.call_handler(self.media_routes[media], f'{media.name.capitalize()} by {_user.get()}')
+
+    async def handle_edit(self, msg: dict) -> None:
+        """
+        Processes an edited message by calling the registered handler
+        :param msg: The received message as dictionary
+        """
+
+        if not self._prepare_context(msg):
+            return
+
+        await self.call_handler(type(self).edit_answer,
+                                f'Message {msg["message_id"]} edited by {_user.get()}: '
+                                f'"{_message.get()}"')
+
+    async def call_handler(self, func: Callable, log: str, *args, **kwargs) -> None:
+        """
+        Calls a handler to process a message and catches any exceptions
+        :param func: The handler to be called
+        :param log: A logging string
+        :param args: The positional arguments for the handler
+        :param kwargs: The keyword arguments for the handler
+        """
+
+        # Blocking calls are attributed to the handler
+        name = getattr(func, "__qualname__", str(func))
+        if Bot._watchdog is not None:
+            Bot._watchdog.track(name, _user.get())
+
+        # A profile scoped to a route only records the handler's calls
+        if Bot._profiling is not None and Bot._profiling.route is not None:
+            func = Bot._profiling.wrap(func, name)
 
-        # Call the matching function to process the message and catch any exceptions
         try:
 
             # The user of the framework can choose freely between synchronous and asynchronous programming
@@ -1021,19 +3610,20 @@ class _Session(telepot.aio.helper.UserHandler):
             if reply is not None:
                 await self.prepare_answer(Answer(_config_value('bot', 'authorization_reply', default=None)))
 
-        # Catch any error
+        # Catch any error, repetitions are only counted
         except Exception as e:
+            if self.errors.record(getattr(func, "__qualname__", str(func)), e):
 
-            # Depending of the exceptions type, the specific message is on a different index
-            if isinstance(e, OSError):
-                msg = e.args[1]
-            else:
-                msg = e.args[0]
-            err = traceback.extract_tb(sys.exc_info()[2])[-1]
-            err = "\n\tDuring the processing occured an error\n\t\tError message: {}\n\t\tFile: {}\n\t\tFunc: {}" \
-                  "\n\t\tLiNo: {}\n\t\tLine: {}\n\tNothing was returned to the user" \
-                .format(msg, err.filename.split("/")[-1], err.name, err.lineno, err.line)
-            logger.warning(log + err)
+                # Depending of the exceptions type, the specific message is on a different index
+                if isinstance(e, OSError) and len(e.args) > 1:
+                    msg = e.args[1]
+                else:
+                    msg = str(e)
+                err = traceback.extract_tb(sys.exc_info()[2])[-1]
+                err = "\n\tDuring the processing occured an error\n\t\tError message: {}\n\t\tFile: {}\n\t\tFunc: {}" \
+                      "\n\t\tLiNo: {}\n\t\tLine: {}\n\tNothing was returned to the user" \
+                    .format(msg, err.filename.split("/")[-1], err.name, err.lineno, err.line)
+                logger.warning(log + err)
 
             # Send error message, if configured
             await self.handle_error()
@@ -1049,8 +3639,10 @@ class _Session(telepot.aio.helper.UserHandler):
         """
 
         # Syncs persistent storage
-        if _Session.database is not None:
-            _Session.update_user_data(self.user_id, self.storage)
+        if self.database is not None:
+            type(self).update_user_data(self.storage_id, self.storage)
+            if self.chat_storage is not self.storage:
+                type(self).update_user_data(self.chat_id, self.chat_storage)
 
         try:
 
@@ -1076,53 +3668,57 @@ class _Session(telepot.aio.helper.UserHandler):
             else:
                 await self.handle_answer([answer])
 
-        except IndexError:
-            err = '\n\tAn index error occured while preparing the answer.' \
-                  '\n\tLikely the answer is ill-formatted:\n\t\t{}'.format(str(answer))
-            logger.warning(log + err)
+        except IndexError as e:
+            if self.errors.record("prepare_answer", e):
+                err = '\n\tAn index error occured while preparing the answer.' \
+                      '\n\tLikely the answer is ill-formatted:\n\t\t{}'.format(str(answer))
+                logger.warning(log + err)
 
             # Send error message, if configured
             await self.handle_error()
             return
 
         except FileNotFoundError as e:
-            err = '\n\tThe request could not be fulfilled as the file "{}" could not be found'.format(e.filename)
-            logger.warning(log + err)
+            if self.errors.record("prepare_answer", e):
+                err = '\n\tThe request could not be fulfilled as the file "{}" could not be found'.format(e.filename)
+                logger.warning(log + err)
 
             # Send error message, if configured
             await self.handle_error()
             return
 
         except TelegramError as e:
-            reason = e.args[0]
+            if self.errors.record("prepare_answer", e):
+                reason = e.args[0]
 
-            # Try to give a clearer error description
-            if reason == "Bad Request: chat not found":
-                reason = "The recipient has either not yet started communication with this bot or blocked it"
+                # Try to give a clearer error description
+                if reason == "Bad Request: chat not found":
+                    reason = "The recipient has either not yet started communication with this bot or blocked it"
 
-            err = '\n\tThe request could not be fulfilled as an API error occured:' \
-                  '\n\t\t{}' \
-                  '\n\tNothing was returned to the user'.format(reason)
-            logger.warning(log + err)
+                err = '\n\tThe request could not be fulfilled as an API error occured:' \
+                      '\n\t\t{}' \
+                      '\n\tNothing was returned to the user'.format(reason)
+                logger.warning(log + err)
 
             # Send error message, if configured
             await self.handle_error()
             return
 
         except Exception as e:
+            if self.errors.record("prepare_answer", e):
 
-            # Depending of the exceptions type, the specific message is on a different index
-            if isinstance(e, OSError):
-                msg = e.args[1]
-            else:
-                msg = e.args[0]
-            err = traceback.extract_tb(sys.exc_info()[2])[-1]
-            err = "\n\tDuring the sending of the bot's answer occured an error\n\t\tError message: {}\n\t\tFile: {}" \
-                  "\n\t\tFunc: {}\n\t\tLiNo: {}\n\t\tLine: {}\n\tNothing was returned to the user" \
-                  "\n\tYou may report this bug as it either should not have occured " \
-                  "or should have been properly caught" \
-                .format(msg, err.filename.split("/")[-1], err.name, err.lineno, err.line)
-            logger.warning(log + err)
+                # Depending of the exceptions type, the specific message is on a different index
+                if isinstance(e, OSError) and len(e.args) > 1:
+                    msg = e.args[1]
+                else:
+                    msg = str(e)
+                err = traceback.extract_tb(sys.exc_info()[2])[-1]
+                err = "\n\tDuring the sending of the bot's answer occured an error\n\t\tError message: {}\n\t\tFile: {}" \
+                      "\n\t\tFunc: {}\n\t\tLiNo: {}\n\t\tLine: {}\n\tNothing was returned to the user" \
+                      "\n\tYou may report this bug as it either should not have occured " \
+                      "or should have been properly caught" \
+                    .format(msg, err.filename.split("/")[-1], err.name, err.lineno, err.line)
+                logger.warning(log + err)
 
             # Send error message, if configured
             await self.handle_error()
@@ -1138,26 +3734,34 @@ class _Session(telepot.aio.helper.UserHandler):
         :param msg: The received message as dictionary
         """
 
-        if not self.is_allowed():
-            return
-
         # Extract the emojis associated with the sticker
         if _config_value('bot', 'extract_emojis', default=False):
             logger.debug("Sticker by {}, will be dismantled".format(self.user))
             msg['text'] = msg['sticker']['emoji']
             await self.handle_text_message(msg)
+            return
 
         # Or call the default handler
-        answer = await self.default_sticker_answer()
-        self.prepare_answer(answer)
+        if not self._prepare_context(msg):
+            return
+
+        await self.call_handler(type(self).default_sticker_answer, "Sticker by {}".format(_user.get()))
 
     async def handle_error(self) -> None:
         """
-        Informs the connected user that an exception occured, if enabled
+        Informs the connected user that an exception occured, if enabled, but at most once per chat and interval
         """
 
-        if _config_value('bot', 'error_reply', default=None) is not None:
-            await self.prepare_answer(Answer(_config_value('bot', 'error_reply')))
+        reply = _config_value('bot', 'error_reply', default=None)
+        if reply is None or self.error_replies.get(self.chat_id):
+            return
+        self.error_replies[self.chat_id] = True
+
+        # The reply is sent directly, so a failure cannot cause another reply
+        try:
+            await Answer(reply)._send(self)
+        except Exception as e:
+            logger.debug(f"The error reply to {self.chat_id} could not be sent: {e!r}")
 
     async def handle_answer(self, answers: Iterable[Answer]) -> None:
         """
@@ -1165,20 +3769,74 @@ class _Session(telepot.aio.helper.UserHandler):
         :param answers: Answer objects to be sent
         """
 
+        answers = [answer if isinstance(answer, Answer) else Answer(str(answer)) for answer in answers]
+
+        # Deliver to different recipients concurrently, but keep the order for each recipient
+        if _config_value('bot', 'concurrent_delivery', default=False) and len(answers) > 1:
+            groups = {}
+            for answer in answers:
+                groups.setdefault(answer._recipient(self), []).append(answer)
+
+            # The answers a group sent before failing are registered as well as those of the other groups
+            sent_groups = [[] for _ in groups]
+            outcomes = await asyncio.gather(*(self._deliver(group, sent) for group, sent
+                                              in zip(groups.values(), sent_groups)), return_exceptions=True)
+            for sent in sent_groups:
+                for answer, message in sent:
+                    self._register_sent(answer, message)
+
+            # The first failure is handled like any other, further ones are only counted and logged
+            errors = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+            for error in errors[1:]:
+                if self.errors.record("handle_answer", error):
+                    logger.warning(f"Delivering answers to another recipient failed as well:\n\t\t{error!r}")
+            if errors:
+                raise errors[0]
+
+            return
+
         # Iterate over answers
         for answer in answers:
-            if not isinstance(answer, Answer):
-                answer = Answer(str(answer))
+            self._register_sent(answer, await answer._send(self))
+
+    async def _deliver(self, answers: List[Answer], results: List[Tuple[Answer, Dict]]) -> None:
+        """
+        Sends answers to the same recipient in order, merging consecutive photos and videos into media groups
+        :param answers: Answer objects to be sent
+        :param results: The list the answers are added to paired with their sent messages, as soon as they were sent
+        """
 
-            sent = await answer._send(self)
-            self.last_sent = answer, sent
-            _context.get("history").appendleft(Message(sent))
+        i = 0
+        while i < len(answers):
 
-            if answer.callback is not None:
-                if answer.is_query():
-                    self.query_callback[sent['message_id']] = answer.callback
-                else:
-                    self.callback = answer.callback
+            # Telegram allows up to ten items per media group
+            album = list(takewhile(Answer._is_album_item, answers[i:i + 10]))
+            if len(album) > 1:
+                results.extend(zip(album, await Answer._send_album(self, album)))
+                i += len(album)
+            else:
+                results.append((answers[i], await answers[i]._send(self)))
+                i += 1
+
+    def _register_sent(self, answer: Answer, sent: Dict) -> None:
+        """
+        Remembers a sent answer in the history and registers its callback
+        :param answer: The sent answer
+        :param sent: The sent message as dictionary
+        """
+
+        # An empty stream sends nothing
+        if sent is None:
+            return
+
+        self.last_sent = answer, sent
+        self.history.appendleft(Message(sent))
+
+        if answer.callback is not None:
+            if answer.is_query():
+                self.query_callback[sent['message_id']] = answer.callback
+            else:
+                self.callback = answer.callback
 
     async def handle_generator(self, msg=None, first_call=False):
         """
@@ -1224,3 +3882,131 @@ class _Session(telepot.aio.helper.UserHandler):
         """
         Sets the default sticker answer function to do nothing if not overwritten
         """
+
+    @staticmethod
+    def before_function() -> bool:
+        """
+        Lets every message be processed if not overwritten
+        """
+
+        return True
+
+
+class _InlineSession(telepot.aio.helper.InlineUserHandler):
+    """
+    The underlying framework telepot spawns an instance of this class for every user sending inline queries.
+    As a query is sent with every keystroke, it debounces them and answers from a cache shared by all users.
+    """
+
+    # The registered handler and the cache of its results
+    handler: Callable = None
+    cache: TTLCache = None
+
+    def __init__(self, *args, **kwargs):
+        """
+        Initialize the session, called by the underlying framework telepot
+        :param args: Used by telepot
+        :param kwargs: Used by telepot
+        """
+
+        super(_InlineSession, self).__init__(*args, **kwargs)
+
+        self.user = User(args[0][1]['from'])
+
+        # The query waiting for being answered
+        self.pending: Union[asyncio.Future, None] = None
+
+    async def on_inline_query(self, query: Dict) -> None:
+        """
+        The function which will be called by telepot if the incoming message is an inline query
+        :param query: The received query as dictionary
+        """
+
+        if type(self).handler is None:
+            return
+
+        # A new query supersedes the one which is still waiting
+        if self.pending is not None and not self.pending.done():
+            self.pending.cancel()
+
+        self.pending = asyncio.ensure_future(self.handle_inline_query(query))
+
+    async def on_chosen_inline_result(self, result: Dict) -> None:
+        """
+        The function which will be called by telepot if the user chose a result. Unused.
+        """
+
+        pass
+
+    async def on_close(self, timeout: int) -> None:
+        """
+        The function which will be called by telepot when the connection times out. Unused.
+        """
+
+        pass
+
+    async def handle_inline_query(self, query: Dict) -> None:
+        """
+        Answers a query with a page of results, which are computed after the debounce delay unless they are cached
+        :param query: The received query as dictionary
+        """
+
+        text = query['query']
+        offset = int(query.get('offset') or 0)
+        page_size = _config_value('inline', 'page_size', default=50)
+        personal = _config_value('inline', 'is_personal', default=False)
+
+        # Queries only differing in case and whitespace share their results
+        key = " ".join(text.split()).casefold()
+        if personal:
+            key = self.user.id, key
+
+        results = self.cache.get(key)
+        if results is None:
+
+            # Wait for further keystrokes, which will cancel this task
+            await asyncio.sleep(_config_value('inline', 'debounce', default=0.3))
+
+            _user.set(self.user)
+            try:
+                if iscoroutinefunction(type(self).handler):
+                    results = await type(self).handler(text)
+                else:
+                    results = type(self).handler(text)
+
+                results = [self._convert(index, result) for index, result in enumerate(results or [])]
+            except Exception as e:
+                logger.warning(f'Inline query by {self.user}: "{text}"\n\tDuring the processing occured an error'
+                               f'\n\t\tError message: {e!r}\n\tNothing was returned to the user')
+                return
+
+            self.cache[key] = results
+
+        # Telegram requests the following pages with the offset it received
+        page = results[offset:offset + page_size]
+        next_offset = str(offset + page_size) if len(results) > offset + page_size else ""
+
+        try:
+            await self.bot.answerInlineQuery(query['id'], page,
+                                             cache_time=_config_value('inline', 'cache_time', default=300),
+                                             is_personal=personal,
+                                             next_offset=next_offset)
+        except TelegramError as e:
+            logger.warning(f'Inline query by {self.user}: "{text}"\n\tThe request could not be fulfilled as an API '
+                           f'error occured:\n\t\t{e.args[0]}')
+        else:
+            logger.info(f'Inline query by {self.user}: "{text}"')
+
+    @staticmethod
+    def _convert(index: int, result: Any) -> Any:
+        """
+        Converts a string into an article, which sends the string when chosen
+        :param index: The result's position, used as its id
+        :param result: The result as returned by the handler
+        :return: The result as accepted by telepot
+        """
+
+        if isinstance(result, str):
+            return InlineQueryResultArticle(id=str(index), title=result,
+                                            input_message_content=InputTextMessageContent(message_text=result))
+        return result
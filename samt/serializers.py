@@ -0,0 +1,366 @@
+"""
+Serializers for the records of the persistent storage. Every record is written in an envelope naming its format and
+compression, so records written in an older format stay readable after switching and are converted on their next write.
+"""
+
+import base64
+import json
+import zlib
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The start of every envelope, followed by the envelope's version, the format's id and the flags
+MAGIC = b"\xa7S"
+ENVELOPE_VERSION = 1
+HEADER_SIZE = len(MAGIC) + 3
+
+# The flags of an envelope
+ZLIB = 1
+ZSTD = 2
+TAGGED = 4
+
+
+def _tag(value: Any) -> Dict[str, Any]:
+    """
+    Represents a value, which json cannot express, as a dictionary with a single marked key
+    :param value: A set, date, datetime or bytes
+    :return: The tagged value
+    """
+
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, (set, frozenset)):
+        return {"__set__": list(value)}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(value).decode()}
+    raise TypeError(f"Object of type {type(value).__name__} cannot be stored")
+
+
+# The functions restoring tagged values
+_untag: Dict[str, Callable[[Any], Any]] = {
+    "__set__": set,
+    "__datetime__": datetime.fromisoformat,
+    "__date__": date.fromisoformat,
+    "__bytes__": base64.b64decode,
+}
+
+
+def _restore(obj: Dict) -> Any:
+    """
+    Restores a tagged value, used as object hook while decoding
+    :param obj: A decoded dictionary
+    :return: The restored value or the unchanged dictionary
+    """
+
+    if len(obj) == 1:
+        key, = obj
+        restore = _untag.get(key)
+        if restore is not None:
+            return restore(obj[key])
+    return obj
+
+
+def _tag_all(value: Any) -> Any:
+    """
+    Converts a record into values json can express, tagging the others
+    :param value: The record
+    :return: A converted copy of the record
+    """
+
+    if type(value) is dict:
+        return {key: _tag_all(item) for key, item in value.items()}
+    if type(value) is list or type(value) is tuple:
+        return [_tag_all(item) for item in value]
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+
+    tagged = _tag(value)
+    if "__set__" in tagged:
+        tagged["__set__"] = [_tag_all(item) for item in tagged["__set__"]]
+    return tagged
+
+
+def _restore_all(value: Any) -> Any:
+    """
+    Restores all tagged values of a decoded structure in place
+    :param value: The decoded value
+    :return: The value with restored values
+    """
+
+    if type(value) is dict:
+        for key, item in value.items():
+            if type(item) is dict or type(item) is list:
+                value[key] = _restore_all(item)
+        return _restore(value)
+
+    if type(value) is list:
+        for i, item in enumerate(value):
+            if type(item) is dict or type(item) is list:
+                value[i] = _restore_all(item)
+
+    return value
+
+
+class Serializer:
+    """
+    The interface of a format, which turns records into bytes and back
+    """
+
+    # The format's name in the configuration and its id in the envelope, which must never change
+    name = ""
+    id = 0
+
+    def dumps(self, obj: Any) -> Tuple[bytes, bool]:
+        """
+        Serializes a record
+        :param obj: The record
+        :return: The bytes and if values were tagged, which must be restored after decoding
+        """
+
+        raise NotImplementedError
+
+    def loads(self, data: bytes, tagged: bool) -> Any:
+        """
+        Deserializes a record
+        :param data: The bytes
+        :param tagged: If the record contains tagged values
+        :return: The record
+        """
+
+        raise NotImplementedError
+
+
+class JsonSerializer(Serializer):
+    """
+    The json module of the standard library
+    """
+
+    name = "json"
+    id = 1
+
+    def dumps(self, obj: Any) -> Tuple[bytes, bool]:
+        # Only records with sets, datetimes or bytes need the object hook while decoding
+        tagged = False
+
+        def default(value):
+            nonlocal tagged
+            tagged = True
+            return _tag(value)
+
+        return json.dumps(obj, default=default, separators=(",", ":"), ensure_ascii=False).encode(), tagged
+
+    def loads(self, data: bytes, tagged: bool) -> Any:
+        return json.loads(data, object_hook=_restore if tagged else None)
+
+
+class OrjsonSerializer(Serializer):
+    """
+    The orjson package, which is considerably faster than the standard library
+    """
+
+    name = "orjson"
+    id = 2
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("The storage format orjson requires the package orjson")
+
+    def dumps(self, obj: Any) -> Tuple[bytes, bool]:
+        # Only records with sets, datetimes or bytes are walked after decoding
+        tagged = False
+
+        def default(value):
+            nonlocal tagged
+            tagged = True
+            return _tag(value)
+
+        data = orjson.dumps(obj, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+        return data, tagged
+
+    def loads(self, data: bytes, tagged: bool) -> Any:
+        obj = orjson.loads(data)
+        return _restore_all(obj) if tagged else obj
+
+
+class MsgpackSerializer(Serializer):
+    """
+    The msgpack package, a compact binary format, which keeps bytes and integer keys as they are
+    """
+
+    name = "msgpack"
+    id = 3
+
+    # The extension types of values msgpack cannot express
+    SET = 1
+    DATETIME = 2
+    DATE = 3
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("The storage format msgpack requires the package msgpack")
+
+    def _default(self, value: Any) -> Any:
+        if isinstance(value, (set, frozenset)):
+            return msgpack.ExtType(self.SET, msgpack.packb(list(value), default=self._default))
+        if isinstance(value, datetime):
+            return msgpack.ExtType(self.DATETIME, value.isoformat().encode())
+        if isinstance(value, date):
+            return msgpack.ExtType(self.DATE, value.isoformat().encode())
+        raise TypeError(f"Object of type {type(value).__name__} cannot be stored")
+
+    def _ext_hook(self, code: int, data: bytes) -> Any:
+        if code == self.SET:
+            return set(msgpack.unpackb(data, ext_hook=self._ext_hook, strict_map_key=False))
+        if code == self.DATETIME:
+            return datetime.fromisoformat(data.decode())
+        if code == self.DATE:
+            return date.fromisoformat(data.decode())
+        return msgpack.ExtType(code, data)
+
+    def dumps(self, obj: Any) -> Tuple[bytes, bool]:
+        return msgpack.packb(obj, default=self._default, use_bin_type=True), False
+
+    def loads(self, data: bytes, tagged: bool) -> Any:
+        return msgpack.unpackb(data, ext_hook=self._ext_hook, strict_map_key=False)
+
+
+# The known formats by their name and id
+formats: Dict[str, type] = {cls.name: cls for cls in (JsonSerializer, OrjsonSerializer, MsgpackSerializer)}
+_formats_by_id: Dict[int, type] = {cls.id: cls for cls in formats.values()}
+
+
+def available_formats() -> list:
+    """
+    Lists the formats, whose packages are installed
+    :return: The formats' names
+    """
+
+    return [name for name, module in (("json", json), ("orjson", orjson), ("msgpack", msgpack)) if module is not None]
+
+
+class Codec:
+    """
+    Writes records in the configured format and compression and reads records of any known format
+    """
+
+    def __init__(self, format: str = "json", compression: Optional[str] = None, min_size: int = 1024,
+                 level: int = 3):
+        """
+        Initializes the codec
+        :param format: The name of the format for writing
+        :param compression: Either zstd, zlib or None, records are only compressed if they are at least min_size bytes
+        :param min_size: The smallest serialized size in bytes, which is compressed
+        :param level: The compression level
+        """
+
+        if format not in formats:
+            raise ValueError(f"Unknown storage format {format}, use one of {', '.join(formats)}")
+        self.serializer: Serializer = formats[format]()
+        self._serializers: Dict[int, Serializer] = {self.serializer.id: self.serializer}
+
+        if compression == "zstd":
+            if zstandard is None:
+                raise ImportError("The storage compression zstd requires the package zstandard")
+            self._compress = zstandard.ZstdCompressor(level=level).compress
+        elif compression == "zlib":
+            self._compress = lambda data: zlib.compress(data, level)
+        elif compression is None:
+            self._compress = None
+        else:
+            raise ValueError(f"Unknown storage compression {compression}, use zstd or zlib")
+
+        self.compression = compression
+        self.min_size = min_size
+
+    def dumps(self, obj: Any) -> bytes:
+        """
+        Serializes a record into an envelope
+        :param obj: The record
+        :return: The envelope's bytes
+        """
+
+        data, tagged = self.serializer.dumps(obj)
+
+        flags = TAGGED if tagged else 0
+        if self._compress is not None and len(data) >= self.min_size:
+            data = self._compress(data)
+            flags |= ZSTD if self.compression == "zstd" else ZLIB
+
+        return MAGIC + bytes((ENVELOPE_VERSION, self.serializer.id, flags)) + data
+
+    def loads(self, data: bytes) -> Any:
+        """
+        Deserializes an envelope written in any known format, or a plain json document of earlier versions
+        :param data: The envelope's bytes
+        :return: The record
+        """
+
+        if not data.startswith(MAGIC):
+            return json.loads(data)
+
+        version, format_id, flags = data[len(MAGIC):HEADER_SIZE]
+        if version > ENVELOPE_VERSION:
+            raise ValueError(f"The record was written by a newer version of the envelope ({version})")
+
+        serializer = self._serializers.get(format_id)
+        if serializer is None:
+            if format_id not in _formats_by_id:
+                raise ValueError(f"The record was written in an unknown format ({format_id})")
+            serializer = self._serializers[format_id] = _formats_by_id[format_id]()
+
+        payload = data[HEADER_SIZE:]
+        if flags & ZSTD:
+            if zstandard is None:
+                raise ImportError("The record is compressed with zstd, which requires the package zstandard")
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        elif flags & ZLIB:
+            payload = zlib.decompress(payload)
+
+        return serializer.loads(payload, bool(flags & TAGGED))
+
+    @staticmethod
+    def to_document(obj: Any) -> Any:
+        """
+        Converts a record into plain json values, which are embedded in a json document as they are, so the document
+        stays readable. Sets, dates, datetimes and bytes are tagged.
+        :param obj: The record
+        :return: The converted record
+        """
+
+        return _tag_all(obj)
+
+    @staticmethod
+    def from_document(obj: Any) -> Any:
+        """
+        Restores the tagged values of a record converted by to_document
+        :param obj: The converted record
+        :return: The record
+        """
+
+        return _restore_all(obj)
+
+    def loads_text(self, text: str) -> Any:
+        """
+        Deserializes an envelope embedded in a json document as base64, as earlier versions wrote them
+        :param text: The envelope as base64
+        :return: The record
+        """
+
+        return self.loads(base64.b64decode(text))
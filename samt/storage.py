@@ -0,0 +1,590 @@
+"""
+Key-value backends for the persistent storage, which let several processes of a bot share the storages of users and
+chats. Set storage_file in the section general to a url like redis://localhost:6379/0 to use the Redis backend.
+"""
+
+import asyncio
+import copy
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from samt.serializers import Codec
+
+# Messages go to the bot's log
+logger = logging.getLogger("samt.samt")
+
+
+class StorageConflict(Exception):
+    """
+    Raised by a backend for a record, which was changed by another process since it was read
+    """
+
+
+class Record(dict):
+    """
+    A record as read from a store, which keeps the version it was read in, so a change is based on this version even if
+    the record left the cache in the meantime, and its serialized form, so an unchanged record is not written again
+    """
+
+    __slots__ = ("version", "snapshot")
+
+    def __init__(self, record: dict = (), version: int = 0, snapshot: bytes = None):
+        super().__init__(record)
+        self.version = version
+        self.snapshot = snapshot
+
+
+class KeyValueStore(ABC):
+    """
+    The interface of a shared storage backend. Records are dictionaries with a version, which is raised on every write.
+    Reads go through a local cache, writes are collected and sent in batches, which only succeed if the record still
+    has the version the change was based on. Otherwise the change is dropped as lost update and the record is read anew.
+    Backends implement _fetch, _write and optionally _listen to learn about changes of other processes.
+    The framework's own records, whose keys start with _<[, are never evicted from the cache.
+    """
+
+    def __init__(self, prefix: str = "samt:", cache_size: int = 10000, flush_interval: float = 0.0,
+                 codec: Codec = None):
+        """
+        Initializes the store without connecting
+        :param prefix: The prefix of all keys of this store
+        :param cache_size: The number of records kept locally
+        :param flush_interval: The seconds changes are collected before they are written
+        :param codec: The serialization of the records, defaults to json
+        """
+
+        self.prefix = prefix
+        self._reserved = f"{prefix}_<["
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.codec = codec if codec is not None else Codec()
+
+        # The cached records and their versions, and the changed ones with the version they are based on
+        self._cache: "OrderedDict[str, Tuple[int, dict]]" = OrderedDict()
+        self._dirty: Dict[str, Tuple[int, dict]] = dict()
+        self._flush_handle: Optional[asyncio.Handle] = None
+        self._flushing: Optional[asyncio.Future] = None
+        self._listener: Optional[asyncio.Future] = None
+
+        # Set once the backend announces changes of other processes, records read before might miss them
+        self._listening = asyncio.Event()
+
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+
+    def _key(self, key: Hashable) -> str:
+        return f"{self.prefix}{key}"
+
+    def table(self, name: str) -> "KeyValueStore":
+        """
+        Returns a store for the records of a single bot, which shares this store's backend and connections, but keeps
+        its records under a prefix of its own with a cache of its own. Backends may override it, e.g. to connect anew.
+        :param name: The name of the bot
+        :return: The store
+        """
+
+        table = copy.copy(self)
+        KeyValueStore.__init__(table, f"{self.prefix}{name}:", self.cache_size, self.flush_interval, self.codec)
+        return table
+
+    def cached(self, key: Hashable) -> dict:
+        """
+        Returns a record without waiting for the backend
+        :param key: The id of the user or chat, or a reserved key
+        :return: The cached record or an empty one, if it was not loaded yet
+        """
+
+        entry = self._cache.get(self._key(key))
+        return entry[1] if entry is not None else dict()
+
+    async def load(self, *keys: Hashable) -> List[dict]:
+        """
+        Returns the current records, reading those which are not cached with a single request
+        :param keys: The ids of users or chats, or reserved keys
+        :return: The records in the order of the keys, equal keys give the same record
+        """
+
+        names = [self._key(key) for key in keys]
+
+        records = dict()
+        missing = []
+        for name in names:
+            if name in records or name in missing:
+                continue
+            entry = self._cache.get(name)
+            if entry is None:
+                missing.append(name)
+            else:
+                self._cache.move_to_end(name)
+                records[name] = entry[1]
+        self.hits += len(records)
+
+        if missing:
+            self.misses += len(missing)
+            await self._start_listener()
+            for name, entry in zip(missing, await self._fetch(missing)):
+                # A change made meanwhile is newer than what was read
+                if name in self._cache:
+                    entry = self._cache[name]
+                else:
+                    version, record = entry if entry is not None else (0, dict())
+                    entry = (version, Record(record, version, self.codec.dumps(record)))
+                    self._remember(name, entry)
+                records[name] = entry[1]
+
+        return [records[name] for name in names]
+
+    def recent(self) -> List[str]:
+        """
+        Lists the keys of the cached records, e.g. to read them ahead in the next instance of the bot
+        :return: The keys without prefix, the most recently used last
+        """
+
+        return [name[len(self.prefix):] for name in self._cache]
+
+    def put(self, key: Hashable, record: dict) -> None:
+        """
+        Marks a record as changed, it is written with the next batch
+        :param key: The id of the user or chat, or a reserved key
+        :param record: The changed record
+        """
+
+        name = self._key(key)
+        if name in self._dirty:
+            version = self._dirty[name][0]
+        elif isinstance(record, Record):
+            version = record.version
+        else:
+            entry = self._cache.get(name)
+            version = entry[0] if entry is not None else 0
+        self._dirty[name] = (version, record)
+        self._remember(name, (version, record))
+
+        # Collect further changes of this loop iteration or interval
+        if self._flush_handle is None and self._flushing is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(self.flush_interval, self._start_flush)
+
+    def invalidate(self, versions: Dict[str, int]) -> None:
+        """
+        Drops cached records, which were changed by another process
+        :param versions: The new versions keyed by the changed records' names
+        """
+
+        for name, version in versions.items():
+            entry = self._cache.get(name)
+            if entry is not None and entry[0] < version:
+                del self._cache[name]
+
+    def _remember(self, name: str, entry: Tuple[int, dict]) -> None:
+        """
+        Caches a record and evicts the least recently used ones, which have no pending changes and are not reserved
+        :param name: The record's name
+        :param entry: The version and the record
+        """
+
+        self._cache[name] = entry
+        self._cache.move_to_end(name)
+
+        # Records, which must stay, are moved to the end instead
+        excess = len(self._cache) - self.cache_size
+        kept = 0
+        while excess > 0 and kept < len(self._cache):
+            name = next(iter(self._cache))
+            if name in self._dirty or name.startswith(self._reserved):
+                self._cache.move_to_end(name)
+                kept += 1
+            else:
+                del self._cache[name]
+                excess -= 1
+
+    def _forget(self) -> None:
+        """
+        Drops all cached records without pending changes, e.g. after changes of other processes might have been missed
+        """
+
+        self._cache = OrderedDict((name, entry) for name, entry in self._cache.items() if name in self._dirty)
+
+    def _start_flush(self) -> None:
+        self._flush_handle = None
+        self._flushing = asyncio.ensure_future(self.flush())
+
+    async def flush(self) -> None:
+        """
+        Writes the changed records in batches until none are left
+        """
+
+        try:
+            while self._dirty:
+                batch, self._dirty = self._dirty, dict()
+
+                # Records which equal what was read or written are skipped, as writing them would only raise their
+                # version and make other processes drop their copies and lose their next change
+                data = dict()
+                for name, (version, record) in list(batch.items()):
+                    data[name] = self.codec.dumps(record)
+                    if isinstance(record, Record) and record.snapshot == data[name]:
+                        del batch[name], data[name]
+                if not batch:
+                    continue
+
+                try:
+                    versions = await self._write({name: (version, data[name])
+                                                  for name, (version, _) in batch.items()})
+                except Exception as e:
+                    # Keep the changes for the next attempt, unless they were changed again meanwhile
+                    logger.warning(f"Writing {len(batch)} records to the storage failed:\n\t\t{e!r}")
+                    self._dirty = dict(batch, **self._dirty)
+                    asyncio.get_event_loop().call_later(1, self._schedule_retry)
+                    return
+
+                for name, version in versions.items():
+                    if isinstance(version, StorageConflict):
+                        self.conflicts += 1
+                        logger.warning(f"The record {name} was changed by another process, the change was dropped")
+                        self._cache.pop(name, None)
+
+                        # Further changes are based on the outdated record as well
+                        self._dirty.pop(name, None)
+                    else:
+                        record = batch[name][1]
+                        if isinstance(record, Record):
+                            record.version = version
+                            record.snapshot = data[name]
+                        if name not in self._dirty:
+                            self._remember(name, (version, record))
+                        else:
+                            # Base further changes on the written version
+                            self._dirty[name] = (version, self._dirty[name][1])
+        finally:
+            self._flushing = None
+
+    def _schedule_retry(self) -> None:
+        if self._dirty and self._flush_handle is None and self._flushing is None:
+            self._start_flush()
+
+    async def _start_listener(self) -> None:
+        """
+        Starts listening for changes of other processes and waits until the backend listens, so changes of the records
+        read afterwards are not missed
+        """
+
+        if self._listener is None:
+            self._listener = asyncio.ensure_future(self._listen())
+            self._listener.add_done_callback(lambda _: self._listening.set())
+
+        if not self._listening.is_set():
+            await self._listening.wait()
+
+    async def lease(self, key: Hashable, holder: str, duration: float) -> bool:
+        """
+        Takes or renews a lease, which only one holder has at a time, until it expires. The record is read and written
+        bypassing the cache, so the version check decides between competing processes.
+        :param key: The reserved key of the lease
+        :param holder: The name of the taking process
+        :param duration: The seconds until the lease expires, unless it is renewed
+        :return: If the holder has the lease now
+        """
+
+        name = self._key(key)
+        entry, = await self._fetch([name])
+        version, record = entry if entry is not None else (0, dict())
+        if record.get("holder") not in (None, holder) and record.get("until", 0) > time.time():
+            return False
+
+        written = await self._write({name: (version, self.codec.dumps({"holder": holder,
+                                                                         "until": time.time() + duration}))})
+        return not isinstance(written[name], StorageConflict)
+
+    async def close(self) -> None:
+        """
+        Writes the pending changes and closes the connections to the backend
+        """
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flushing is not None:
+            await self._flushing
+        await self.flush()
+
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+
+    @abstractmethod
+    async def _fetch(self, names: List[str]) -> List[Optional[Tuple[int, dict]]]:
+        """
+        Reads records from the backend
+        :param names: The records' names
+        :return: The versions and records or None for missing records, in the order of the names
+        """
+
+        raise NotImplementedError
+
+    @abstractmethod
+    async def _write(self, records: Dict[str, Tuple[int, bytes]]) -> Dict[str, Any]:
+        """
+        Writes records to the backend, if their stored versions match
+        :param records: The expected versions and the serialized records keyed by their names
+        :return: The new version or a StorageConflict keyed by the records' names
+        """
+
+        raise NotImplementedError
+
+    async def _listen(self) -> None:
+        """
+        Invalidates cached records, which were changed by other processes, for the lifetime of the store. Sets
+        _listening once changes are received, or could not be subscribed to.
+        """
+
+
+class RedisError(Exception):
+    """
+    An error reply of a Redis server
+    """
+
+
+async def _read_reply(reader: asyncio.StreamReader) -> Any:
+    """
+    Reads a single value in the Redis serialization protocol
+    :param reader: The stream to read from
+    :return: The value, errors are returned and not raised to keep pipelines in sync
+    """
+
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("The connection to Redis was closed")
+
+    kind, value = line[:1], line[1:-2]
+    if kind == b"+":
+        return value.decode()
+    if kind == b"-":
+        return RedisError(value.decode())
+    if kind == b":":
+        return int(value)
+    if kind == b"$":
+        length = int(value)
+        return None if length < 0 else (await reader.readexactly(length + 2))[:-2]
+    if kind == b"*":
+        length = int(value)
+        return None if length < 0 else [await _read_reply(reader) for _ in range(length)]
+
+    raise ConnectionError(f"Invalid reply from Redis: {line!r}")
+
+
+def _encode(*commands: Tuple) -> bytes:
+    """
+    Encodes commands in the Redis serialization protocol, so they can be sent at once
+    :param commands: The commands with their arguments
+    :return: The encoded pipeline
+    """
+
+    parts = []
+    for command in commands:
+        parts.append(b"*%d\r\n" % len(command))
+        for arg in command:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+class _RedisConnection:
+    """
+    A connection to a Redis server, which sends pipelines of commands one after another
+    """
+
+    def __init__(self, host: str, port: int, db: int = 0, password: str = None):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.lock = asyncio.Lock()
+
+    async def connect(self) -> None:
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        setup = []
+        if self.password is not None:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            for reply in await self._send(setup):
+                if isinstance(reply, RedisError):
+                    raise reply
+
+    async def execute(self, *commands: Tuple) -> List[Any]:
+        """
+        Sends commands in a single round trip, reconnecting first if necessary
+        :param commands: The commands with their arguments
+        :return: The replies in the order of the commands
+        """
+
+        async with self.lock:
+            if self.writer is None:
+                await self.connect()
+            # A connection left with unread replies, e.g. by a cancelled caller, would answer the next commands wrongly
+            try:
+                return await self._send(commands)
+            except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+                self.close()
+                raise
+
+    async def _send(self, commands) -> List[Any]:
+        self.writer.write(_encode(*commands))
+        await self.writer.drain()
+        return [await _read_reply(self.reader) for _ in commands]
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class RedisStore(KeyValueStore):
+    """
+    A storage backend for Redis or any server speaking its protocol. Every record is kept as its version followed by
+    the serialized record. Writes check the versions inside a transaction, and announce the new versions on a channel,
+    so other processes drop their cached copies.
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "samt:", cache_size: int = 10000,
+                 flush_interval: float = 0.0, codec: Codec = None):
+        """
+        Initializes the store without connecting
+        :param url: The server's url as redis://[:password@]host[:port][/db]
+        :param prefix: The prefix of all keys of this store
+        :param cache_size: The number of records kept locally
+        :param flush_interval: The seconds changes are collected before they are written
+        :param codec: The serialization of the records, defaults to json
+        """
+
+        super().__init__(prefix, cache_size, flush_interval, codec)
+
+        self.url = url
+        parsed = urlparse(url)
+        self._address = dict(host=parsed.hostname or "localhost", port=parsed.port or 6379,
+                             db=int(parsed.path.strip("/") or 0), password=parsed.password)
+
+        # Reads and writes use their own connections, as a transaction spans two round trips
+        self._reads = _RedisConnection(**self._address)
+        self._writes = _RedisConnection(**self._address)
+        self._transaction = asyncio.Lock()
+        self.channel = f"{prefix}changes"
+
+    def table(self, name: str) -> "RedisStore":
+        return RedisStore(self.url, f"{self.prefix}{name}:", self.cache_size, self.flush_interval, self.codec)
+
+    async def _fetch(self, names: List[str]) -> List[Optional[Tuple[int, dict]]]:
+        values, = await self._reads.execute(("MGET", *names))
+        if isinstance(values, RedisError):
+            raise values
+        return [self._decode(value) for value in values]
+
+    def _decode(self, value: Optional[bytes]) -> Optional[Tuple[int, dict]]:
+        if value is None:
+            return None
+
+        # Records of earlier versions are json documents with the version inside
+        if value.startswith(b"{"):
+            record = json.loads(value)
+            return record["version"], record["storage"]
+
+        version, _, data = value.partition(b":")
+        return int(version), self.codec.loads(data)
+
+    @staticmethod
+    def _version(value: Optional[bytes]) -> int:
+        if value is None:
+            return 0
+        if value.startswith(b"{"):
+            return json.loads(value)["version"]
+        return int(value[:value.index(b":")])
+
+    async def _write(self, records: Dict[str, Tuple[int, bytes]]) -> Dict[str, Any]:
+        # The watched keys belong to the connection, so transactions must not interleave
+        async with self._transaction:
+            return await self._transact(records)
+
+    async def _transact(self, records: Dict[str, Tuple[int, bytes]]) -> Dict[str, Any]:
+        result = dict()
+
+        while records:
+            names = list(records)
+
+            # Watch the records, so the transaction fails if one changes after reading its version
+            _, values = await self._writes.execute(("WATCH", *names), ("MGET", *names))
+            if isinstance(values, RedisError):
+                raise values
+
+            writes = dict()
+            for name, value in zip(names, values):
+                version, storage = records[name]
+                if self._version(value) != version:
+                    result[name] = StorageConflict(name)
+                else:
+                    writes[name] = (version + 1, storage)
+
+            if not writes:
+                await self._writes.execute(("UNWATCH",))
+                break
+
+            changes = json.dumps({name: version for name, (version, _) in writes.items()})
+            replies = await self._writes.execute(
+                ("MULTI",),
+                *(("SET", name, b"%d:%s" % (version, storage)) for name, (version, storage) in writes.items()),
+                ("PUBLISH", self.channel, changes),
+                ("EXEC",))
+
+            # A failed transaction is repeated, where the changed records now show up as conflicts
+            if replies[-1] is None:
+                records = {name: records[name] for name in writes}
+                continue
+            if isinstance(replies[-1], RedisError):
+                raise replies[-1]
+
+            result.update((name, version) for name, (version, _) in writes.items())
+            break
+
+        return result
+
+    async def _listen(self) -> None:
+        connection = _RedisConnection(**self._address)
+
+        while True:
+            try:
+                await connection.execute(("SUBSCRIBE", self.channel))
+
+                # Records read before the subscription took effect may have been changed unnoticed
+                self._forget()
+                self._listening.set()
+
+                while True:
+                    message = await _read_reply(connection.reader)
+                    if isinstance(message, list) and message[0] == b"message":
+                        self.invalidate(json.loads(message[2]))
+
+            except asyncio.CancelledError:
+                connection.close()
+                raise
+
+            except Exception as e:
+                # Changes are missed while disconnected, so nothing cached can be trusted anymore
+                logger.warning(f"Listening for changes of the storage failed:\n\t\t{e!r}")
+                connection.close()
+                self._forget()
+                self._listening.set()
+                await asyncio.sleep(1)
+
+    async def close(self) -> None:
+        await super().close()
+        self._reads.close()
+        self._writes.close()
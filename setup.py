@@ -16,10 +16,12 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     license="MIT",
-    install_requires=['toml', 'telepot', 'aiotask_context', 'more-itertools'],
+    install_requires=['toml', 'telepot', 'more-itertools'],
     extras_require={
         "Easy parsing": ["parse"],
-        "Persistent storage": ["tinydb"]
+        "Persistent storage": ["tinydb"],
+        "Fast serialization": ["orjson", "msgpack"],
+        "Compression": ["zstandard"]
     },
     url="https://github.com/neunzehnhundert97/SAMT"
 )
@@ -0,0 +1,103 @@
+"""
+Helpers running bots in processes of their own against the local stand-ins of the Telegram API and Redis, so they can
+be stopped and restarted like in production
+"""
+
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+from typing import Dict, List
+
+from samt.fakeapi import FakeTelegramServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    """
+    Finds a port, which is not in use
+    :return: The port
+    """
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class BotProcess:
+    """
+    A bot script, which is started in a process of its own and stopped with SIGINT
+    """
+
+    # The lines every script starts with, the configuration is passed as json
+    header = ("import json, sys\n"
+              "from samt import Bot, Context, Answer\n"
+              "bot = Bot(json.loads(sys.argv[1]))\n")
+
+    def __init__(self, directory: str, source: str, config: Dict):
+        """
+        Writes the script without starting it
+        :param directory: The directory of the script, its log and its storage
+        :param source: The handlers of the bot
+        :param config: The configuration, whose api_url is set by start
+        """
+
+        self.directory = directory
+        self.script = os.path.join(directory, "Bot.py")
+        self.config = config
+        self.process = None
+
+        with open(self.script, "w") as f:
+            f.write(self.header + source + "\nbot.listen()\n")
+
+    async def start(self, api: FakeTelegramServer) -> None:
+        """
+        Starts the bot and waits until it polls for updates
+        :param api: The stand-in of the Telegram API
+        """
+
+        config = dict(self.config, bot=dict(self.config.get("bot", {}), token="1:x", api_url=api.url))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (ROOT, os.environ.get("PYTHONPATH")))))
+
+        api.polled.clear()
+        self.process = subprocess.Popen([sys.executable, self.script, json.dumps(config)], env=env,
+                                        cwd=self.directory)
+        await asyncio.wait_for(api.polled.wait(), 20)
+
+    async def stop(self) -> None:
+        """
+        Shuts the bot down gracefully and waits for the process to end
+        """
+
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.send_signal(signal.SIGINT)
+        for _ in range(200):
+            if self.process.poll() is not None:
+                break
+            await asyncio.sleep(0.05)
+        else:
+            self.process.kill()
+        assert self.process.returncode == 0, open(os.path.join(self.directory, "Bot.log")).read()
+
+    def kill(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+
+def sent_texts(api: FakeTelegramServer) -> List[tuple]:
+    """
+    Records the messages sent by the bots
+    :param api: The stand-in of the Telegram API
+    :return: A list, to which the chat ids and texts are appended
+    """
+
+    sent = []
+    api.listeners.append(lambda method, params, result: sent.append((int(params["chat_id"]), params.get("text")))
+                         if method == "sendMessage" else None)
+    return sent
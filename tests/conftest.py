@@ -0,0 +1,30 @@
+"""
+Fixtures of the tests
+"""
+
+from typing import Dict, List
+
+import pytest
+
+from tests.common import BotProcess
+
+
+@pytest.fixture
+def bot_process(tmp_path):
+    """
+    Creates bot processes in directories of their own below the test's directory and kills those left running
+    """
+
+    processes: List[BotProcess] = []
+
+    def create(source: str, config: Dict) -> BotProcess:
+        directory = tmp_path / f"bot{len(processes)}"
+        directory.mkdir()
+        process = BotProcess(str(directory), source, config)
+        processes.append(process)
+        return process
+
+    yield create
+
+    for process in processes:
+        process.kill()
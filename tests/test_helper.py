@@ -0,0 +1,110 @@
+import random
+
+import pytest
+
+from samt.helper import AccessList, split_message
+
+
+def test_split_message_keeps_short_texts():
+    assert split_message("Hello world", 4096) == ["Hello world"]
+
+
+def test_split_message_prefers_paragraphs_and_words():
+    text = "First paragraph with some words.\n\nSecond paragraph with more words."
+    assert split_message(text, 40) == ["First paragraph with some words.", "Second paragraph with more words."]
+
+    parts = split_message("lorem ipsum dolor sit amet " * 20, 50)
+    assert all(len(part) <= 50 for part in parts)
+    assert " ".join(parts).split() == ("lorem ipsum dolor sit amet " * 20).split()
+
+
+def test_split_message_strips_and_drops_empty_parts():
+    assert split_message("   \n\n  ", 10) == []
+    assert split_message("\n\nabc" + " " * 30 + "\n\n" + "def  ", 10) == ["abc", "def"]
+
+
+def test_split_message_rejects_invalid_limits():
+    with pytest.raises(ValueError):
+        split_message("text", 0)
+
+
+def test_split_message_reopens_html():
+    parts = split_message("<b>" + "bold words " * 10 + "</b> plain", 40, "HTML")
+    assert all(len(part) <= 40 for part in parts)
+    assert all(part.startswith("<b>") for part in parts[:-1])
+    assert all(part.endswith("</b>") for part in parts[:-1])
+    assert parts[-1].endswith("plain")
+
+
+def test_split_message_does_not_break_entities_or_links():
+    parts = split_message("a &amp; " * 20, 15, "HTML")
+    assert all(part.count("&") == part.count(";") for part in parts)
+
+    parts = split_message("see [the docs](https://example.org/docs) " * 5, 45, "Markdown")
+    assert all(part.count("[") == part.count(")") for part in parts)
+
+
+def test_split_message_reopens_markdown():
+    parts = split_message("*" + "bold words " * 10 + "*", 30, "MarkdownV2")
+    assert all(len(part) <= 30 for part in parts)
+    assert all(part.startswith("*") and part.endswith("*") for part in parts)
+
+
+def test_split_message_drops_parts_with_markup_only():
+    assert split_message("<b>" + " " * 50 + "</b>text", 20, "HTML") == ["<b></b>text"]
+    assert split_message("*" + " " * 30 + "more*", 10, "Markdown") == ["*more*"]
+
+
+@pytest.mark.parametrize("markup", [None, "HTML", "Markdown", "MarkdownV2"])
+def test_split_message_fuzzed(markup):
+    rng = random.Random(markup)
+    words = ["word", "a", "longerword", "\n", "\n\n", " ", "<b>", "</b>", "<i>", "</i>", "*", "_", "`", "&amp;"]
+    for _ in range(300):
+        text = "".join(rng.choice(words) + rng.choice(("", " ")) for _ in range(rng.randint(0, 60)))
+        limit = rng.randint(12, 80)
+        for part in split_message(text, limit, markup):
+            assert 0 < len(part) <= limit
+            assert part == part.strip()
+
+
+def test_access_list_checks_ids():
+    access = AccessList(allowed=[1, 2], denied=[3])
+    assert access.is_allowed(1)
+    assert access.is_allowed(5, 2)
+    assert not access.is_allowed(5)
+    assert not access.is_allowed(1, 3)
+
+    unrestricted = AccessList(denied=[3])
+    assert unrestricted.is_allowed(5)
+    assert not unrestricted.is_allowed(3)
+
+
+def test_access_list_persists_runtime_changes_only():
+    access = AccessList(allowed=range(1000), denied=[5000])
+    access.allow(2000, 3000)
+    access.revoke(1, 3000)
+    access.deny(6000)
+    access.undeny(5000)
+
+    assert access.to_dict() == {"allow": [2000], "revoke": [1, 3000], "deny": [6000], "undeny": [5000]}
+
+
+def test_access_list_applies_changes_to_the_configuration():
+    access = AccessList(allowed=[1, 2, 3])
+    access.allow(4)
+    access.revoke(2)
+    access.deny(3)
+    changes = access.to_dict()
+
+    # The configuration changed meanwhile, its ids count unless they were changed at runtime
+    restarted = AccessList(allowed=[1, 2, 5])
+    restarted.update(changes)
+    assert restarted.allowed == {1, 4, 5}
+    assert restarted.denied == {3}
+    assert restarted.to_dict() == changes
+
+    # Without configured ids, the list is not restricted anymore
+    unrestricted = AccessList()
+    unrestricted.update(changes)
+    assert unrestricted.is_allowed(7)
+    assert not unrestricted.is_allowed(3)
@@ -0,0 +1,172 @@
+import asyncio
+import os
+
+import pytest
+from tinydb import TinyDB
+
+from samt.fakeapi import FakeTelegramServer
+from samt.fakeredis import FakeRedisServer
+from samt.helper import AccessList
+from samt.serializers import Codec
+from samt.storage import RedisStore
+from tests.common import free_port, sent_texts
+
+JOBS = """
+@bot.answer("/remind")
+def remind():
+    bot.schedule_at(Context.user(), 1.0, Answer("reminder"))
+    job = bot.schedule_at(Context.user(), 1.0, "cancelled")
+    bot.cancel_job(job)
+    return "ok"
+"""
+
+ACCESS = """
+@bot.answer("/change")
+def change():
+    bot.allow(2)
+    bot.revoke(3)
+    return "changed"
+
+@bot.answer("/hi")
+def hi():
+    return "hi"
+"""
+
+
+async def until(condition, timeout: float = 10) -> None:
+    """
+    Waits until a condition holds
+    :param condition: A function returning if it holds
+    :param timeout: The seconds after which the test fails
+    """
+
+    for _ in range(int(timeout / 0.05)):
+        if condition():
+            return
+        await asyncio.sleep(0.05)
+    raise AssertionError("The condition did not hold in time")
+
+
+def run_with_storage(storage: str, directory: str, test) -> None:
+    """
+    Runs a test with a stand-in of the Telegram API and a persistent storage
+    :param storage: Either tinydb or redis
+    :param directory: The directory of the storage file
+    :param test: A coroutine function called with the api, the configuration and a coroutine function reading a record
+    """
+
+    async def main():
+        api = FakeTelegramServer(port=free_port())
+        await api.start()
+        redis = None
+        # The state file keeps the updates, which were processed, from being received again after a restart
+        config = {"general": {"persistent_storage": True, "state_file": "state.json", "access_flush_interval": 0.1},
+                  "jobs": {"flush_interval": 0.1, "lease_duration": 1.0}}
+
+        if storage == "redis":
+            redis = FakeRedisServer(port=free_port())
+            await redis.start()
+            config["general"]["storage_file"] = redis.url
+
+            async def read(key):
+                store = RedisStore(redis.url).table("1")
+                record, = await store.load(key)
+                await store.close()
+                return record
+        else:
+            config["general"]["storage_file"] = os.path.join(directory, "db.json")
+
+            async def read(key):
+                with TinyDB(config["general"]["storage_file"]) as db:
+                    documents = [d for d in db.table("1").all() if d["user"] == key]
+                return Codec.from_document(documents[0]["storage"]) if documents else dict()
+
+        try:
+            await test(api, config, read)
+        finally:
+            await api.stop()
+            if redis is not None:
+                await redis.stop()
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("storage", ["tinydb", "redis"])
+def test_jobs_are_restored_after_a_restart(storage, tmp_path, bot_process):
+    async def test(api, config, read):
+        sent = sent_texts(api)
+        bot = bot_process(JOBS, config)
+
+        await bot.start(api)
+        api.push_message(1, "/remind")
+        await until(lambda: (1, "ok") in sent)
+        await bot.stop()
+        assert (await read("_<[jobs]>_")).get("buckets")
+
+        # The job became due while the bot was stopped
+        await asyncio.sleep(1.0)
+        await bot.start(api)
+        await until(lambda: (1, "reminder") in sent)
+        await asyncio.sleep(0.3)
+        await bot.stop()
+
+        # A job, which ran, is not restored again
+        await bot.start(api)
+        await asyncio.sleep(1.5)
+        await bot.stop()
+        assert sent == [(1, "ok"), (1, "reminder")]
+
+    run_with_storage(storage, str(tmp_path), test)
+
+
+def test_jobs_in_a_shared_storage_run_once(tmp_path, bot_process):
+    async def test(api, config, read):
+        other_api = FakeTelegramServer(port=free_port())
+        await other_api.start()
+        sent, other_sent = sent_texts(api), sent_texts(other_api)
+
+        first = bot_process(JOBS, config)
+        await first.start(api)
+        api.push_message(1, "/remind")
+        await until(lambda: (1, "ok") in sent)
+        await first.stop()
+
+        # Both processes start at once, only the one taking the lease runs the persisted job
+        second = bot_process(JOBS, config)
+        await asyncio.gather(first.start(api), second.start(other_api))
+        await until(lambda: (1, "reminder") in sent + other_sent)
+        await asyncio.sleep(1.5)
+        await asyncio.gather(first.stop(), second.stop())
+        await other_api.stop()
+        assert (sent + other_sent).count((1, "reminder")) == 1
+
+    run_with_storage("redis", str(tmp_path), test)
+
+
+@pytest.mark.parametrize("storage", ["tinydb", "redis"])
+def test_access_list_changes_are_restored_after_a_restart(storage, tmp_path, bot_process):
+    async def test(api, config, read):
+        sent = sent_texts(api)
+        config["general"]["allowed_ids"] = [1, 3]
+
+        bot = bot_process(ACCESS, config)
+        await bot.start(api)
+        api.push_message(1, "/change")
+        await until(lambda: (1, "changed") in sent)
+        await asyncio.sleep(0.3)
+        await bot.stop()
+
+        # Only the changes are stored, not the configured ids
+        assert await read(AccessList.storage_key) == {"allow": [2], "revoke": [3], "deny": [], "undeny": []}
+
+        # They are applied to the ids configured on the next start
+        config["general"]["allowed_ids"] = [1, 3, 4]
+        await bot.start(api)
+        for user in (2, 3, 4):
+            api.push_message(user, "/hi")
+        await until(lambda: (2, "hi") in sent and (4, "hi") in sent)
+        await asyncio.sleep(0.3)
+        await bot.stop()
+        assert (3, "hi") not in sent
+
+    run_with_storage(storage, str(tmp_path), test)
@@ -0,0 +1,76 @@
+import base64
+import json
+from datetime import date, datetime
+
+import pytest
+
+from samt.serializers import Codec, available_formats, zstandard
+
+COMPRESSIONS = [None, "zlib"] + (["zstd"] if zstandard is not None else [])
+
+RECORD = {
+    "name": "Ann",
+    "counter": 42,
+    "ratio": 0.5,
+    "active": True,
+    "nothing": None,
+    "visited": {"start", "help"},
+    "last_seen": datetime(2026, 10, 1, 12, 30),
+    "birthday": date(2000, 2, 29),
+    "avatar": b"\x00\x01\xff",
+    "history": [{"id": i, "sent": datetime(2026, 1, 1, 0, i), "tags": {i, i + 1}} for i in range(50)],
+    "settings": {"units": "metric", "nested": [[1, 2], {"deep": {"x"}}]},
+}
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize("format", available_formats())
+def test_codec_round_trip(format, compression):
+    codec = Codec(format, compression, min_size=0)
+    assert codec.loads(codec.dumps(RECORD)) == RECORD
+    assert codec.loads(codec.dumps({})) == {}
+
+
+@pytest.mark.parametrize("format", available_formats())
+def test_codec_reads_every_format(format):
+    written = Codec(format, "zlib", min_size=0).dumps(RECORD)
+    for other in available_formats():
+        assert Codec(other).loads(written) == RECORD
+
+
+def test_codec_compresses_large_records_only():
+    codec = Codec("json", "zlib", min_size=1024)
+    small, large = codec.dumps({"a": 1}), codec.dumps(RECORD)
+    assert b'"a"' in small
+    assert len(large) < len(Codec("json").dumps(RECORD))
+    assert codec.loads(small) == {"a": 1}
+    assert codec.loads(large) == RECORD
+
+
+def test_codec_reads_plain_json_of_earlier_versions():
+    assert Codec("json").loads(json.dumps({"a": [1, 2]}).encode()) == {"a": [1, 2]}
+
+
+def test_codec_rejects_unknown_settings():
+    with pytest.raises(ValueError):
+        Codec("yaml")
+    with pytest.raises(ValueError):
+        Codec("json", "lzma")
+    with pytest.raises(ValueError):
+        Codec().loads(Codec().dumps({})[:2] + bytes((99, 1, 0)) + b"{}")
+
+
+def test_codec_documents_stay_plain_json():
+    document = Codec.to_document(RECORD)
+
+    # The document is embedded as it is, e.g. into a TinyDB database
+    text = json.dumps(document)
+    assert '"name": "Ann"' in text
+    assert Codec.from_document(json.loads(text)) == RECORD
+    assert Codec.to_document({"a": [1, "b"]}) == {"a": [1, "b"]}
+
+
+def test_codec_reads_embedded_envelopes_of_earlier_versions():
+    codec = Codec("msgpack")
+    text = base64.b64encode(codec.dumps(RECORD)).decode()
+    assert Codec().loads_text(text) == RECORD
@@ -0,0 +1,134 @@
+import asyncio
+from datetime import datetime
+
+from samt.fakeredis import FakeRedisServer
+from samt.serializers import Codec
+from samt.storage import RedisStore
+from tests.common import free_port
+
+
+def run_with_redis(test, *codecs: Codec):
+    """
+    Runs a test with two stores sharing a local stand-in of Redis, like two processes would
+    :param test: A coroutine function called with the server and the stores
+    :param codecs: The codecs of the stores
+    """
+
+    async def main():
+        server = FakeRedisServer(port=free_port())
+        await server.start()
+        stores = [RedisStore(server.url, codec=codecs[i] if i < len(codecs) else None) for i in range(2)]
+        try:
+            await test(server, *stores)
+        finally:
+            for store in stores:
+                await store.close()
+            await server.stop()
+
+    asyncio.run(main())
+
+
+def test_redis_store_shares_records():
+    async def test(server, first, second):
+        record, = await first.load(1)
+        record.update(name="Ann", seen=datetime(2026, 10, 1), tags={"a"})
+        first.put(1, record)
+        await first.flush()
+
+        assert await second.load(1) == [{"name": "Ann", "seen": datetime(2026, 10, 1), "tags": {"a"}}]
+        assert second.cached(1)["name"] == "Ann"
+        assert (await second.load(2))[0] == {}
+
+    run_with_redis(test, Codec("msgpack", "zlib", min_size=0), Codec("json"))
+
+
+def test_redis_store_detects_lost_updates():
+    async def test(server, first, second):
+        (a,), (b,) = await first.load(1), await second.load(1)
+
+        a["counter"] = 1
+        first.put(1, a)
+        await first.flush()
+
+        # The second change is based on the version read before the first one
+        b["counter"] = 2
+        second.put(1, b)
+        await second.flush()
+        assert second.conflicts == 1
+        assert first.conflicts == 0
+
+        # The dropped change is read anew and can be applied to the current record
+        record, = await second.load(1)
+        assert record == {"counter": 1}
+        record["counter"] += 1
+        second.put(1, record)
+        await second.flush()
+        assert second.conflicts == 1
+        third = RedisStore(server.url)
+        assert (await third.load(1))[0] == {"counter": 2}
+        await third.close()
+
+    run_with_redis(test)
+
+
+def test_redis_store_skips_unchanged_records():
+    async def test(server, first, second):
+        record, = await first.load(1)
+        record["counter"] = 1
+        first.put(1, record)
+        await first.flush()
+        stored = dict(server.data)
+
+        # Putting a record unchanged writes nothing
+        commands = server.commands
+        first.put(1, record)
+        await first.flush()
+        assert server.commands == commands
+        assert server.data == stored
+
+        # So another process's change based on the same version succeeds
+        other, = await second.load(1)
+        record["counter"] = 1
+        first.put(1, record)
+        await first.flush()
+        other["counter"] = 5
+        second.put(1, other)
+        await second.flush()
+        assert second.conflicts == 0
+
+    run_with_redis(test)
+
+
+def test_redis_store_tables_and_reserved_records():
+    async def test(server, first, second):
+        table = first.table("other")
+        table.cache_size = 2
+        for key in ("_<[jobs]>_", 1, 2, 3):
+            record, = await table.load(key)
+            record["key"] = str(key)
+            table.put(key, record)
+        await table.flush()
+        await table.close()
+
+        assert all(key.startswith(b"samt:other:") for key in server.data if b"changes" not in key)
+        assert (await second.load(1))[0] == {}
+
+        # Records of the framework stay cached
+        assert "_<[jobs]>_" in table.recent()
+        assert len(table.recent()) == 2
+
+    run_with_redis(test)
+
+
+def test_redis_store_leases():
+    async def test(server, first, second):
+        assert await first.lease("_<[lease]>_", "first", 0.3)
+        assert not await second.lease("_<[lease]>_", "second", 0.3)
+
+        # Renewing keeps the lease, expiring hands it over
+        assert await first.lease("_<[lease]>_", "first", 0.3)
+        await asyncio.sleep(0.4)
+        assert await second.lease("_<[lease]>_", "second", 0.3)
+        assert not await first.lease("_<[lease]>_", "first", 0.3)
+
+    run_with_redis(test)